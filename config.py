@@ -1,9 +1,9 @@
 import os
+import tempfile
 from pathlib import Path
 
 from dotenv import load_dotenv
 
-
 base_dir = Path(__file__).resolve().parent
 env_file = base_dir / ".env"
 load_dotenv(env_file)
@@ -16,13 +16,56 @@ class Config:
     SQLALCHEMY_TRACK_MODIFICATIONS = False
     JWT_EXPIRED_MINUTES = 30
     PER_PAGE = 5
+    BULK_MAX_ITEMS = 500
+    BATCH_MAX_REQUESTS = 20
+    REQUIRE_IF_MATCH = False
+    IDEMPOTENCY_KEY_TTL = 24 * 60 * 60
+    IDEMPOTENCY_LOCK_TIMEOUT = 10
+    SETTLEMENT_GROUP_COMMIT = False
+    SETTLEMENT_GROUP_COMMIT_WINDOW = 0.005
+    SETTLEMENT_GROUP_COMMIT_MAX_SIZE = 200
+    SETTLEMENT_GROUP_COMMIT_TIMEOUT = 10
     CORS_HEADERS = "Content-Type"
     ALLOWED_EXTENSIONS = {"jpg", "jpeg", "png", "gif"}
     MAX_CONTENT_LENGTH = 2 * 1024 * 1024
+    PICTURE_CONTENT_TYPES = {"image/jpeg", "image/png", "image/gif"}
+    PICTURE_UPLOAD_MAX_SIZE = 10 * 1024 * 1024
+    PICTURE_UPLOAD_URL_EXPIRES = 10 * 60
+    PICTURE_VARIANTS = {"thumbnail": 160, "medium": 640, "large": 1280}
+    PICTURE_VARIANTS_QUALITY = 85
+    PICTURE_VARIANTS_WORKERS = 2
+    PICTURE_UPLOAD_WORKERS = 4
+    PICTURE_BULK_MAX_FILES = 20
+    PICTURE_UPLOAD_RETRIES = 3
+    PICTURE_UPLOAD_RETRY_DELAY = 1
+    PICTURE_SPOOL_FOLDER = os.path.join(tempfile.gettempdir(), "myrent_spool")
     S3_BUCKET = os.environ.get("S3_BUCKET")
     AWS_ACCESS_KEY_ID = os.environ.get("AWS_ACCESS_KEY_ID")
     AWS_SECRET_ACCESS_KEY = os.environ.get("AWS_SECRET_ACCESS_KEY")
+    S3_REGION = os.environ.get("S3_REGION")
+    S3_ENDPOINT_URL = os.environ.get("S3_ENDPOINT_URL")
+    S3_MAX_POOL_CONNECTIONS = 50
+    S3_TCP_KEEPALIVE = True
+    S3_RETRY_MODE = "standard"
+    S3_MAX_ATTEMPTS = 5
+    S3_MULTIPART_THRESHOLD = 8 * 1024 * 1024
+    S3_MULTIPART_CHUNKSIZE = 8 * 1024 * 1024
+    S3_MAX_CONCURRENCY = 10
+    S3_DELETE_BATCH_SIZE = 1000
+    S3_DELETE_WORKERS = 8
+    S3_PRIVATE = os.environ.get("S3_PRIVATE") == "1"
+    S3_PRESIGNED_URL_EXPIRES = 60 * 60
+    S3_PRESIGNED_URL_MIN_TTL = 10 * 60
+    S3_PRESIGNED_URL_CACHE_SIZE = 100000
     SAMPLES_FOLDER = os.path.join(base_dir, "samples")
+    STORAGE_BACKEND = os.environ.get("STORAGE_BACKEND") or "s3"
+    STORAGE_LOCAL_FOLDER = os.environ.get("STORAGE_LOCAL_FOLDER") or os.path.join(
+        base_dir, "uploads"
+    )
+    STORAGE_LOCAL_URL = os.environ.get("STORAGE_LOCAL_URL") or f"/api/{VERSION}/storage"
+    STORAGE_LOCAL_ACCEL_REDIRECT = os.environ.get("STORAGE_LOCAL_ACCEL_REDIRECT")
+    STORAGE_CACHE_MAX_AGE = 365 * 24 * 60 * 60
+    USE_X_SENDFILE = os.environ.get("USE_X_SENDFILE") == "1"
 
 
 class DevelopmentConfig(Config):
@@ -34,6 +77,7 @@ class TestingConfig(Config):
     SQLALCHEMY_DATABASE_URI = f"sqlite:///{DB_FILE_PATH}"
     DEBUG = True
     TESTING = True
+    STORAGE_BACKEND = "local"
 
 
 class ProductionConfig(Config):
@@ -0,0 +1,52 @@
+"""empty message
+
+Revision ID: 4a7e91c3d2f8
+Revises: e2b6c8d1f357
+Create Date: 2026-10-19 19:24:53.871402
+
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = "4a7e91c3d2f8"
+down_revision = "e2b6c8d1f357"
+branch_labels = None
+depends_on = None
+
+# (table, column, referred table)
+CASCADE_FOREIGN_KEYS = [
+    ("pictures", "flat_id", "flats"),
+    ("agreements", "flat_id", "flats"),
+    ("agreements", "tenant_id", "tenants"),
+    ("settlements", "agreement_id", "agreements"),
+    ("overdues", "agreement_id", "agreements"),
+]
+
+
+def _recreate_foreign_key(table, column, referred_table, ondelete):
+    # foreign keys were created without names, so the names given
+    # by the database (MySQL and PostgreSQL differ) are read from it
+    inspector = sa.inspect(op.get_bind())
+    for foreign_key in inspector.get_foreign_keys(table):
+        if foreign_key["constrained_columns"] == [column]:
+            op.drop_constraint(foreign_key["name"], table, type_="foreignkey")
+    op.create_foreign_key(
+        f"fk_{table}_{column}_{referred_table}",
+        table,
+        referred_table,
+        [column],
+        ["id"],
+        ondelete=ondelete,
+    )
+
+
+def upgrade():
+    for table, column, referred_table in CASCADE_FOREIGN_KEYS:
+        _recreate_foreign_key(table, column, referred_table, "CASCADE")
+
+
+def downgrade():
+    for table, column, referred_table in CASCADE_FOREIGN_KEYS:
+        _recreate_foreign_key(table, column, referred_table, None)
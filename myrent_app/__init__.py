@@ -18,6 +18,7 @@ def create_app(config_name="development"):
     migrate.init_app(app, db)
 
     from myrent_app.agreements import agreements_bp
+    from myrent_app.batch import batch_bp
     from myrent_app.commands import db_manage_bp
     from myrent_app.errors import errors_bp
     from myrent_app.flats import flats_bp
@@ -32,6 +33,7 @@ def create_app(config_name="development"):
     app.register_blueprint(agreements_bp, url_prefix=f"/api/{version}")
     app.register_blueprint(settlements_bp, url_prefix=f"/api/{version}")
     app.register_blueprint(pictures_bp, url_prefix=f"/api/{version}")
+    app.register_blueprint(batch_bp, url_prefix=f"/api/{version}")
     app.register_blueprint(errors_bp)
     app.register_blueprint(db_manage_bp)
 
@@ -12,6 +12,11 @@ from myrent_app.models import (
     agreement_schema,
 )
 from myrent_app.utils import (
+    check_if_match,
+    commit_without_expire,
+    get_write_response,
+    idempotent,
+    set_version_etag,
     token_landlord_required,
     token_landlord_tenant_required,
     validate_json_content_type,
@@ -54,13 +59,16 @@ def get_agreement(id_model_tuple: tuple, agreement_id: int):
     if id_model_tuple[1] == "tenants" and agreement.tenant_id != id_model_tuple[0]:
         abort(404, description=f"Agreement with id {agreement_id} not found")
 
-    return jsonify({"success": True, "data": agreement_schema.dump(agreement)})
+    response = jsonify({"success": True, "data": agreement_schema.dump(agreement)})
+
+    return set_version_etag(response, agreement)
 
 
 @agreements_bp.route(
     "/flats/<int:flat_id>/tenants/<int:tenant_id>/agreements", methods=["POST"]
 )
 @token_landlord_required
+@idempotent
 @validate_json_content_type
 @use_args(AgreementSchema(exclude=["flat_id", "tenant_id"]), error_status_code=400)
 def create_agreement(landlord_id: int, args: dict, flat_id: int, tenant_id: int):
@@ -77,21 +85,18 @@ def create_agreement(landlord_id: int, args: dict, flat_id: int, tenant_id: int)
     if tenant.landlord_id != landlord_id:
         abort(404, description=f"Tenant with id {tenant_id} not found")
 
-    agreement_with_identifier = Agreement.query.filter(
-        Agreement.identifier == args["identifier"]
-    ).first()
-    if agreement_with_identifier is not None:
-        abort(
-            409,
-            description=f'Agreement with identifier {args["identifier"]} already exists',
-        )
-
     agreement = Agreement(flat_id=flat_id, tenant_id=tenant_id, **args)
 
     db.session.add(agreement)
-    db.session.commit()
-
-    return jsonify({"success": True, "data": agreement_schema.dump(agreement)}), 201
+    commit_without_expire()
+
+    return get_write_response(
+        agreement_schema,
+        agreement,
+        "agreements.get_agreement",
+        201,
+        agreement_id=agreement.id,
+    )
 
 
 @agreements_bp.route("/agreements/<int:agreement_id>", methods=["PUT"])
@@ -105,18 +110,7 @@ def update_agreement(landlord_id: int, args: dict, agreement_id: int):
 
     if agreement.flat.landlord_id != landlord_id:
         abort(404, description=f"Agreement with id {agreement_id} not found")
-
-    agreement_with_this_identifier = Agreement.query.filter(
-        Agreement.identifier == args["identifier"]
-    ).first()
-    if (
-        agreement_with_this_identifier is not None
-        and agreement_with_this_identifier.identifier != args["identifier"]
-    ):
-        abort(
-            409,
-            description=f'Agreement with identifier {args["identifier"]} already exists',
-        )
+    check_if_match(agreement)
 
     agreement.identifier = args["identifier"]
     agreement.sign_date = args["sign_date"]
@@ -134,9 +128,14 @@ def update_agreement(landlord_id: int, args: dict, agreement_id: int):
     if description is not None:
         agreement.description = description
 
-    db.session.commit()
+    commit_without_expire()
 
-    return jsonify({"success": True, "data": agreement_schema.dump(agreement)})
+    return get_write_response(
+        agreement_schema,
+        agreement,
+        "agreements.get_agreement",
+        agreement_id=agreement.id,
+    )
 
 
 @agreements_bp.route("/agreements/<int:agreement_id>", methods=["DELETE"])
@@ -148,10 +147,20 @@ def delete_agreement(landlord_id: int, agreement_id: int):
 
     if agreement.flat.landlord_id != landlord_id:
         abort(404, description=f"Agreement with id {agreement_id} not found")
+    check_if_match(agreement)
 
-    db.session.delete(agreement)
+    deleted = Agreement.delete_all(
+        Agreement.id == agreement_id, Agreement.version == agreement.version
+    )
+    if not deleted["agreements"]:
+        db.session.rollback()
+        abort(412, description="Resource has been modified (ETag does not match)")
     db.session.commit()
 
     return jsonify(
-        {"success": True, "data": f"Agreement with id {agreement_id} has been deleted"}
+        {
+            "success": True,
+            "data": f"Agreement with id {agreement_id} has been deleted",
+            "deleted": deleted,
+        }
     )
@@ -0,0 +1,138 @@
+from contextlib import contextmanager
+from typing import Optional
+
+from flask import abort, current_app, g, jsonify, request
+from webargs.flaskparser import use_args
+from werkzeug.test import EnvironBuilder
+
+from myrent_app import db
+from myrent_app.batch import batch_bp
+from myrent_app.models import batch_schema
+from myrent_app.utils import validate_json_content_type
+
+
+@contextmanager
+def _deferred_commit():
+    """
+    Makes db.session.commit() in handlers only flush changes, so that all
+    sub-requests share one transaction committed or rolled back at the end
+    """
+    session = db.session()
+    previous_commit = vars(session).get("commit")
+    previous_deferred_commit = g.get("deferred_commit")
+    session.commit = session.flush
+    g.deferred_commit = True
+    try:
+        yield
+    finally:
+        if previous_commit is None:
+            del session.commit
+        else:
+            session.commit = previous_commit
+        if previous_deferred_commit is None:
+            g.pop("deferred_commit")
+        else:
+            g.deferred_commit = previous_deferred_commit
+
+
+@contextmanager
+def _batch_running():
+    """Marks that sub-requests of a batch are dispatched"""
+    previous_batch = g.get("batch")
+    g.batch = True
+    try:
+        yield
+    finally:
+        g.batch = previous_batch
+
+
+def _get_endpoint(sub_request: dict) -> Optional[str]:
+    """
+    Returns endpoint of the route matched by the sub-request path (after
+    decoding and normalization, like the dispatch of the sub-request)
+    """
+    builder = EnvironBuilder(
+        path=sub_request["path"],
+        method=sub_request["method"],
+        base_url=request.host_url,
+    )
+    try:
+        with current_app.request_context(builder.get_environ()):
+            return request.endpoint
+    finally:
+        builder.close()
+
+
+def _dispatch(sub_request: dict) -> dict:
+    headers = {}
+    if request.headers.get("Authorization"):
+        headers["Authorization"] = request.headers["Authorization"]
+
+    builder = EnvironBuilder(
+        path=sub_request["path"],
+        method=sub_request["method"],
+        json=sub_request.get("body"),
+        headers=headers,
+        base_url=request.host_url,
+    )
+    try:
+        with current_app.request_context(builder.get_environ()):
+            response = current_app.full_dispatch_request()
+    except Exception as exc:
+        print("Exception batch request: ", exc)
+        return {"status": 500, "body": None}
+    finally:
+        builder.close()
+
+    result = {
+        "status": response.status_code,
+        "body": response.get_json() if response.is_json else None,
+    }
+    if "Location" in response.headers:
+        result["location"] = response.headers["Location"]
+    response.close()
+    return result
+
+
+@batch_bp.route("/batch", methods=["POST"])
+@validate_json_content_type
+@use_args(batch_schema, error_status_code=400)
+def batch_requests(args: dict):
+    """
+    Runs sub-requests (method, path, body) one by one with the caller's
+    Authorization header and returns all responses. With atomic=true
+    all sub-requests share one transaction which is rolled back and
+    the batch is stopped at the first failed sub-request.
+    """
+    max_requests = current_app.config.get("BATCH_MAX_REQUESTS", 20)
+    if len(args["requests"]) > max_requests:
+        abort(400, description=f"Too many requests (maximum {max_requests})")
+
+    if g.get("batch") or any(
+        _get_endpoint(item) == "batch.batch_requests" for item in args["requests"]
+    ):
+        abort(400, description="Batch requests can not be nested")
+
+    responses = []
+    if args["atomic"]:
+        with _batch_running(), _deferred_commit():
+            for sub_request in args["requests"]:
+                responses.append(_dispatch(sub_request))
+                if responses[-1]["status"] >= 400:
+                    break
+        success = responses[-1]["status"] < 400
+        if success:
+            db.session.commit()
+        else:
+            db.session.rollback()
+    else:
+        with _batch_running():
+            for sub_request in args["requests"]:
+                responses.append(_dispatch(sub_request))
+                if responses[-1]["status"] >= 400:
+                    db.session.rollback()
+        success = all(response["status"] < 400 for response in responses)
+
+    return jsonify(
+        {"success": success, "data": responses, "number_of_records": len(responses)}
+    )
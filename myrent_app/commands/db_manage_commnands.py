@@ -1,20 +1,31 @@
 import json
 import mimetypes
 import os
-from datetime import datetime
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from datetime import datetime, timedelta
 
-import boto3
+import click
 from flask import current_app
 
 from myrent_app import db
 from myrent_app.commands import db_manage_bp
-from myrent_app.models import Agreement, Flat, Landlord, Picture, Settlement, Tenant
-from myrent_app.utils import (
-    allowed_picture,
-    delete_all_files_from_s3,
-    generate_hashed_password,
-    upload_file_to_s3,
+from myrent_app.commands.generator import generate_data
+from myrent_app.models import (
+    Agreement,
+    Flat,
+    IdempotencyKey,
+    Landlord,
+    Picture,
+    Settlement,
+    Tenant,
 )
+from myrent_app.pictures.reconcile import reconcile_storage as reconcile_picture_storage
+from myrent_app.settlements.charges import generate_charges as generate_period_charges
+from myrent_app.settlements.group_commit import commit_settlement
+from myrent_app.settlements.overdue import detect_overdues
+from myrent_app.storage import get_storage
+from myrent_app.utils import allowed_picture, generate_hashed_password
 
 
 def load_json_data(filename: str) -> list:
@@ -26,7 +37,7 @@ def load_json_data(filename: str) -> list:
 
 def get_picture_samples():
     result = []
-    for file in os.listdir(current_app.config["SAMPLES_FOLDER"]):
+    for file in sorted(os.listdir(current_app.config["SAMPLES_FOLDER"])):
         if allowed_picture(file):
             result.append(os.path.join(current_app.config["SAMPLES_FOLDER"], file))
     return result
@@ -38,73 +49,95 @@ def db_manage():
     pass
 
 
+def _hash_passwords(items: list, workers: int) -> None:
+    """Hashes passwords of the items in a pool of processes"""
+    if not items:
+        return
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        hashed_passwords = executor.map(
+            generate_hashed_password,
+            [item["password"] for item in items],
+            chunksize=max(1, len(items) // (4 * workers)),
+        )
+        with click.progressbar(
+            hashed_passwords, length=len(items), label="Hashing passwords"
+        ) as bar:
+            for item, hashed_password in zip(items, bar):
+                item["password"] = hashed_password
+
+
+def _parse_dates(items: list, *fields: str) -> list:
+    for item in items:
+        for field in fields:
+            item[field] = datetime.strptime(item[field], "%d-%m-%Y").date()
+    return items
+
+
+def _save_picture_samples(pictures_list: list) -> list:
+    """
+    Saves sample pictures (one for every flat) in the storage on
+    PICTURE_UPLOAD_WORKERS threads, returns rows of the pictures
+    """
+    app = current_app._get_current_object()
+    storage = get_storage()
+
+    def save_picture(flat_id: int, pic: str) -> dict:
+        file_name = f"flat{flat_id}_{os.path.split(pic)[1]}"
+        with app.app_context():
+            file_url = storage.save_file(pic, file_name, mimetypes.guess_type(pic)[0])
+        return {
+            "name": file_name,
+            "description": f"Description for {file_name}",
+            "path": file_url,
+            "flat_id": flat_id,
+        }
+
+    with ThreadPoolExecutor(
+        max_workers=app.config.get("PICTURE_UPLOAD_WORKERS")
+    ) as executor:
+        pictures = executor.map(
+            save_picture, range(1, len(pictures_list) + 1), pictures_list
+        )
+        with click.progressbar(
+            pictures,
+            length=len(pictures_list),
+            label=f"Uploading pictures to {storage.name} storage",
+        ) as bar:
+            return list(bar)
+
+
 @db_manage.command()
-def add_data():
-    """Add sample data to the database and AWS S3"""
+@click.option(
+    "--workers",
+    default=os.cpu_count(),
+    help="Number of processes hashing passwords",
+)
+def add_data(workers: int):
+    """Add sample data to the database and the storage"""
     try:
-        data_json = load_json_data("landlords.json")
-        for item in data_json:
-            item["password"] = generate_hashed_password(item["password"])
-            landlord = Landlord(**item)
-            db.session.add(landlord)
-
-        data_json = load_json_data("flats.json")
-        for item in data_json:
-            flat = Flat(**item)
-            db.session.add(flat)
-
-        data_json = load_json_data("tenants.json")
-        for item in data_json:
-            item["password"] = generate_hashed_password(item["password"])
-            tenant = Tenant(**item)
-            db.session.add(tenant)
-
-        data_json = load_json_data("agreements.json")
-        for item in data_json:
-            item["sign_date"] = datetime.strptime(item["sign_date"], "%d-%m-%Y").date()
-            item["date_from"] = datetime.strptime(item["date_from"], "%d-%m-%Y").date()
-            item["date_to"] = datetime.strptime(item["date_to"], "%d-%m-%Y").date()
-            agreement = Agreement(**item)
-            db.session.add(agreement)
-
-        data_json = load_json_data("settlements.json")
-        for item in data_json:
-            item["date"] = datetime.strptime(item["date"], "%d-%m-%Y").date()
-            settlement = Settlement(**item)
-            db.session.add(settlement)
+        landlords = load_json_data("landlords.json")
+        tenants = load_json_data("tenants.json")
+        _hash_passwords(landlords + tenants, workers)
+
+        db.session.bulk_insert_mappings(Landlord, landlords)
+        db.session.bulk_insert_mappings(Flat, load_json_data("flats.json"))
+        db.session.bulk_insert_mappings(Tenant, tenants)
+        db.session.bulk_insert_mappings(
+            Agreement,
+            _parse_dates(
+                load_json_data("agreements.json"), "sign_date", "date_from", "date_to"
+            ),
+        )
+        db.session.bulk_insert_mappings(
+            Settlement, _parse_dates(load_json_data("settlements.json"), "date")
+        )
 
         pictures_list = get_picture_samples()
         if pictures_list:
-            bucket_name = current_app.config.get("S3_BUCKET")
-            flat_id = 0
-
-            s3 = boto3.client(
-                "s3",
-                aws_access_key_id=current_app.config.get("AWS_ACCESS_KEY_ID"),
-                aws_secret_access_key=current_app.config.get("AWS_SECRET_ACCESS_KEY"),
+            db.session.bulk_insert_mappings(
+                Picture, _save_picture_samples(pictures_list)
             )
 
-            for pic in pictures_list:
-                flat_id += 1
-                file_name = f"flat{flat_id}_{os.path.split(pic)[1]}"
-                file_type = mimetypes.guess_type(pic)[0]
-
-                s3.upload_file(
-                    pic,
-                    bucket_name,
-                    file_name,
-                    ExtraArgs={"ACL": "public-read", "ContentType": file_type},
-                )
-                print(f"Uploading file {file_name} to s3 bucket {bucket_name}")
-
-                picture = Picture(
-                    name=file_name,
-                    description=f"Description for {file_name}",
-                    path=f"http://{bucket_name}.s3.amazonaws.com/{file_name}",
-                    flat_id=flat_id,
-                )
-                db.session.add(picture)
-
         db.session.commit()
         print("Data has been added to database")
     except Exception as exc:
@@ -113,7 +146,7 @@ def add_data():
 
 @db_manage.command()
 def remove_data_mysql():
-    """Remove all data from the MySQL database and from AWS S3"""
+    """Remove all data from the MySQL database and from the storage"""
     try:
         db.session.execute("DELETE FROM pictures")
         db.session.execute("ALTER TABLE pictures AUTO_INCREMENT=1")
@@ -131,11 +164,7 @@ def remove_data_mysql():
 
         print("All data has been deleted from database")
 
-        result_info = delete_all_files_from_s3(
-            current_app.config["S3_BUCKET"],
-            current_app.config["AWS_ACCESS_KEY_ID"],
-            current_app.config["AWS_SECRET_ACCESS_KEY"],
-        )
+        result_info = get_storage().delete_all()
         print(result_info)
 
     except Exception as exc:
@@ -144,7 +173,7 @@ def remove_data_mysql():
 
 @db_manage.command()
 def remove_data_postgres():
-    """Remove all data from the database and from AWS S3"""
+    """Remove all data from the database and from the storage"""
     try:
         db.session.execute("DELETE FROM pictures;")
         db.session.execute("ALTER SEQUENCE pictures_id_seq RESTART WITH 1;")
@@ -162,12 +191,165 @@ def remove_data_postgres():
 
         print("All data has been deleted from database")
 
-        result_info = delete_all_files_from_s3(
-            current_app.config["S3_BUCKET"],
-            current_app.config["AWS_ACCESS_KEY_ID"],
-            current_app.config["AWS_SECRET_ACCESS_KEY"],
-        )
+        result_info = get_storage().delete_all()
         print(result_info)
 
     except Exception as exc:
         print(f"Unexpected error: {exc}")
+
+
+@db_manage.command()
+@click.option("--period", required=True, help="Period in format YYYY-MM")
+@click.option("--shard", default=0, help="Number of this process shard")
+@click.option("--shards", default=1, help="Number of all process shards")
+@click.option("--batch-size", default=1000, help="Number of rows in one INSERT")
+def generate_charges(period: str, shard: int, shards: int, batch_size: int):
+    """Generate charges for all active agreements for the given period"""
+    try:
+        number_of_charges = generate_period_charges(
+            period, shard=shard, shards=shards, batch_size=batch_size
+        )
+        print(f"{number_of_charges} charges for period {period} have been generated")
+    except Exception as exc:
+        print(f"Unexpected error: {exc}")
+
+
+@db_manage.command()
+@click.option("--period", required=True, help="Period in format YYYY-MM")
+def detect_overdue(period: str):
+    """Store agreements with charges not paid until the payment deadline"""
+    try:
+        number_of_overdues = detect_overdues(period)
+        print(f"{number_of_overdues} overdue agreements found for period {period}")
+    except Exception as exc:
+        print(f"Unexpected error: {exc}")
+
+
+@db_manage.command()
+def clean_idempotency_keys():
+    """Remove stored idempotency keys older than IDEMPOTENCY_KEY_TTL"""
+    try:
+        ttl = timedelta(seconds=current_app.config["IDEMPOTENCY_KEY_TTL"])
+        number_of_keys = IdempotencyKey.query.filter(
+            IdempotencyKey.created < datetime.utcnow() - ttl
+        ).delete(synchronize_session=False)
+        db.session.commit()
+        print(f"{number_of_keys} expired idempotency keys have been removed")
+    except Exception as exc:
+        print(f"Unexpected error: {exc}")
+
+
+@db_manage.command()
+@click.option("--dry-run", is_flag=True, help="Only report the differences")
+@click.option(
+    "--min-age",
+    default=24 * 60 * 60,
+    help="Seconds after which files without pictures are orphaned",
+)
+@click.option("--batch-size", default=100, help="Number of files deleted at once")
+@click.option("--pause", default=1.0, help="Seconds of pause between deletions")
+@click.option("--chunk-size", default=1000, help="Number of rows read at once")
+def reconcile_storage(
+    dry_run: bool, min_age: int, batch_size: int, pause: float, chunk_size: int
+):
+    """Remove files without pictures and mark pictures without files as failed"""
+    try:
+        counts = reconcile_picture_storage(
+            dry_run=dry_run,
+            min_age=min_age,
+            batch_size=batch_size,
+            pause=pause,
+            chunk_size=chunk_size,
+        )
+        print(
+            f"{counts['orphaned']} orphaned files ({counts['deleted']} deleted, "
+            f"{counts['recent']} recent skipped), {counts['missing']} missing files "
+            f"({counts['failed']} pictures marked as failed)"
+        )
+    except Exception as exc:
+        print(f"Unexpected error: {exc}")
+
+
+@db_manage.command()
+@click.option("--landlords", required=True, type=int, help="Number of landlords")
+@click.option(
+    "--flats-per-landlord", default=10, help="Number of flats of every landlord"
+)
+@click.option("--months", default=24, help="Number of months with agreements")
+@click.option("--start-period", default="2020-01", help="First month (YYYY-MM)")
+@click.option("--seed", default=0, help="Seed of the random generator")
+@click.option("--password", default="password", help="Password of all users")
+@click.option("--batch-size", default=10000, help="Number of rows written at once")
+def generate(
+    landlords: int,
+    flats_per_landlord: int,
+    months: int,
+    start_period: str,
+    seed: int,
+    password: str,
+    batch_size: int,
+):
+    """Generate large synthetic data set for load testing"""
+    try:
+        start = time.perf_counter()
+        with click.progressbar(length=landlords, label="Generating data") as bar:
+            counts = generate_data(
+                landlords,
+                flats_per_landlord,
+                months,
+                start_period=start_period,
+                seed=seed,
+                password=password,
+                batch_size=batch_size,
+                progress=lambda: bar.update(1),
+            )
+        duration = time.perf_counter() - start
+        for table_name, number_of_rows in counts.items():
+            print(f"{number_of_rows} rows have been added to {table_name}")
+        print(f"Data has been generated in {duration:.1f}s")
+    except Exception as exc:
+        print(f"Unexpected error: {exc}")
+
+
+def _post_settlements(agreement_id: int, count: int, threads: int) -> float:
+    app = current_app._get_current_object()
+    values = {
+        "agreement_id": agreement_id,
+        "type": "payment",
+        "value": 1,
+        "description": "benchmark",
+    }
+
+    def post_settlement(_):
+        with app.app_context():
+            commit_settlement(dict(values))
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        list(executor.map(post_settlement, range(count)))
+    return time.perf_counter() - start
+
+
+@db_manage.command()
+@click.option("--agreement-id", required=True, type=int, help="Agreement id")
+@click.option("--count", default=1000, help="Number of settlements per run")
+@click.option("--threads", default=16, help="Number of concurrent requests")
+def benchmark_settlements(agreement_id: int, count: int, threads: int):
+    """Compare settlement inserts with one commit per request and group-commit"""
+    group_commit = current_app.config["SETTLEMENT_GROUP_COMMIT"]
+    try:
+        for enabled in [False, True]:
+            current_app.config["SETTLEMENT_GROUP_COMMIT"] = enabled
+            seconds = _post_settlements(agreement_id, count, threads)
+            mode = "group-commit" if enabled else "commit per request"
+            print(f"{mode}: {count} settlements in {seconds:.2f}s", end=" ")
+            print(f"({count / seconds:.0f}/s)")
+
+        Settlement.query.filter(Settlement.agreement_id == agreement_id).filter(
+            Settlement.description == "benchmark"
+        ).delete(synchronize_session=False)
+        db.session.commit()
+    except Exception as exc:
+        print(f"Unexpected error: {exc}")
+    finally:
+        current_app.config["SETTLEMENT_GROUP_COMMIT"] = group_commit
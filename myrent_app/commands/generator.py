@@ -0,0 +1,390 @@
+import calendar
+import csv
+import io
+import random
+from collections import Counter
+from datetime import datetime, timedelta
+from typing import Dict, List
+
+from sqlalchemy import Table
+
+from myrent_app import db
+from myrent_app.models import Agreement, Flat, Landlord, Settlement, Tenant
+from myrent_app.utils import generate_hashed_password
+
+FIRST_NAMES = [
+    "Adam",
+    "Anna",
+    "Barbara",
+    "Jan",
+    "Katarzyna",
+    "Krzysztof",
+    "Magdalena",
+    "Marek",
+    "Maria",
+    "Michał",
+    "Monika",
+    "Paweł",
+    "Piotr",
+    "Tomasz",
+    "Zofia",
+]
+LAST_NAMES = [
+    "Kowalski",
+    "Nowak",
+    "Wiśniewski",
+    "Wójcik",
+    "Kowalczyk",
+    "Kamiński",
+    "Lewandowski",
+    "Zieliński",
+    "Szymański",
+    "Woźniak",
+    "Dąbrowski",
+    "Mazur",
+]
+STREETS = [
+    "Andersena",
+    "Długa",
+    "Kwiatowa",
+    "Leśna",
+    "Lipowa",
+    "Mostnika",
+    "Ogrodowa",
+    "Polna",
+    "Słoneczna",
+    "Szkolna",
+    "Warszawska",
+    "Zielona",
+]
+CITIES = ["Gdańsk", "Kraków", "Łódź", "Poznań", "Słupsk", "Warszawa", "Wrocław"]
+
+LANDLORD_COLUMNS = [
+    "id",
+    "identifier",
+    "email",
+    "first_name",
+    "last_name",
+    "phone",
+    "address",
+    "description",
+    "password",
+    "created",
+]
+FLAT_COLUMNS = [
+    "id",
+    "identifier",
+    "address",
+    "description",
+    "status",
+    "landlord_id",
+    "created",
+    "version",
+]
+TENANT_COLUMNS = [
+    "id",
+    "identifier",
+    "email",
+    "first_name",
+    "last_name",
+    "phone",
+    "address",
+    "description",
+    "password",
+    "landlord_id",
+    "created",
+    "version",
+]
+AGREEMENT_COLUMNS = [
+    "id",
+    "identifier",
+    "sign_date",
+    "date_from",
+    "date_to",
+    "price_value",
+    "price_period",
+    "payment_deadline",
+    "deposit_value",
+    "description",
+    "flat_id",
+    "tenant_id",
+    "created",
+    "version",
+]
+SETTLEMENT_COLUMNS = [
+    "id",
+    "type",
+    "value",
+    "date",
+    "period",
+    "description",
+    "agreement_id",
+    "created",
+    "version",
+]
+
+
+class BulkWriter:
+    """
+    Buffers rows of several tables and writes them in batches, with COPY on
+    PostgreSQL and executemany on other databases. Tables are flushed
+    together in the order of registration, so parent rows are always
+    written before the rows referencing them.
+    """
+
+    def __init__(self, batch_size: int):
+        self.batch_size = batch_size
+        self.use_copy = db.engine.dialect.name == "postgresql"
+        self.columns: Dict[Table, List[str]] = {}
+        self.rows: Dict[Table, list] = {}
+        self.counts = Counter()
+
+    def register(self, table: Table, columns: List[str]) -> None:
+        self.columns[table] = columns
+        self.rows[table] = []
+
+    def add(self, table: Table, row: tuple) -> None:
+        rows = self.rows[table]
+        rows.append(row)
+        if len(rows) >= self.batch_size:
+            self.flush()
+
+    def flush(self) -> None:
+        for table, rows in self.rows.items():
+            if not rows:
+                continue
+            if self.use_copy:
+                self._copy(table, rows)
+            else:
+                columns = self.columns[table]
+                db.session.execute(
+                    table.insert(), [dict(zip(columns, row)) for row in rows]
+                )
+            self.counts[table.name] += len(rows)
+            rows.clear()
+
+    def _copy(self, table: Table, rows: list) -> None:
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows(rows)
+        buffer.seek(0)
+        cursor = db.session.connection().connection.cursor()
+        try:
+            cursor.copy_expert(
+                f"COPY {table.name} ({', '.join(self.columns[table])}) "
+                f"FROM STDIN WITH (FORMAT csv)",
+                buffer,
+            )
+        finally:
+            cursor.close()
+
+
+def _get_months(start_period: str, months: int) -> List[tuple]:
+    """
+    Returns (first day, last day, YYYY-MM, first day as datetime) of the
+    consecutive months
+    """
+    first_day = datetime.strptime(start_period, "%Y-%m").date()
+    result = []
+    for _ in range(months):
+        last_day = first_day.replace(
+            day=calendar.monthrange(first_day.year, first_day.month)[1]
+        )
+        result.append(
+            (
+                first_day,
+                last_day,
+                first_day.strftime("%Y-%m"),
+                datetime.combine(first_day, datetime.min.time()),
+            )
+        )
+        first_day = last_day + timedelta(days=1)
+    return result
+
+
+def _get_next_id(model: db.Model) -> int:
+    return (db.session.query(db.func.max(model.id)).scalar() or 0) + 1
+
+
+def _reset_sequences(tables: List[Table]) -> None:
+    """Moves PostgreSQL id sequences after the ids inserted explicitly"""
+    if db.engine.dialect.name != "postgresql":
+        return
+    for table in tables:
+        db.session.execute(
+            f"SELECT setval(pg_get_serial_sequence('{table.name}', 'id'), "
+            f"(SELECT MAX(id) FROM {table.name}))"
+        )
+
+
+def generate_data(
+    landlords: int,
+    flats_per_landlord: int,
+    months: int,
+    start_period: str = "2020-01",
+    seed: int = 0,
+    password: str = "password",
+    batch_size: int = 10000,
+    progress=None,
+) -> Counter:
+    """
+    Generates landlords with flats, a chain of non-overlapping agreements
+    (each with a new tenant) for every flat over the months from
+    start_period, and a monthly charge and (mostly) a payment for every month
+    of the agreements. The same seed gives the same data. All generated
+    users have the same password (hashed once). progress is called after
+    every generated landlord. Returns numbers of inserted rows by table.
+    """
+    rng = random.Random(seed)
+    month_list = _get_months(start_period, months)
+    hashed_password = generate_hashed_password(password)
+
+    tables = [
+        (Landlord, LANDLORD_COLUMNS),
+        (Flat, FLAT_COLUMNS),
+        (Tenant, TENANT_COLUMNS),
+        (Agreement, AGREEMENT_COLUMNS),
+        (Settlement, SETTLEMENT_COLUMNS),
+    ]
+    writer = BulkWriter(batch_size)
+    ids = {}
+    for model, columns in tables:
+        writer.register(model.__table__, columns)
+        ids[model] = _get_next_id(model)
+
+    def next_id(model: db.Model) -> int:
+        ids[model] += 1
+        return ids[model] - 1
+
+    def person() -> tuple:
+        return (
+            rng.choice(FIRST_NAMES),
+            rng.choice(LAST_NAMES),
+            f"{rng.randint(500, 899)}-{rng.randint(100, 999)}-{rng.randint(100, 999)}",
+            f"{rng.choice(STREETS)} {rng.randint(1, 150)}/{rng.randint(1, 80)} "
+            f"{rng.choice(CITIES)}",
+        )
+
+    created = month_list[0][3]
+    for _ in range(landlords):
+        landlord_id = next_id(Landlord)
+        writer.add(
+            Landlord.__table__,
+            (
+                landlord_id,
+                f"landlord{landlord_id}",
+                f"landlord{landlord_id}@example.com",
+                *person(),
+                None,
+                hashed_password,
+                created,
+            ),
+        )
+
+        for _ in range(flats_per_landlord):
+            flat_id = next_id(Flat)
+            writer.add(
+                Flat.__table__,
+                (
+                    flat_id,
+                    f"flat{flat_id}",
+                    person()[3],
+                    f"{rng.randint(1, 4)} rooms, {rng.randint(25, 120)}m^2",
+                    "active",
+                    landlord_id,
+                    created,
+                    1,
+                ),
+            )
+
+            month = rng.randint(0, 2)
+            while month < months:
+                length = min(rng.randint(6, 24), months - month)
+                first_day = month_list[month][0]
+                last_day = month_list[month + length - 1][1]
+                price = rng.randint(30, 90) * 50
+                deadline = rng.randint(5, 15)
+                sign_date = first_day - timedelta(days=rng.randint(5, 30))
+                sign_created = datetime.combine(sign_date, datetime.min.time())
+
+                tenant_id = next_id(Tenant)
+                writer.add(
+                    Tenant.__table__,
+                    (
+                        tenant_id,
+                        f"tenant{tenant_id}",
+                        f"tenant{tenant_id}@example.com",
+                        *person(),
+                        None,
+                        hashed_password,
+                        landlord_id,
+                        sign_created,
+                        1,
+                    ),
+                )
+
+                agreement_id = next_id(Agreement)
+                writer.add(
+                    Agreement.__table__,
+                    (
+                        agreement_id,
+                        f"agreement{agreement_id}",
+                        sign_date,
+                        first_day,
+                        last_day,
+                        price,
+                        "month",
+                        deadline,
+                        2 * price,
+                        None,
+                        flat_id,
+                        tenant_id,
+                        sign_created,
+                        1,
+                    ),
+                )
+
+                for period_start, _, period, period_created in month_list[
+                    month : month + length
+                ]:
+                    writer.add(
+                        Settlement.__table__,
+                        (
+                            next_id(Settlement),
+                            "charge",
+                            price,
+                            period_start,
+                            period,
+                            f"Charge for {period}",
+                            agreement_id,
+                            period_created,
+                            1,
+                        ),
+                    )
+                    if rng.random() < 0.95:
+                        payment_date = period_start + timedelta(
+                            days=rng.randint(0, deadline + 5)
+                        )
+                        writer.add(
+                            Settlement.__table__,
+                            (
+                                next_id(Settlement),
+                                "payment",
+                                price if rng.random() < 0.9 else price / 2,
+                                payment_date,
+                                None,
+                                f"Payment for {period}",
+                                agreement_id,
+                                period_created,
+                                1,
+                            ),
+                        )
+
+                month += length + rng.randint(0, 2)
+
+        if progress is not None:
+            progress()
+
+    writer.flush()
+    _reset_sequences([model.__table__ for model, _ in tables])
+    db.session.commit()
+    return writer.counts
@@ -1,8 +1,17 @@
-from flask import Response, jsonify
+import re
+from typing import Optional, Tuple
+
+from flask import Response, has_request_context, jsonify, request
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm.exc import StaleDataError
 
 from myrent_app import db
 from myrent_app.errors import errors_bp
 
+STATEMENT_TABLE_RE = re.compile(r"^\s*(?:INSERT INTO|UPDATE)\s+[`\"]?(\w+)", re.I)
+SQLITE_UNIQUE_RE = re.compile(r"UNIQUE constraint failed: (\w+)\.(\w+)")
+MYSQL_UNIQUE_RE = re.compile(r"Duplicate entry .* for key '(?:\w+\.)?(\w+)'")
+
 
 class ErrorResponse:
     """
@@ -20,9 +29,87 @@ class ErrorResponse:
         return response
 
 
+def _get_unique_column(table_name: str, constraint_name: str) -> Optional[str]:
+    """
+    Returns the column of the unique constraint or index of the table found
+    by its name in the metadata or by default names given by databases
+    (PostgreSQL: <table>_<column>_key, MySQL: <column>)
+    """
+    table = db.Model.metadata.tables.get(table_name)
+    if table is None:
+        return None
+    for index in table.indexes:
+        if index.unique and index.name == constraint_name:
+            return index.columns.keys()[0]
+    for column in table.columns:
+        if constraint_name in [f"{table_name}_{column.name}_key", column.name]:
+            return column.name
+    return None
+
+
+def _get_unique_violation(err: IntegrityError) -> Tuple[Optional[str], Optional[str]]:
+    """
+    Returns table and column of the violated unique constraint (or Nones
+    for other integrity errors) read from the database error
+    """
+    match = SQLITE_UNIQUE_RE.search(str(err.orig))
+    if match is not None:
+        return match.groups()
+
+    table_match = STATEMENT_TABLE_RE.match(err.statement or "")
+    if table_match is None:
+        return None, None
+    table_name = table_match.group(1)
+
+    constraint_name = getattr(getattr(err.orig, "diag", None), "constraint_name", None)
+    if constraint_name is None:
+        match = MYSQL_UNIQUE_RE.search(str(err.orig))
+        constraint_name = match.group(1) if match is not None else None
+    if constraint_name is None:
+        return None, None
+
+    return table_name, _get_unique_column(table_name, constraint_name)
+
+
+def _get_violating_value(err: IntegrityError, column_name: str) -> Optional[str]:
+    """
+    Returns the value of the column from named statement parameters or,
+    for positional ones, from the JSON body of the request
+    """
+    if isinstance(err.params, dict) and column_name in err.params:
+        return err.params[column_name]
+    if has_request_context():
+        data = request.get_json(silent=True)
+        if isinstance(data, dict):
+            return data.get(column_name)
+    return None
+
+
+@errors_bp.app_errorhandler(IntegrityError)
+def integrity_error(err):
+    db.session.rollback()
+
+    table_name, column_name = _get_unique_violation(err)
+    if column_name is None:
+        return ErrorResponse("Conflict with existing data", 409).to_response()
+
+    model_name = table_name
+    for model in db.Model.__subclasses__():
+        if model.__tablename__ == table_name:
+            model_name = model.__name__
+
+    value = _get_violating_value(err, column_name)
+    if value is None:
+        message = f"{model_name} with this {column_name} already exists"
+    else:
+        message = f"{model_name} with {column_name} {value} already exists"
+    return ErrorResponse(message, 409).to_response()
+
+
 @errors_bp.app_errorhandler(400)
 def bad_request_error(err):
-    messages = err.data.get("messages", {}).get("json", {})
+    messages = getattr(err, "data", {}).get("messages", {})
+    messages = messages.get("json", messages.get("query", err.description))
     return ErrorResponse(messages, 400).to_response()
 
 
@@ -41,6 +128,19 @@ def conflict_error(err):
     return ErrorResponse(err.description, 409).to_response()
 
 
+@errors_bp.app_errorhandler(StaleDataError)
+def stale_data_error(err):
+    db.session.rollback()
+    return ErrorResponse(
+        "Resource has been modified (ETag does not match)", 412
+    ).to_response()
+
+
+@errors_bp.app_errorhandler(412)
+def precondition_failed_error(err):
+    return ErrorResponse(err.description, 412).to_response()
+
+
 @errors_bp.app_errorhandler(415)
 def unsupported_media_type_error(err):
     return ErrorResponse(err.description, 415).to_response()
@@ -51,6 +151,16 @@ def unsupported_media_type_error(err):
     return ErrorResponse(err.description, 415).to_response()
 
 
+@errors_bp.app_errorhandler(428)
+def precondition_required_error(err):
+    return ErrorResponse(err.description, 428).to_response()
+
+
+@errors_bp.app_errorhandler(501)
+def not_implemented_error(err):
+    return ErrorResponse(err.description, 501).to_response()
+
+
 @errors_bp.app_errorhandler(500)
 def internal_server_error(err):
     db.session.rolback()
@@ -3,12 +3,28 @@ from webargs.flaskparser import use_args
 
 from myrent_app import db
 from myrent_app.flats import flats_bp
-from myrent_app.models import Flat, FlatSchema, Landlord, flat_schema
+from myrent_app.models import (
+    Agreement,
+    Blob,
+    Flat,
+    FlatSchema,
+    Landlord,
+    Picture,
+    flat_schema,
+)
+from myrent_app.storage import get_storage
 from myrent_app.utils import (
     apply_filter,
     apply_order,
+    check_if_match,
+    commit_without_expire,
+    get_bulk_items,
+    get_bulk_response,
     get_pagination,
     get_schema_args,
+    get_write_response,
+    reject_existing_values,
+    set_version_etag,
     token_landlord_required,
     validate_json_content_type,
 )
@@ -40,7 +56,9 @@ def get_one_flat(flat_id: str):
         flat_id, description=f"Flat with id {flat_id} not found"
     )
 
-    return jsonify({"success": True, "data": flat_schema.dump(flat)})
+    response = jsonify({"success": True, "data": flat_schema.dump(flat)})
+
+    return set_version_etag(response, flat)
 
 
 @flats_bp.route("/landlords/<int:landlord_id>/flats", methods=["GET"])
@@ -59,17 +77,30 @@ def get_all_landlord_flats(landlord_id: str):
 @validate_json_content_type
 @use_args(FlatSchema(exclude=["landlord_id"]), error_status_code=400)
 def create_flat(landlord_id: int, args: dict):
-    flat_identifier = Flat.query.filter(Flat.identifier == args["identifier"]).first()
-    if flat_identifier is not None:
-        abort(
-            409, description=f'Flat with identifier {args["identifier"]} already exists'
-        )
-
     flat = Flat(landlord_id=landlord_id, **args)
     db.session.add(flat)
+    commit_without_expire()
+
+    return get_write_response(
+        flat_schema, flat, "flats.get_one_flat", 201, flat_id=flat.id
+    )
+
+
+@flats_bp.route("/flats/bulk", methods=["POST"])
+@token_landlord_required
+@validate_json_content_type
+def create_flats(landlord_id: int):
+    items, errors = get_bulk_items(FlatSchema(many=True, exclude=["landlord_id"]))
+    reject_existing_values(
+        Flat, "identifier", items, errors, "Flat with identifier {} already exists"
+    )
+
+    db.session.bulk_insert_mappings(
+        Flat, [dict(item, landlord_id=landlord_id) for item in items.values()]
+    )
     db.session.commit()
 
-    return jsonify({"success": True, "data": flat_schema.dump(flat)}), 201
+    return get_bulk_response(len(items), errors)
 
 
 @flats_bp.route("/flats/<int:flat_id>", methods=["PUT"])
@@ -80,17 +111,7 @@ def update_flat(landlord_id: int, args: dict, flat_id: int):
     flat = Flat.query.get_or_404(
         flat_id, description=f"Flat with id {flat_id} not found"
     )
-
-    flat_with_this_identifier = Flat.query.filter(
-        Flat.identifier == args["identifier"]
-    ).first()
-    if (
-        flat_with_this_identifier is not None
-        and flat_with_this_identifier.identifier != flat.identifier
-    ):
-        abort(
-            409, description=f'Flat with identifier {args["identifier"]} already exists'
-        )
+    check_if_match(flat)
 
     status = args.get("status")
     if status is not None:
@@ -105,9 +126,9 @@ def update_flat(landlord_id: int, args: dict, flat_id: int):
     flat.identifier = args["identifier"]
     flat.address = args["address"]
 
-    db.session.commit()
+    commit_without_expire()
 
-    return jsonify({"success": True, "data": flat_schema.dump(flat)})
+    return get_write_response(flat_schema, flat, "flats.get_one_flat", flat_id=flat.id)
 
 
 @flats_bp.route("/flats/<int:flat_id>", methods=["DELETE"])
@@ -119,10 +140,35 @@ def delete_flat(landlord_id: int, flat_id):
 
     if flat.landlord_id != landlord_id:
         abort(404, description=f"Flat with id {flat_id} not found")
-
-    db.session.delete(flat)
+    check_if_match(flat)
+
+    pictures = Picture.query.filter(Picture.flat_id == flat_id)
+    picture_names, blob_ids = [], []
+    for picture in pictures:
+        if picture.blob_id is None:
+            picture_names.extend(picture.file_names)
+        else:
+            blob_ids.append(picture.blob_id)
+
+    deleted = Agreement.delete_all(Agreement.flat_id == flat_id)
+    deleted["pictures"] = pictures.delete(synchronize_session=False)
+    picture_names.extend(Blob.release(blob_ids))
+    deleted["flats"] = Flat.query.filter(
+        Flat.id == flat_id, Flat.version == flat.version
+    ).delete(synchronize_session=False)
+    if not deleted["flats"]:
+        db.session.rollback()
+        abort(412, description="Resource has been modified (ETag does not match)")
     db.session.commit()
 
+    storage = get_storage()
+    for picture_name in picture_names:
+        storage.delete(picture_name)
+
     return jsonify(
-        {"success": True, "data": f"Flat with id {flat_id} has been deleted"}
+        {
+            "success": True,
+            "data": f"Flat with id {flat_id} has been deleted",
+            "deleted": deleted,
+        }
     )
@@ -1,6 +1,16 @@
+import json
 from pathlib import Path
-
-from flask import abort, jsonify, request
+from typing import Iterator
+
+from flask import (
+    Response,
+    abort,
+    jsonify,
+    request,
+    stream_with_context,
+)
+from flask_sqlalchemy import BaseQuery
+from marshmallow import Schema
 
 # from flask_cors import cross_origin
 from webargs.flaskparser import use_args
@@ -8,17 +18,35 @@ from webargs.flaskparser import use_args
 from myrent_app import db
 from myrent_app.landlords import landlords_bp
 from myrent_app.models import (
+    Agreement,
+    AgreementSchema,
+    Flat,
+    FlatSchema,
     Landlord,
     LandlordSchema,
+    Overdue,
+    OverdueSchema,
+    PeriodSchema,
+    Picture,
+    PictureSchema,
+    Settlement,
+    SettlementSchema,
+    Tenant,
+    TenantSchema,
+    date_range_schema,
     landlord_schema,
     landlord_update_password_schema,
 )
+from myrent_app.storage import get_storage
 from myrent_app.utils import (
     apply_filter,
     apply_order,
+    commit_without_expire,
     generate_hashed_password,
     get_pagination,
     get_schema_args,
+    get_write_response,
+    stream_zip,
     token_landlord_required,
     validate_json_content_type,
 )
@@ -57,15 +85,6 @@ def get_one_landlord(landlord_id: int):
 @validate_json_content_type
 @use_args(landlord_schema, error_status_code=400)
 def register_landlord(args: dict):
-    if Landlord.query.filter(Landlord.identifier == args["identifier"]).first():
-        abort(
-            409,
-            description=f'Landlord with identifier {args["identifier"]} already exists',
-        )
-
-    if Landlord.query.filter(Landlord.email == args["email"]).first():
-        abort(409, description=f'Landlord with email {args["email"]} already exists')
-
     args["password"] = generate_hashed_password(args["password"])
 
     new_landlord = Landlord(**args)
@@ -131,28 +150,6 @@ def update_landlord_data(landlord_id: int, args: dict):
         landlord_id, description=f"Landlord with id {landlord_id} not found"
     )
 
-    landlord_with_this_identifier = Landlord.query.filter(
-        Landlord.identifier == args["identifier"]
-    ).first()
-    if (
-        landlord_with_this_identifier is not None
-        and landlord_with_this_identifier.identifier != landlord.identifier
-    ):
-        abort(
-            409,
-            description=f'Landlord with identifier {args["identifier"]}'
-            " already exists",
-        )
-
-    landlord_with_this_email = Landlord.query.filter(
-        Landlord.email == args["email"]
-    ).first()
-    if (
-        landlord_with_this_email is not None
-        and landlord_with_this_email.email != landlord.email
-    ):
-        abort(409, description=f'Landlord with email {args["email"]}' " already exists")
-
     landlord.identifier = args["identifier"]
     landlord.email = args["email"]
     landlord.first_name = args["first_name"]
@@ -162,6 +159,180 @@ def update_landlord_data(landlord_id: int, args: dict):
     description = args.get("description")
     if description is not None:
         landlord.description = description
-    db.session.commit()
+    commit_without_expire()
 
-    return jsonify({"success": True, "data": landlord_schema.dump(landlord)})
+    return get_write_response(
+        landlord_schema, landlord, "landlords.get_current_landlord"
+    )
+
+
+@landlords_bp.route("/landlords/me/dashboard", methods=["GET"])
+@token_landlord_required
+@use_args(date_range_schema, location="query", error_status_code=400)
+def get_landlord_dashboard(landlord_id: int, args: dict):
+    """
+    Monthly charges and payments per flat of the landlord, aggregated by the
+    database in one GROUP BY query (optional query params: from, to
+    in format dd-mm-YYYY).
+    """
+    year = db.extract("year", Settlement.date)
+    month = db.extract("month", Settlement.date)
+    is_charge = Settlement.type == "charge"
+    is_payment = Settlement.type == "payment"
+
+    query = (
+        db.session.query(
+            year,
+            month,
+            Flat.id,
+            db.func.sum(db.case([(is_charge, Settlement.value)], else_=0)),
+            db.func.count(db.case([(is_charge, Settlement.id)])),
+            db.func.sum(db.case([(is_payment, Settlement.value)], else_=0)),
+            db.func.count(db.case([(is_payment, Settlement.id)])),
+        )
+        .select_from(Settlement)
+        .join(Agreement)
+        .join(Flat)
+        .filter(Flat.landlord_id == landlord_id)
+    )
+    if args.get("date_from") is not None:
+        query = query.filter(Settlement.date >= args["date_from"])
+    if args.get("date_to") is not None:
+        query = query.filter(Settlement.date <= args["date_to"])
+    query = query.group_by(year, month, Flat.id).order_by(year, month, Flat.id)
+
+    rows = [
+        [
+            f"{int(row_year):04d}-{int(row_month):02d}",
+            flat_id,
+            float(charges),
+            charges_count,
+            float(payments),
+            payments_count,
+        ]
+        for (
+            row_year,
+            row_month,
+            flat_id,
+            charges,
+            charges_count,
+            payments,
+            payments_count,
+        ) in query
+    ]
+    flats = (
+        db.session.query(Flat.id, Flat.identifier)
+        .filter(Flat.landlord_id == landlord_id)
+        .order_by(Flat.id)
+    )
+
+    return jsonify(
+        {
+            "success": True,
+            "data": {
+                "columns": [
+                    "month",
+                    "flat_id",
+                    "charges",
+                    "charges_count",
+                    "payments",
+                    "payments_count",
+                ],
+                "rows": rows,
+                "flats": [[flat_id, identifier] for flat_id, identifier in flats],
+            },
+        }
+    )
+
+
+@landlords_bp.route("/landlords/me/overdue", methods=["GET"])
+@token_landlord_required
+@use_args(PeriodSchema(partial=True), location="query", error_status_code=400)
+def get_landlord_overdues(landlord_id: int, args: dict):
+    """
+    Overdue agreements of the landlord stored by the last run of the
+    detect-overdue command (optional query param: period in format YYYY-MM).
+    """
+    query = (
+        Overdue.query.join(Agreement)
+        .join(Flat)
+        .filter(Flat.landlord_id == landlord_id)
+        .options(db.contains_eager(Overdue.agreement))
+    )
+    if args.get("period") is not None:
+        query = query.filter(Overdue.period == args["period"])
+    query = query.order_by(Overdue.period.desc(), Overdue.agreement_id)
+    overdues = OverdueSchema(many=True).dump(query)
+
+    return jsonify(
+        {"success": True, "data": overdues, "number_of_records": len(overdues)}
+    )
+
+
+def _get_ndjson_lines(query: BaseQuery, schema: Schema) -> Iterator[bytes]:
+    for item in query.yield_per(500):
+        yield (json.dumps(schema.dump(item), ensure_ascii=False) + "\n").encode()
+
+
+def _get_export_entries(landlord_id: int) -> Iterator[tuple]:
+    flats = Flat.query.filter(Flat.landlord_id == landlord_id)
+    agreements = Agreement.query.join(Flat).filter(Flat.landlord_id == landlord_id)
+    settlements = (
+        Settlement.query.join(Agreement)
+        .join(Flat)
+        .filter(Flat.landlord_id == landlord_id)
+    )
+    pictures = Picture.query.join(Flat).filter(Flat.landlord_id == landlord_id)
+
+    yield "landlord.ndjson", _get_ndjson_lines(
+        Landlord.query.filter(Landlord.id == landlord_id),
+        LandlordSchema(exclude=["flats"]),
+    )
+    yield "flats.ndjson", _get_ndjson_lines(
+        flats.order_by(Flat.id), FlatSchema(exclude=["landlord"])
+    )
+    yield "tenants.ndjson", _get_ndjson_lines(
+        Tenant.query.filter(Tenant.landlord_id == landlord_id).order_by(Tenant.id),
+        TenantSchema(exclude=["landlord"]),
+    )
+    yield "agreements.ndjson", _get_ndjson_lines(
+        agreements.options(
+            db.contains_eager(Agreement.flat), db.joinedload(Agreement.tenant)
+        ).order_by(Agreement.id),
+        AgreementSchema(),
+    )
+    yield "settlements.ndjson", _get_ndjson_lines(
+        settlements.options(db.contains_eager(Settlement.agreement)).order_by(
+            Settlement.id
+        ),
+        SettlementSchema(),
+    )
+    yield "pictures.ndjson", _get_ndjson_lines(
+        pictures.options(db.contains_eager(Picture.flat)).order_by(Picture.id),
+        PictureSchema(),
+    )
+
+    storage = get_storage()
+    for picture in pictures.options(db.joinedload(Picture.blob)).order_by(Picture.id):
+        for _, chunks in storage.read_files([picture.stored_file.key]):
+            yield f"pictures/{picture.name}", chunks
+
+
+@landlords_bp.route("/landlords/me/export", methods=["GET"])
+@token_landlord_required
+def export_landlord_data(landlord_id: int):
+    """
+    All data of the landlord as a zip archive streamed while it is created:
+    one NDJSON file per model and the picture files
+    """
+    Landlord.query.get_or_404(
+        landlord_id, description=f"Landlord with id {landlord_id} not found"
+    )
+
+    return Response(
+        stream_with_context(stream_zip(_get_export_entries(landlord_id))),
+        mimetype="application/zip",
+        headers={
+            "Content-Disposition": f'attachment; filename="landlord{landlord_id}.zip"'
+        },
+    )
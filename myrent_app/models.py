@@ -1,8 +1,12 @@
+from collections import Counter
 from datetime import datetime, timedelta
+from typing import Iterable, Tuple
 
 import jwt
 from flask import current_app
-from marshmallow import Schema, fields, validate
+from marshmallow import Schema, fields, post_dump, validate
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.declarative import declared_attr
 from werkzeug.security import check_password_hash
 
 from myrent_app import db
@@ -13,6 +17,20 @@ class TimestampMixin(object):
     updated = db.Column(db.DateTime, onupdate=datetime.utcnow)
 
 
+class VersionMixin(object):
+    """
+    Version of the row incremented by every ORM UPDATE, which is made only
+    when the version in the database is still the loaded one
+    (optimistic concurrency control, exposed as ETag)
+    """
+
+    version = db.Column(db.Integer, nullable=False, default=1, server_default="1")
+
+    @declared_attr
+    def __mapper_args__(cls):
+        return {"version_id_col": cls.version}
+
+
 class Landlord(TimestampMixin, db.Model):
     __tablename__ = "landlords"
     id = db.Column(db.Integer, primary_key=True)
@@ -47,17 +65,21 @@ class Landlord(TimestampMixin, db.Model):
         return check_password_hash(self.password, password)
 
 
-class Flat(TimestampMixin, db.Model):
+class Flat(TimestampMixin, VersionMixin, db.Model):
     __tablename__ = "flats"
     id = db.Column(db.Integer, primary_key=True)
     identifier = db.Column(db.String(255), unique=True, nullable=False)
     address = db.Column(db.String(255), nullable=False)
     description = db.Column(db.Text)
     status = db.Column(db.String(50), default="active")  # active/inactive/sold
-    landlord_id = db.Column(db.Integer, db.ForeignKey("landlords.id"), nullable=False)
+    landlord_id = db.Column(
+        db.Integer, db.ForeignKey("landlords.id"), nullable=False, index=True
+    )
     landlord = db.relationship("Landlord", back_populates="flats")
-    agreements = db.relationship("Agreement", back_populates="flat")
-    pictures = db.relationship("Picture", back_populates="flat")
+    agreements = db.relationship(
+        "Agreement", back_populates="flat", passive_deletes=True
+    )
+    pictures = db.relationship("Picture", back_populates="flat", passive_deletes=True)
 
     def __repr__(self):
         return f"<flat>: {self.id} {self.identifier}"
@@ -67,24 +89,147 @@ class Flat(TimestampMixin, db.Model):
         return value
 
 
-class Picture(TimestampMixin, db.Model):
+PICTURE_VARIANT_FORMATS = {"jpeg": "jpg", "webp": "webp"}
+
+
+class VariantsMixin(object):
+    """
+    Resized variants of a stored file, named after its storage key
+    """
+
+    variants = db.Column(db.String(255))  # comma separated, e.g. thumbnail,medium
+
+    @staticmethod
+    def get_variant_name(key: str, variant: str, file_format: str) -> str:
+        stem = key.rsplit(".", 1)[0]
+        return f"{stem}_{variant}.{PICTURE_VARIANT_FORMATS[file_format]}"
+
+    @property
+    def variant_names(self) -> dict:
+        variants = self.variants.split(",") if self.variants else []
+        return {
+            variant: {
+                file_format: self.get_variant_name(self.key, variant, file_format)
+                for file_format in PICTURE_VARIANT_FORMATS
+            }
+            for variant in variants
+        }
+
+    @property
+    def file_names(self) -> list:
+        """Names of the original and all variant files in the storage"""
+        names = [self.key]
+        for variant_names in self.variant_names.values():
+            names.extend(variant_names.values())
+        return names
+
+
+class Blob(TimestampMixin, VariantsMixin, db.Model):
+    """
+    Picture file stored once under its SHA-256 hash, shared by all pictures
+    with the same content (refcount is the number of the pictures)
+    """
+
+    __tablename__ = "blobs"
+    id = db.Column(db.Integer, primary_key=True)
+    sha256 = db.Column(db.String(64), unique=True, nullable=False)
+    size = db.Column(db.Integer, nullable=False)
+    content_type = db.Column(db.String(255))
+    refcount = db.Column(db.Integer, nullable=False, default=1)
+    status = db.Column(db.String(20), nullable=False, default="pending")
+
+    def __repr__(self):
+        return f"<blob>: {self.sha256} ({self.refcount})"
+
+    @property
+    def key(self) -> str:
+        return f"blobs/{self.sha256}"
+
+    @staticmethod
+    def acquire(sha256: str, size: int, content_type: str) -> Tuple["Blob", bool]:
+        """
+        Returns blob with the hash with reference count incremented, or
+        a new one (created is True when it has to be uploaded)
+        """
+        updated = Blob.query.filter(Blob.sha256 == sha256).update(
+            {Blob.refcount: Blob.refcount + 1}, synchronize_session=False
+        )
+        if updated:
+            return Blob.query.filter(Blob.sha256 == sha256).one(), False
+
+        blob = Blob(sha256=sha256, size=size, content_type=content_type)
+        try:
+            with db.session.begin_nested():
+                db.session.add(blob)
+        except IntegrityError:
+            return Blob.acquire(sha256, size, content_type)
+        return blob, True
+
+    @staticmethod
+    def release(blob_ids: Iterable[int]) -> list:
+        """
+        Decrements reference counts of the blobs (once for every given id),
+        deletes blobs without references, returns their file names
+        """
+        counts = Counter(blob_ids)
+        for blob_id, count in counts.items():
+            Blob.query.filter(Blob.id == blob_id).update(
+                {Blob.refcount: Blob.refcount - count}, synchronize_session=False
+            )
+        unused = Blob.query.filter(Blob.id.in_(counts), Blob.refcount <= 0).all()
+        if not unused:
+            return []
+        Blob.query.filter(Blob.id.in_([blob.id for blob in unused])).delete(
+            synchronize_session=False
+        )
+        return [name for blob in unused for name in blob.file_names]
+
+
+class Picture(TimestampMixin, VariantsMixin, db.Model):
     __tablename__ = "pictures"
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(50), unique=True, nullable=False)
     path = db.Column(db.String(255), nullable=False)
     description = db.Column(db.Text)
-    flat_id = db.Column(db.Integer, db.ForeignKey("flats.id"), nullable=False)
+    status = db.Column(
+        db.String(20), nullable=False, default="ready", server_default="ready"
+    )  # pending, ready or failed
+    flat_id = db.Column(
+        db.Integer, db.ForeignKey("flats.id", ondelete="CASCADE"), nullable=False
+    )
     flat = db.relationship("Flat", back_populates="pictures")
+    blob_id = db.Column(db.Integer, db.ForeignKey("blobs.id"), index=True)
+    blob = db.relationship("Blob", lazy="joined")
 
     def __repr__(self):
         return f"<picture>: {self.id} - {self.name}"
 
+    @property
+    def key(self) -> str:
+        return self.name
+
+    @property
+    def stored_file(self) -> VariantsMixin:
+        """Blob of the picture, the picture itself when stored by its name"""
+        return self if self.blob_id is None else self.blob
+
+    @property
+    def variant_urls(self) -> dict:
+        stored_file = self.stored_file
+        base_url = self.path[: len(self.path) - len(stored_file.key)]
+        return {
+            variant: {
+                file_format: f"{base_url}{name}" for file_format, name in names.items()
+            }
+            for variant, names in stored_file.variant_names.items()
+        }
+
     @staticmethod
     def additional_validation(param: str, value: str) -> str:
         return value
 
 
-class Tenant(TimestampMixin, db.Model):
+class Tenant(TimestampMixin, VersionMixin, db.Model):
     __tablename__ = "tenants"
     id = db.Column(db.Integer, primary_key=True)
     identifier = db.Column(db.String(255), unique=True, nullable=False, index=True)
@@ -97,7 +242,9 @@ class Tenant(TimestampMixin, db.Model):
     password = db.Column(db.String(255), nullable=False)
     landlord_id = db.Column(db.Integer, db.ForeignKey("landlords.id"), nullable=False)
     landlord = db.relationship("Landlord", back_populates="tenants")
-    agreements = db.relationship("Agreement", back_populates="tenant")
+    agreements = db.relationship(
+        "Agreement", back_populates="tenant", passive_deletes=True
+    )
 
     def __repr__(self):
         return f"<tenant>: {self.first_name} {self.last_name}"
@@ -120,7 +267,7 @@ class Tenant(TimestampMixin, db.Model):
         return check_password_hash(self.password, password)
 
 
-class Agreement(TimestampMixin, db.Model):
+class Agreement(TimestampMixin, VersionMixin, db.Model):
     __tablename__ = "agreements"
     id = db.Column(db.Integer, primary_key=True)
     identifier = db.Column(db.String(50), unique=True, nullable=False, index=True)
@@ -132,11 +279,20 @@ class Agreement(TimestampMixin, db.Model):
     payment_deadline = db.Column(db.Integer, nullable=False)
     deposit_value = db.Column(db.Float, default=0)
     description = db.Column(db.Text)
-    flat_id = db.Column(db.Integer, db.ForeignKey("flats.id"), nullable=False)
-    tenant_id = db.Column(db.Integer, db.ForeignKey("tenants.id"), nullable=False)
+    flat_id = db.Column(
+        db.Integer,
+        db.ForeignKey("flats.id", ondelete="CASCADE"),
+        nullable=False,
+        index=True,
+    )
+    tenant_id = db.Column(
+        db.Integer, db.ForeignKey("tenants.id", ondelete="CASCADE"), nullable=False
+    )
     flat = db.relationship("Flat", back_populates="agreements")
     tenant = db.relationship("Tenant", back_populates="agreements")
-    settlements = db.relationship("Settlement", back_populates="agreement")
+    settlements = db.relationship(
+        "Settlement", back_populates="agreement", passive_deletes=True
+    )
 
     def __repr__(self):
         return f"<agreement>: {self.identifier} - {self.flat} - {self.tenant}"
@@ -150,15 +306,48 @@ class Agreement(TimestampMixin, db.Model):
                 value = None
         return value
 
-
-class Settlement(TimestampMixin, db.Model):
+    @staticmethod
+    def delete_all(*criterion) -> dict:
+        """
+        Deletes agreements matching the criterion together with their
+        settlements and overdues, one DELETE statement per table,
+        returns numbers of deleted rows
+        """
+        agreement_ids = db.session.query(Agreement.id).filter(*criterion).subquery()
+        deleted = {}
+        for model in [Settlement, Overdue]:
+            deleted[model.__tablename__] = model.query.filter(
+                model.agreement_id.in_(agreement_ids)
+            ).delete(synchronize_session=False)
+        deleted["agreements"] = Agreement.query.filter(*criterion).delete(
+            synchronize_session=False
+        )
+        return deleted
+
+
+class Settlement(TimestampMixin, VersionMixin, db.Model):
     __tablename__ = "settlements"
+    __table_args__ = (
+        db.Index(
+            "ix_settlements_agreement_id_date_type", "agreement_id", "date", "type"
+        ),
+        db.Index(
+            "ix_settlements_agreement_id_type_period",
+            "agreement_id",
+            "type",
+            "period",
+            unique=True,
+        ),
+    )
     id = db.Column(db.Integer, primary_key=True)
     type = db.Column(db.String(50), nullable=False)
     value = db.Column(db.Float, nullable=False)
     date = db.Column(db.Date, nullable=False, default=datetime.now().date())
+    period = db.Column(db.String(7))  # YYYY-MM, set for generated charges
     description = db.Column(db.Text)
-    agreement_id = db.Column(db.Integer, db.ForeignKey("agreements.id"), nullable=False)
+    agreement_id = db.Column(
+        db.Integer, db.ForeignKey("agreements.id", ondelete="CASCADE"), nullable=False
+    )
     agreement = db.relationship("Agreement", back_populates="settlements")
 
     def __repr__(self):
@@ -174,6 +363,63 @@ class Settlement(TimestampMixin, db.Model):
         return value
 
 
+class Overdue(TimestampMixin, db.Model):
+    __tablename__ = "overdues"
+    __table_args__ = (
+        db.Index(
+            "ix_overdues_agreement_id_period", "agreement_id", "period", unique=True
+        ),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    period = db.Column(db.String(7), nullable=False, index=True)
+    amount = db.Column(db.Float, nullable=False)
+    agreement_id = db.Column(
+        db.Integer, db.ForeignKey("agreements.id", ondelete="CASCADE"), nullable=False
+    )
+    agreement = db.relationship("Agreement")
+
+    def __repr__(self):
+        return f"<overdue>: {self.period} {self.amount} {self.agreement}"
+
+    @staticmethod
+    def additional_validation(param: str, value: str) -> str:
+        return value
+
+
+class IdempotencyKey(db.Model):
+    """
+    Response of a write request stored under the Idempotency-Key header,
+    the row is inserted before the request is processed and acts as a lock
+    (status_code is null until the response is stored)
+    """
+
+    __tablename__ = "idempotency_keys"
+    __table_args__ = (
+        db.Index(
+            "ix_idempotency_keys_landlord_id_key", "landlord_id", "key", unique=True
+        ),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    key = db.Column(db.String(255), nullable=False)
+    request_hash = db.Column(db.String(64), nullable=False)
+    status_code = db.Column(db.Integer)
+    headers = db.Column(db.Text)
+    body = db.Column(db.Text)
+    created = db.Column(
+        db.DateTime, nullable=False, default=datetime.utcnow, index=True
+    )
+    landlord_id = db.Column(
+        db.Integer, db.ForeignKey("landlords.id", ondelete="CASCADE"), nullable=False
+    )
+
+    def __repr__(self):
+        return f"<idempotency key>: {self.key} {self.status_code}"
+
+    def is_expired(self) -> bool:
+        ttl = current_app.config.get("IDEMPOTENCY_KEY_TTL")
+        return self.created < datetime.utcnow() - timedelta(seconds=ttl)
+
+
 class LandlordSchema(Schema):
     id = fields.Integer(dump_only=True)
     identifier = fields.String(required=True, validate=validate.Length(min=3, max=255))
@@ -269,6 +515,7 @@ class SettlementSchema(Schema):
     type = fields.String(required=True, validate=validate.OneOf(["charge", "payment"]))
     value = fields.Float()
     date = fields.Date("%d-%m-%Y", required=True)
+    period = fields.String(dump_only=True)
     description = fields.String()
     agreement_id = fields.Integer(load_only=True)
     agreement = fields.Nested(
@@ -283,11 +530,102 @@ class PictureSchema(Schema):
     name = fields.String(required=True, validate=validate.Length(max=50))
     path = fields.String(required=True, validate=validate.Length(max=255))
     description = fields.String()
+    variants = fields.Dict(attribute="variant_urls", dump_only=True)
+    status = fields.String(dump_only=True)
     flat_id = fields.Integer(load_only=True)
     flat = fields.Nested(lambda: FlatSchema(only=["id", "identifier", "address"]))
     created = fields.DateTime(dump_only=True)
     updated = fields.DateTime(dump_only=True)
 
+    @post_dump(pass_many=True, pass_original=True)
+    def sign_urls(self, data, original, many: bool, **kwargs):
+        """
+        Replaces path and variants with urls signed by the private storage,
+        all pictures of the list in one batch
+        """
+        from myrent_app.storage import get_storage
+
+        storage = get_storage()
+        if not storage.private:
+            return data
+
+        items = data if many else [data]
+        stored_files = [
+            picture.stored_file for picture in (original if many else [original])
+        ]
+        urls = storage.get_urls(
+            [name for stored_file in stored_files for name in stored_file.file_names]
+        )
+        for item, stored_file in zip(items, stored_files):
+            if "path" in item:
+                item["path"] = urls[stored_file.key]
+            if "variants" in item:
+                item["variants"] = {
+                    variant: {
+                        file_format: urls[file_name]
+                        for file_format, file_name in variant_names.items()
+                    }
+                    for variant, variant_names in stored_file.variant_names.items()
+                }
+        return data
+
+
+class PictureUploadSchema(Schema):
+    file_name = fields.String(required=True, validate=validate.Length(min=1, max=255))
+    content_type = fields.String(required=True)
+
+
+class PictureConfirmSchema(Schema):
+    name = fields.String(required=True, validate=validate.Length(max=50))
+    description = fields.String()
+
+
+class OverdueSchema(Schema):
+    id = fields.Integer(dump_only=True)
+    period = fields.String()
+    amount = fields.Float()
+    agreement = fields.Nested(
+        lambda: AgreementSchema(only=["id", "identifier", "payment_deadline"])
+    )
+    created = fields.DateTime(dump_only=True)
+
+
+class BatchRequestSchema(Schema):
+    method = fields.String(
+        required=True, validate=validate.OneOf(["GET", "POST", "PUT", "DELETE"])
+    )
+    path = fields.String(required=True, validate=validate.Length(min=1))
+    body = fields.Raw(allow_none=True)
+
+
+class BatchSchema(Schema):
+    requests = fields.List(
+        fields.Nested(BatchRequestSchema),
+        required=True,
+        validate=validate.Length(min=1),
+    )
+    atomic = fields.Boolean(missing=False)
+
+
+class PeriodSchema(Schema):
+    period = fields.String(
+        required=True,
+        validate=validate.Regexp(
+            r"^\d{4}-(0[1-9]|1[0-2])$", error="Period must be in format YYYY-MM"
+        ),
+    )
+
+
+class DateRangeSchema(Schema):
+    date_from = fields.Date("%d-%m-%Y", data_key="from")
+    date_to = fields.Date("%d-%m-%Y", data_key="to")
+
+
+class ExportSchema(DateRangeSchema):
+    file_format = fields.String(
+        data_key="format", missing="csv", validate=validate.OneOf(["csv", "xlsx"])
+    )
+
 
 landlord_schema = LandlordSchema()
 landlord_update_password_schema = LandlordUpdatePasswordSchema()
@@ -297,3 +635,10 @@ tenant_update_password_schema = TenantUpdatePasswordSchema()
 agreement_schema = AgreementSchema()
 settlement_schema = SettlementSchema()
 picture_schema = PictureSchema()
+picture_upload_schema = PictureUploadSchema()
+picture_confirm_schema = PictureConfirmSchema()
+overdue_schema = OverdueSchema()
+batch_schema = BatchSchema()
+period_schema = PeriodSchema()
+date_range_schema = DateRangeSchema()
+export_schema = ExportSchema()
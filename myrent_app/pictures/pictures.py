@@ -11,16 +11,29 @@ from flask import (
     send_file,
     url_for,
 )
+from webargs.flaskparser import use_args
 from werkzeug.utils import secure_filename
 
 from myrent_app import db
-from myrent_app.models import Flat, Picture, PictureSchema, picture_schema
+from myrent_app.models import (
+    Blob,
+    Flat,
+    Picture,
+    PictureSchema,
+    picture_confirm_schema,
+    picture_schema,
+    picture_upload_schema,
+)
 from myrent_app.pictures import pictures_bp
+from myrent_app.pictures.uploads import get_upload_queue, spool_picture
+from myrent_app.storage import get_storage
 from myrent_app.utils import (
     allowed_picture,
-    delete_file_from_s3,
+    commit_without_expire,
+    get_write_response,
+    idempotent,
     token_landlord_required,
-    upload_file_to_s3,
+    validate_json_content_type,
 )
 
 
@@ -63,6 +76,7 @@ def get_picture(picture_id: int):
 
 @pictures_bp.route("/flats/<int:flat_id>/pictures", methods=["POST"])
 @token_landlord_required
+@idempotent
 def add_picture(landlord_id: int, flat_id: int):
     flat = Flat.query.get_or_404(
         flat_id, description=f"Flat with id {flat_id} not found"
@@ -87,26 +101,242 @@ def add_picture(landlord_id: int, flat_id: int):
     if picture_with_this_filename is not None:
         abort(409, description=f"Picture with name {file.filename} already exists")
 
-    file_url = upload_file_to_s3(
-        file,
-        file_name,
-        current_app.config.get("S3_BUCKET"),
-        current_app.config.get("AWS_ACCESS_KEY_ID"),
-        current_app.config.get("AWS_SECRET_ACCESS_KEY"),
+    spool_path, sha256, size = spool_picture(file, file_name)
+    try:
+        blob, created = Blob.acquire(sha256, size, file.content_type)
+        if blob.status == "failed":
+            blob.status = "pending"
+            created = True
+
+        picture = Picture(
+            name=file_name,
+            path=get_storage().url(blob.key),
+            flat_id=flat_id,
+            blob=blob,
+            status=blob.status,
+        )
+        if description is not None and description != "":
+            picture.description = description
+
+        db.session.add(picture)
+        commit_without_expire()
+    except Exception:
+        os.remove(spool_path)
+        raise
+
+    if created:
+        get_upload_queue().submit(blob.id, spool_path)
+    else:
+        os.remove(spool_path)
+
+    return get_write_response(
+        picture_schema,
+        picture,
+        "pictures.get_picture",
+        201 if picture.status == "ready" else 202,
+        picture_id=picture.id,
+    )
+
+
+@pictures_bp.route("/flats/<int:flat_id>/pictures/bulk", methods=["POST"])
+@token_landlord_required
+@idempotent
+def add_pictures(landlord_id: int, flat_id: int):
+    flat = Flat.query.get_or_404(
+        flat_id, description=f"Flat with id {flat_id} not found"
+    )
+
+    if flat.landlord_id != landlord_id:
+        abort(404, description=f"Flat with id {flat_id} not found")
+
+    files = request.files.getlist("picture")
+    descriptions = request.form.getlist("description")
+    max_files = current_app.config.get("PICTURE_BULK_MAX_FILES")
+
+    if not files:
+        abort(422, description=f"Picture is not attached")
+    if len(files) > max_files:
+        abort(400, description=f"Too many pictures (maximum {max_files})")
+
+    file_names = [f"flat{flat_id}_{secure_filename(file.filename)}" for file in files]
+    existing_names = {
+        name
+        for (name,) in Picture.query.with_entities(Picture.name).filter(
+            Picture.name.in_(file_names)
+        )
+    }
+    extensions = [e for e in current_app.config.get("ALLOWED_EXTENSIONS")]
+    errors = {}
+    for index, file_name in enumerate(file_names):
+        if not allowed_picture(file_name):
+            message = f"Not allowed picture extension ({extensions})"
+        elif file_name in existing_names or file_name in file_names[:index]:
+            message = f"Picture with name {files[index].filename} already exists"
+        else:
+            continue
+        errors[index] = {"picture": [message]}
+
+    indexes = [index for index in range(len(files)) if index not in errors]
+    if not indexes:
+        abort(400, description=errors)
+
+    spooled = {}
+    uploads = {}
+    pictures = {}
+    try:
+        for index in indexes:
+            spooled[index] = spool_picture(files[index], file_names[index])
+
+        for index in indexes:
+            spool_path, sha256, size = spooled[index]
+            blob, created = Blob.acquire(sha256, size, files[index].content_type)
+            if blob.status == "failed":
+                blob.status = "pending"
+                created = True
+            if created:
+                uploads[blob] = spool_path
+
+            picture = Picture(
+                name=file_names[index],
+                path=get_storage().url(blob.key),
+                flat_id=flat_id,
+                blob=blob,
+                status=blob.status,
+            )
+            if index < len(descriptions) and descriptions[index] != "":
+                picture.description = descriptions[index]
+            db.session.add(picture)
+            pictures[index] = picture
+
+        commit_without_expire()
+    except Exception:
+        for spool_path, _, _ in spooled.values():
+            os.remove(spool_path)
+        raise
+
+    upload_queue = get_upload_queue()
+    for blob, spool_path in uploads.items():
+        upload_queue.submit(blob.id, spool_path)
+    for spool_path, _, _ in spooled.values():
+        if spool_path not in uploads.values():
+            os.remove(spool_path)
+
+    return (
+        jsonify(
+            {
+                "success": True,
+                "data": {
+                    "number_of_records": len(pictures),
+                    "pictures": {
+                        index: picture_schema.dump(picture)
+                        for index, picture in pictures.items()
+                    },
+                    "errors": errors,
+                },
+            }
+        ),
+        201 if all(p.status == "ready" for p in pictures.values()) else 202,
+    )
+
+
+@pictures_bp.route("/flats/<int:flat_id>/pictures/upload-url", methods=["POST"])
+@token_landlord_required
+@validate_json_content_type
+@use_args(picture_upload_schema, error_status_code=400)
+def get_picture_upload_url(landlord_id: int, args: dict, flat_id: int):
+    flat = Flat.query.get_or_404(
+        flat_id, description=f"Flat with id {flat_id} not found"
+    )
+
+    if flat.landlord_id != landlord_id:
+        abort(404, description=f"Flat with id {flat_id} not found")
+
+    file_name = f"flat{flat_id}_{secure_filename(args['file_name'])}"
+
+    if not allowed_picture(file_name):
+        extensions = [e for e in current_app.config.get("ALLOWED_EXTENSIONS")]
+        abort(422, description=f"Not allowed picture extension ({extensions})")
+
+    content_types = current_app.config.get("PICTURE_CONTENT_TYPES")
+    if args["content_type"] not in content_types:
+        abort(422, description=f"Not allowed content type ({sorted(content_types)})")
+
+    if len(file_name) > 50:
+        abort(422, description="Picture name is too long")
+
+    picture_with_this_filename = Picture.query.filter(Picture.name == file_name).first()
+    if picture_with_this_filename is not None:
+        abort(409, description=f"Picture with name {args['file_name']} already exists")
+
+    storage = get_storage()
+    if not storage.direct_upload:
+        abort(
+            501,
+            description=f"Direct uploads are not supported by {storage.name} storage",
+        )
+
+    upload = storage.generate_upload(file_name, args["content_type"])
+
+    return jsonify(
+        {
+            "success": True,
+            "data": {
+                "name": file_name,
+                "url": upload["url"],
+                "fields": upload["fields"],
+                "max_size": current_app.config.get("PICTURE_UPLOAD_MAX_SIZE"),
+                "expires_in": current_app.config.get("PICTURE_UPLOAD_URL_EXPIRES"),
+            },
+        }
+    )
+
+
+@pictures_bp.route("/flats/<int:flat_id>/pictures/confirm", methods=["POST"])
+@token_landlord_required
+@idempotent
+@validate_json_content_type
+@use_args(picture_confirm_schema, error_status_code=400)
+def confirm_picture_upload(landlord_id: int, args: dict, flat_id: int):
+    flat = Flat.query.get_or_404(
+        flat_id, description=f"Flat with id {flat_id} not found"
     )
 
-    picture = Picture(name=file_name, path=str(file_url), flat_id=flat_id)
-    if description is not None and description != "":
+    if flat.landlord_id != landlord_id:
+        abort(404, description=f"Flat with id {flat_id} not found")
+
+    file_name = args["name"]
+    storage = get_storage()
+
+    metadata = None
+    if file_name.startswith(f"flat{flat_id}_"):
+        metadata = storage.get_metadata(file_name)
+    if metadata is None:
+        abort(404, description=f"Picture {file_name} has not been uploaded")
+
+    if metadata["size"] > current_app.config.get("PICTURE_UPLOAD_MAX_SIZE") or metadata[
+        "content_type"
+    ] not in current_app.config.get("PICTURE_CONTENT_TYPES"):
+        storage.delete(file_name)
+        abort(422, description=f"Picture {file_name} is not allowed")
+
+    picture = Picture(
+        name=file_name,
+        path=storage.url(file_name),
+        flat_id=flat_id,
+        status="pending",
+    )
+    description = args.get("description")
+    if description:
         picture.description = description
 
     db.session.add(picture)
-    db.session.commit()
+    commit_without_expire()
 
-    print("file: ", file)
-    print("file_name: ", file_name)
-    print("description: ", (description))
+    get_upload_queue().submit_direct_upload(picture.id, metadata["content_type"])
 
-    return jsonify({"success": True, "data": picture_schema.dump(picture)}), 201
+    return get_write_response(
+        picture_schema, picture, "pictures.get_picture", 202, picture_id=picture.id
+    )
 
 
 @pictures_bp.route("/pictures/<int:picture_id>", methods=["DELETE"])
@@ -119,18 +349,33 @@ def delete_picture(landlord_id: int, picture_id: int):
     if picture.flat.landlord_id != landlord_id:
         abort(404, description=f"Picture with id {picture_id} not found")
 
-    if not delete_file_from_s3(
-        current_app.config.get("S3_BUCKET"),
-        picture.name,
-        current_app.config.get("AWS_ACCESS_KEY_ID"),
-        current_app.config.get("AWS_SECRET_ACCESS_KEY"),
-    ):
-
-        abort(404, description=f"Picture with id {picture_id} not found in AWS S3")
-
-    db.session.delete(picture)
+    storage = get_storage()
+    if picture.blob_id is None:
+        if not storage.delete(picture.name):
+            abort(404, description=f"Picture with id {picture_id} not found in storage")
+        file_names = picture.file_names[1:]
+        db.session.delete(picture)
+    else:
+        db.session.delete(picture)
+        db.session.flush()
+        file_names = Blob.release([picture.blob_id])
     db.session.commit()
 
+    for file_name in file_names:
+        storage.delete(file_name)
+
     return jsonify(
         {"success": True, "data": f"Picture with id {picture_id} has been deleted"}
     )
+
+
+@pictures_bp.route("/storage/<path:file_name>", methods=["GET"])
+def get_storage_file(file_name: str):
+    """Files of the local storage (not found for S3 storage)"""
+    mimetype = None
+    if file_name.startswith("blobs/") and "." not in file_name:
+        blob = Blob.query.filter(Blob.sha256 == file_name.split("/", 1)[1]).first()
+        if blob is not None:
+            mimetype = blob.content_type
+
+    return get_storage().send(file_name, mimetype)
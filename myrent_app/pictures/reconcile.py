@@ -0,0 +1,161 @@
+import heapq
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+from typing import Iterator, Tuple
+
+from flask_sqlalchemy import BaseQuery
+from sqlalchemy.orm.attributes import InstrumentedAttribute
+
+from myrent_app import db
+from myrent_app.models import Blob, Picture
+from myrent_app.storage import get_storage
+
+# collations comparing strings by bytes, like the listing of S3 bucket
+BINARY_COLLATIONS = {"postgresql": '"C"', "mysql": "utf8mb4_bin", "sqlite": "BINARY"}
+
+
+def _iter_sorted(
+    query: BaseQuery, column: InstrumentedAttribute, chunk_size: int
+) -> Iterator[db.Model]:
+    """Yields rows of the query sorted by the column, read in keyset chunks"""
+    collation = BINARY_COLLATIONS.get(db.engine.dialect.name)
+    order = column.collate(collation) if collation else column
+    last_value = None
+    while True:
+        chunk_query = query
+        if last_value is not None:
+            chunk_query = chunk_query.filter(order > last_value)
+        chunk = chunk_query.order_by(order).limit(chunk_size).all()
+        if not chunk:
+            return
+        yield from chunk
+        last_value = getattr(chunk[-1], column.key)
+
+
+def iter_expected_files(
+    chunk_size: int, changed_before: datetime
+) -> Iterator[Tuple[str, bool, tuple]]:
+    """
+    Yields names of the files which should be in the storage sorted by name
+    with flag if the file must exist (its blob or picture is ready and was
+    not changed after changed_before) and (model, id) of the blob or picture
+    stored under this name (empty for the variants). Variant names always
+    sort after the name of their stored file, so only the variants of the
+    recent rows are kept in heap.
+    """
+    stored_files = heapq.merge(
+        _iter_sorted(
+            Picture.query.filter(Picture.blob_id.is_(None)), Picture.name, chunk_size
+        ),
+        _iter_sorted(Blob.query, Blob.sha256, chunk_size),
+        key=lambda stored_file: stored_file.key,
+    )
+
+    heap = []
+    for stored_file in stored_files:
+        while heap and heap[0][0] < stored_file.key:
+            yield heapq.heappop(heap)
+        changed = stored_file.updated or stored_file.created
+        required = stored_file.status == "ready" and changed < changed_before
+        owner = (type(stored_file).__name__, stored_file.id)
+        heapq.heappush(heap, (stored_file.key, required, owner))
+        for file_name in stored_file.file_names[1:]:
+            heapq.heappush(heap, (file_name, required, ()))
+    while heap:
+        yield heapq.heappop(heap)
+
+
+def diff_files(
+    stored_files: Iterator[Tuple[str, float]],
+    expected_files: Iterator[Tuple[str, bool, tuple]],
+) -> Iterator[Tuple[str, tuple]]:
+    """
+    Merges both sorted streams and yields ("orphaned", stored file) for files
+    without rows and ("missing", expected file) for required files which are
+    not in the storage
+    """
+    stored = next(stored_files, None)
+    expected = next(expected_files, None)
+    while stored is not None or expected is not None:
+        if expected is None or (stored is not None and stored[0] < expected[0]):
+            yield "orphaned", stored
+            stored = next(stored_files, None)
+        elif stored is None or expected[0] < stored[0]:
+            if expected[1]:
+                yield "missing", expected
+            expected = next(expected_files, None)
+        else:
+            stored = next(stored_files, None)
+            expected = next(expected_files, None)
+
+
+def _mark_failed(owner: tuple) -> None:
+    model, owner_id = owner
+    if model == "Blob":
+        Blob.query.filter(Blob.id == owner_id).update(
+            {Blob.status: "failed"}, synchronize_session=False
+        )
+        Picture.query.filter(Picture.blob_id == owner_id).update(
+            {Picture.status: "failed"}, synchronize_session=False
+        )
+    else:
+        Picture.query.filter(Picture.id == owner_id).update(
+            {Picture.status: "failed"}, synchronize_session=False
+        )
+
+
+def reconcile_storage(
+    dry_run: bool = False,
+    min_age: int = 24 * 60 * 60,
+    batch_size: int = 100,
+    pause: float = 1.0,
+    chunk_size: int = 1000,
+) -> Counter:
+    """
+    Compares the storage listing with the files of pictures and blobs in
+    constant memory. Orphaned files older than min_age seconds (younger ones
+    can be uploads in progress) are deleted in batches with a pause between
+    them, pictures whose files are missing are marked as failed unless their
+    rows were changed in the last min_age seconds (the listing can be older
+    than the row). With dry_run the differences are only reported. Returns
+    counts of the differences.
+    """
+    storage = get_storage()
+    now = time.time()
+    changed_before = datetime.utcnow() - timedelta(seconds=min_age)
+    counts = Counter()
+    orphaned_files = []
+
+    def delete_orphaned_files():
+        counts["deleted"] += storage.delete_files(orphaned_files)
+        print(f"Deleted {counts['deleted']} orphaned files")
+        orphaned_files.clear()
+
+    differences = diff_files(
+        storage.list_files(), iter_expected_files(chunk_size, changed_before)
+    )
+    for kind, (file_name, *details) in differences:
+        if kind == "orphaned":
+            if now - details[0] < min_age:
+                counts["recent"] += 1
+                continue
+            print(f"Orphaned file: {file_name}")
+            counts["orphaned"] += 1
+            if not dry_run:
+                orphaned_files.append(file_name)
+                if len(orphaned_files) >= batch_size:
+                    delete_orphaned_files()
+                    time.sleep(pause)
+        else:
+            print(f"Missing file: {file_name}")
+            counts["missing"] += 1
+            owner = details[1]
+            if not dry_run and owner:
+                _mark_failed(owner)
+                counts["failed"] += 1
+
+    if orphaned_files:
+        delete_orphaned_files()
+    db.session.commit()
+    return counts
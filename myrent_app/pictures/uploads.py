@@ -0,0 +1,200 @@
+import atexit
+import hashlib
+import os
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from typing import Tuple
+from uuid import uuid4
+
+from flask import Flask, current_app
+from werkzeug.datastructures import FileStorage
+
+from myrent_app import db
+from myrent_app.models import Blob, Picture
+from myrent_app.pictures.variants import store_picture_variants
+from myrent_app.storage import get_storage
+from myrent_app.utils import STREAM_CHUNK_SIZE
+
+_queue_lock = threading.Lock()
+
+
+class PictureUploadQueue:
+    """
+    Uploads picture blobs spooled on the local disk to the storage (or hashes
+    pictures uploaded directly to the storage) in a pool of
+    PICTURE_UPLOAD_WORKERS threads, retrying failed uploads, and marks the
+    blobs and their pictures as ready or failed
+    """
+
+    def __init__(self, app: Flask):
+        self.app = app
+        self.pid = os.getpid()
+        self.executor = ThreadPoolExecutor(
+            max_workers=app.config.get("PICTURE_UPLOAD_WORKERS"),
+            thread_name_prefix="picture-upload",
+        )
+        self.futures = set()
+        self.lock = threading.Lock()
+        atexit.register(self.drain)
+
+    def submit(self, blob_id: int, spool_path: str) -> Future:
+        return self._track(self.executor.submit(self._upload, blob_id, spool_path))
+
+    def submit_direct_upload(self, picture_id: int, content_type: str) -> Future:
+        """Queues the picture uploaded directly to the storage"""
+        return self._track(
+            self.executor.submit(self._store_direct_upload, picture_id, content_type)
+        )
+
+    def _track(self, future: Future) -> Future:
+        with self.lock:
+            self.futures.add(future)
+        future.add_done_callback(self._discard)
+        return future
+
+    def _discard(self, future: Future):
+        with self.lock:
+            self.futures.discard(future)
+
+    def drain(self, timeout: float = None) -> bool:
+        """Waits until all queued uploads are finished"""
+        with self.lock:
+            futures = list(self.futures)
+        not_done = wait(futures, timeout=timeout).not_done
+        return not not_done
+
+    def _upload(self, blob_id: int, spool_path: str):
+        with self.app.app_context():
+            try:
+                blob = Blob.query.get(blob_id)
+                if blob is not None:
+                    blob.status = self._upload_file(blob, spool_path)
+                    Picture.query.filter(Picture.blob_id == blob_id).update(
+                        {Picture.status: blob.status}, synchronize_session=False
+                    )
+                    db.session.commit()
+            except Exception as e:
+                print("Exception picture upload: ", e)
+                self._mark_failed(blob_id)
+            finally:
+                os.remove(spool_path)
+
+    def _store_direct_upload(self, picture_id: int, content_type: str):
+        """
+        Hashes the picture file uploaded directly to the storage, stores it as
+        a blob (with variants when the blob is new) and deletes the uploaded file
+        """
+        with self.app.app_context():
+            storage = get_storage()
+            try:
+                picture = Picture.query.get(picture_id)
+                if picture is None:
+                    return
+                sha256, size = self._hash_file(storage, picture.name)
+                blob, created = Blob.acquire(sha256, size, content_type)
+                if created or blob.status == "failed":
+                    storage.copy(picture.name, blob.key)
+                    store_picture_variants(blob)
+                    blob.status = "ready"
+                picture.blob = blob
+                picture.path = storage.url(blob.key)
+                picture.status = blob.status
+                db.session.commit()
+                storage.delete(picture.name)
+            except Exception as e:
+                print("Exception picture direct upload: ", e)
+                db.session.rollback()
+                Picture.query.filter(Picture.id == picture_id).update(
+                    {Picture.status: "failed"}, synchronize_session=False
+                )
+                db.session.commit()
+
+    @staticmethod
+    def _hash_file(storage, file_name: str) -> Tuple[str, int]:
+        sha256 = hashlib.sha256()
+        size = None
+        for _, chunks in storage.read_files([file_name]):
+            size = 0
+            for chunk in chunks:
+                sha256.update(chunk)
+                size += len(chunk)
+        if size is None:
+            raise FileNotFoundError(f"Picture {file_name} has not been uploaded")
+        return sha256.hexdigest(), size
+
+    @staticmethod
+    def _mark_failed(blob_id: int):
+        """
+        Marks the blob and its pictures as failed in a new transaction, so they
+        are not left pending and the next upload of the content retries it
+        """
+        db.session.rollback()
+        try:
+            Blob.query.filter(Blob.id == blob_id).update(
+                {Blob.status: "failed"}, synchronize_session=False
+            )
+            Picture.query.filter(Picture.blob_id == blob_id).update(
+                {Picture.status: "failed"}, synchronize_session=False
+            )
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            print("Exception picture status: ", e)
+
+    def _upload_file(self, blob: Blob, spool_path: str) -> str:
+        config = self.app.config
+        retries = config.get("PICTURE_UPLOAD_RETRIES")
+        for attempt in range(retries):
+            try:
+                get_storage().save_file(spool_path, blob.key, blob.content_type)
+                break
+            except Exception as e:
+                print(f"Exception picture upload (attempt {attempt + 1}): ", e)
+                if attempt + 1 < retries:
+                    time.sleep(config.get("PICTURE_UPLOAD_RETRY_DELAY") * 2**attempt)
+        else:
+            return "failed"
+
+        with open(spool_path, "rb") as file:
+            store_picture_variants(blob, file.read())
+        return "ready"
+
+
+def get_upload_queue() -> PictureUploadQueue:
+    app = current_app._get_current_object()
+    with _queue_lock:
+        upload_queue = app.extensions.get("picture_upload_queue")
+        if upload_queue is None or upload_queue.pid != os.getpid():
+            upload_queue = PictureUploadQueue(app)
+            app.extensions["picture_upload_queue"] = upload_queue
+    return upload_queue
+
+
+def spool_picture(file: FileStorage, file_name: str) -> Tuple[str, str, int]:
+    """
+    Saves the uploaded file in PICTURE_SPOOL_FOLDER computing its SHA-256
+    hash while streaming, returns path, hash and size of the file
+    """
+    folder = current_app.config.get("PICTURE_SPOOL_FOLDER")
+    os.makedirs(folder, exist_ok=True)
+    spool_path = os.path.join(folder, f"{uuid4().hex}_{file_name}")
+    sha256 = hashlib.sha256()
+    size = 0
+    with open(spool_path, "wb") as spool:
+        for chunk in iter(lambda: file.stream.read(STREAM_CHUNK_SIZE), b""):
+            sha256.update(chunk)
+            spool.write(chunk)
+            size += len(chunk)
+    return spool_path, sha256.hexdigest(), size
+
+
+def drain_picture_uploads(timeout: float = None) -> bool:
+    """
+    Waits for pictures queued in the current process, returns False when
+    some of them are still uploading after the timeout
+    """
+    upload_queue = current_app.extensions.get("picture_upload_queue")
+    if upload_queue is None or upload_queue.pid != os.getpid():
+        return True
+    return upload_queue.drain(timeout)
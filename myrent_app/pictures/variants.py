@@ -0,0 +1,80 @@
+import io
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Tuple
+
+from flask import current_app
+from PIL import Image, ImageOps
+
+from myrent_app.models import PICTURE_VARIANT_FORMATS, VariantsMixin
+from myrent_app.storage import get_storage
+
+VARIANT_CONTENT_TYPES = {"jpeg": "image/jpeg", "webp": "image/webp"}
+
+_pool_lock = threading.Lock()
+
+
+def resize_picture(
+    data: bytes, sizes: Dict[str, int], quality: int
+) -> Dict[Tuple[str, str], bytes]:
+    """
+    Returns (variant, format) -> encoded picture scaled down to fit the size
+    of the variant, rotated according to EXIF orientation and saved without
+    EXIF and other metadata (run in the process pool)
+    """
+    result = {}
+    with Image.open(io.BytesIO(data)) as image:
+        image = ImageOps.exif_transpose(image)
+        if image.mode != "RGB":
+            image = image.convert("RGB")
+        for variant, size in sizes.items():
+            resized = image.copy()
+            resized.thumbnail((size, size), Image.LANCZOS)
+            for file_format in PICTURE_VARIANT_FORMATS:
+                buffer = io.BytesIO()
+                resized.save(buffer, format=file_format, quality=quality)
+                result[(variant, file_format)] = buffer.getvalue()
+    return result
+
+
+def get_variants_pool() -> ProcessPoolExecutor:
+    """
+    Returns pool of PICTURE_VARIANTS_WORKERS processes shared by the app
+    in the current process (created again after fork)
+    """
+    app = current_app._get_current_object()
+    with _pool_lock:
+        pid, pool = app.extensions.get("picture_variants_pool", (None, None))
+        if pid != os.getpid():
+            pool = ProcessPoolExecutor(app.config.get("PICTURE_VARIANTS_WORKERS"))
+            app.extensions["picture_variants_pool"] = (os.getpid(), pool)
+    return pool
+
+
+def store_picture_variants(stored_file: VariantsMixin, data: bytes = None) -> bool:
+    """
+    Resizes the stored picture file (read from the storage when data is not given)
+    in the process pool, uploads the variants next to the original file
+    and sets names of the variants (blocks until the pool finishes, so it is
+    run by the background upload queue, not in requests)
+    """
+    sizes = current_app.config.get("PICTURE_VARIANTS")
+    quality = current_app.config.get("PICTURE_VARIANTS_QUALITY")
+    storage = get_storage()
+    try:
+        if data is None:
+            data = storage.read(stored_file.key)
+        variants = get_variants_pool().submit(resize_picture, data, sizes, quality)
+        for (variant, file_format), variant_data in variants.result().items():
+            storage.save_data(
+                variant_data,
+                stored_file.get_variant_name(stored_file.key, variant, file_format),
+                VARIANT_CONTENT_TYPES[file_format],
+            )
+    except Exception as e:
+        print("Exception store_picture_variants: ", e)
+        return False
+
+    stored_file.variants = ",".join(sizes)
+    return True
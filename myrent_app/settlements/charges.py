@@ -0,0 +1,142 @@
+import calendar
+from datetime import date, datetime
+from typing import Iterator, List, Tuple
+
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.sql.expression import Insert
+
+from myrent_app import db
+from myrent_app.models import Agreement, Flat, Settlement
+
+
+def get_period_bounds(period: str) -> Tuple[date, date]:
+    """
+    Returns the first and the last day of the period given as YYYY-MM
+    """
+    first_day = datetime.strptime(period, "%Y-%m").date()
+    last_day = first_day.replace(
+        day=calendar.monthrange(first_day.year, first_day.month)[1]
+    )
+    return first_day, last_day
+
+
+def calculate_charge(
+    price_value: float,
+    price_period: str,
+    date_from: date,
+    date_to: date,
+    period_start: date,
+    period_end: date,
+) -> Tuple[date, float]:
+    """
+    Returns the date and the value of the charge for the part of the period
+    covered by the agreement. Day prices are multiplied by the number of
+    covered days, month prices are prorated for partial months.
+    """
+    charge_from = max(date_from, period_start)
+    charge_to = min(date_to, period_end)
+    days = (charge_to - charge_from).days + 1
+
+    if price_period == "day":
+        value = price_value * days
+    else:
+        value = price_value * days / period_end.day
+
+    return charge_from, round(value, 2)
+
+
+def _iter_batches(rows: list, batch_size: int) -> Iterator[list]:
+    for i in range(0, len(rows), batch_size):
+        yield rows[i : i + batch_size]
+
+
+def get_due_charges(
+    period: str, landlord_id: int = None, shard: int = 0, shards: int = 1
+) -> List[dict]:
+    """
+    Returns charges due for the period for all agreements active in it which
+    have no generated charge for this period yet. Agreements can be split
+    between processes with shard/shards (agreement id modulo shards).
+    """
+    period_start, period_end = get_period_bounds(period)
+    already_charged = (
+        db.session.query(Settlement.id)
+        .filter(Settlement.agreement_id == Agreement.id)
+        .filter(Settlement.type == "charge")
+        .filter(Settlement.period == period)
+        .exists()
+    )
+
+    query = (
+        db.session.query(
+            Agreement.id,
+            Agreement.price_value,
+            Agreement.price_period,
+            Agreement.date_from,
+            Agreement.date_to,
+        )
+        .filter(Agreement.date_from <= period_end)
+        .filter(Agreement.date_to >= period_start)
+        .filter(~already_charged)
+    )
+    if landlord_id is not None:
+        query = query.join(Flat).filter(Flat.landlord_id == landlord_id)
+    if shards > 1:
+        query = query.filter(Agreement.id % shards == shard)
+
+    charges = []
+    for agreement_id, price_value, price_period, date_from, date_to in query:
+        charge_date, value = calculate_charge(
+            price_value, price_period, date_from, date_to, period_start, period_end
+        )
+        charges.append(
+            {
+                "type": "charge",
+                "value": value,
+                "date": charge_date,
+                "period": period,
+                "description": f"Charge for {period_start:%m/%Y}",
+                "agreement_id": agreement_id,
+            }
+        )
+    return charges
+
+
+def _insert_charges_statement() -> Insert:
+    """
+    Returns INSERT statement skipping charges which violate the unique index
+    of agreement, type and period (inserted by a concurrent run)
+    """
+    table = Settlement.__table__
+    dialect = db.engine.dialect.name
+    if dialect == "postgresql":
+        return postgresql.insert(table).on_conflict_do_nothing()
+    if dialect == "mysql":
+        return table.insert().prefix_with("IGNORE")
+    if dialect == "sqlite":
+        return table.insert().prefix_with("OR IGNORE")
+    return table.insert()
+
+
+def generate_charges(
+    period: str,
+    landlord_id: int = None,
+    shard: int = 0,
+    shards: int = 1,
+    batch_size: int = 1000,
+) -> int:
+    """
+    Inserts due charges for the period with bulk INSERT statements (one
+    transaction per batch) and returns the number of created charges.
+    Running it again for the same period, also concurrently, does not create
+    duplicates: charges already inserted by another run are skipped.
+    """
+    charges = get_due_charges(period, landlord_id, shard, shards)
+    statement = _insert_charges_statement()
+
+    number_of_charges = 0
+    for batch in _iter_batches(charges, batch_size):
+        number_of_charges += db.session.execute(statement, batch).rowcount
+        db.session.commit()
+
+    return number_of_charges
@@ -0,0 +1,163 @@
+import os
+import queue
+import threading
+import time
+from typing import List, Optional
+
+from flask import Flask, current_app, g
+
+from myrent_app import db
+from myrent_app.models import Settlement
+from myrent_app.utils import commit_without_expire
+
+_committer_lock = threading.Lock()
+
+GROUP_COMMIT_POLL_INTERVAL = 0.5
+
+
+class PendingSettlement:
+    def __init__(self, values: dict):
+        self.values = values
+        self.settlement = None
+        self.error = None
+        self.taken = False
+        self.cancelled = False
+        self.done = threading.Event()
+
+
+class SettlementGroupCommitter:
+    """
+    Collects settlements submitted by concurrent requests for
+    SETTLEMENT_GROUP_COMMIT_WINDOW seconds (or until
+    SETTLEMENT_GROUP_COMMIT_MAX_SIZE settlements) and inserts them in one
+    transaction, so one commit is paid for the whole group
+    """
+
+    def __init__(self, app: Flask):
+        self.app = app
+        self.window = app.config.get("SETTLEMENT_GROUP_COMMIT_WINDOW")
+        self.max_size = app.config.get("SETTLEMENT_GROUP_COMMIT_MAX_SIZE")
+        self.timeout = app.config.get("SETTLEMENT_GROUP_COMMIT_TIMEOUT")
+        self.pid = os.getpid()
+        self.queue = queue.Queue()
+        self.lock = threading.Lock()
+        self.thread = threading.Thread(
+            target=self._run, name="settlement-group-commit", daemon=True
+        )
+        self.thread.start()
+
+    def submit(self, values: dict) -> Optional[Settlement]:
+        """
+        Returns the committed settlement or None when the flusher thread has
+        not taken it within SETTLEMENT_GROUP_COMMIT_TIMEOUT seconds or has
+        stopped (then it is never inserted and can be committed directly)
+        """
+        pending = PendingSettlement(values)
+        self.queue.put(pending)
+        deadline = time.monotonic() + self.timeout
+        while not pending.done.wait(GROUP_COMMIT_POLL_INTERVAL):
+            if self.thread.is_alive() and time.monotonic() < deadline:
+                continue
+            with self.lock:
+                if not pending.taken:
+                    pending.cancelled = True
+                    return None
+            if not self.thread.is_alive():
+                raise RuntimeError("Settlement group commit thread has stopped")
+        if pending.error is not None:
+            raise pending.error
+        return pending.settlement
+
+    def _collect(self) -> List[PendingSettlement]:
+        batch = [self.queue.get()]
+        deadline = time.monotonic() + self.window
+        while len(batch) < self.max_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self.queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        with self.lock:
+            batch = [pending for pending in batch if not pending.cancelled]
+            for pending in batch:
+                pending.taken = True
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            try:
+                with self.app.app_context():
+                    self.flush(batch)
+            except Exception as exc:
+                print("Exception settlement group commit: ", exc)
+                for pending in batch:
+                    if not pending.done.is_set():
+                        pending.error = exc
+                        pending.done.set()
+
+    @staticmethod
+    def flush(batch: List[PendingSettlement]):
+        """
+        Inserts the settlements in one transaction, when it fails they are
+        inserted one by one so that only the invalid ones get the error
+        """
+        try:
+            for pending in batch:
+                pending.settlement = Settlement(**pending.values)
+                db.session.add(pending.settlement)
+            commit_without_expire()
+        except Exception:
+            db.session.rollback()
+            for pending in batch:
+                pending.settlement = Settlement(**pending.values)
+                db.session.add(pending.settlement)
+                try:
+                    commit_without_expire()
+                    db.session.expunge(pending.settlement)
+                except Exception as exc:
+                    db.session.rollback()
+                    pending.settlement = None
+                    pending.error = exc
+        finally:
+            db.session.expunge_all()
+            for pending in batch:
+                pending.done.set()
+
+
+def _get_committer() -> SettlementGroupCommitter:
+    app = current_app._get_current_object()
+    committer = app.extensions.get("settlement_group_commit")
+    if (
+        committer is None
+        or committer.pid != os.getpid()
+        or not committer.thread.is_alive()
+    ):
+        committer = SettlementGroupCommitter(app)
+        app.extensions["settlement_group_commit"] = committer
+    return committer
+
+
+def commit_settlement(values: dict) -> Settlement:
+    """
+    Inserts and commits the settlement, with SETTLEMENT_GROUP_COMMIT enabled
+    together with settlements of concurrent requests (not inside a batch
+    request which has its own transaction, and directly when the group is
+    not committed in time), returns the settlement attached to the session
+    of the request
+    """
+    if current_app.config.get("SETTLEMENT_GROUP_COMMIT") and not g.get(
+        "deferred_commit"
+    ):
+        with _committer_lock:
+            committer = _get_committer()
+        settlement = committer.submit(values)
+        if settlement is not None:
+            return db.session.merge(settlement, load=False)
+
+    settlement = Settlement(**values)
+    db.session.add(settlement)
+    commit_without_expire()
+    return settlement
@@ -0,0 +1,69 @@
+from datetime import date, datetime
+
+from myrent_app import db
+from myrent_app.models import Agreement, Overdue, Settlement
+from myrent_app.settlements.charges import get_period_bounds
+
+
+def detect_overdues(period: str, today: date = None) -> int:
+    """
+    Finds agreements active in the period whose charges up to the end of the
+    period are not covered by payments made until the payment deadline day
+    of the period and stores them (with the missing amount) in the overdues
+    table. The whole detection is one INSERT ... SELECT with GROUP BY over
+    settlements; previous results for the period are replaced.
+    Returns the number of overdue agreements.
+    """
+    today = today or date.today()
+    period_start, period_end = get_period_bounds(period)
+
+    charges = db.func.sum(
+        db.case(
+            [(Settlement.type == "charge", Settlement.value)],
+            else_=0,
+        )
+    )
+    paid_until_deadline = db.or_(
+        Settlement.date < period_start,
+        db.extract("day", Settlement.date) <= Agreement.payment_deadline,
+    )
+    payments = db.func.sum(
+        db.case(
+            [
+                (
+                    db.and_(Settlement.type == "payment", paid_until_deadline),
+                    Settlement.value,
+                )
+            ],
+            else_=0,
+        )
+    )
+
+    query = (
+        db.session.query(
+            Settlement.agreement_id,
+            db.literal(period),
+            charges - payments,
+            db.literal(datetime.utcnow()),
+        )
+        .join(Agreement)
+        .filter(Agreement.date_from <= period_end)
+        .filter(Agreement.date_to >= period_start)
+        .filter(Settlement.date <= period_end)
+        .group_by(Settlement.agreement_id)
+        .having(charges - payments > 0)
+    )
+    if period_start > today:
+        query = query.filter(db.false())
+    elif period_end >= today:
+        query = query.filter(Agreement.payment_deadline < today.day)
+
+    Overdue.query.filter(Overdue.period == period).delete(synchronize_session=False)
+    result = db.session.execute(
+        Overdue.__table__.insert().from_select(
+            ["agreement_id", "period", "amount", "created"], query.statement
+        )
+    )
+    db.session.commit()
+
+    return result.rowcount
@@ -1,4 +1,7 @@
-from flask import abort, jsonify
+from typing import Iterator
+
+from flask import Response, abort, jsonify, stream_with_context
+from flask_sqlalchemy import BaseQuery
 from webargs.flaskparser import use_args
 
 from myrent_app import db
@@ -8,15 +11,105 @@ from myrent_app.models import (
     Landlord,
     Settlement,
     SettlementSchema,
+    date_range_schema,
+    export_schema,
+    period_schema,
     settlement_schema,
 )
 from myrent_app.settlements import settlements_bp
+from myrent_app.settlements.charges import generate_charges
+from myrent_app.settlements.group_commit import commit_settlement
 from myrent_app.utils import (
+    CSV_MIMETYPE,
+    XLSX_MIMETYPE,
+    check_if_match,
+    commit_without_expire,
+    get_bulk_items,
+    get_bulk_response,
+    get_content_disposition,
+    get_write_response,
+    idempotent,
+    set_version_etag,
+    stream_csv,
+    stream_xlsx,
     token_landlord_required,
     token_landlord_tenant_required,
     validate_json_content_type,
 )
 
+STATEMENT_HEADER = [
+    "agreement",
+    "date",
+    "type",
+    "description",
+    "charge",
+    "payment",
+    "balance",
+]
+
+
+def _get_statement_query(args: dict) -> BaseQuery:
+    query = (
+        db.session.query(
+            Agreement.identifier,
+            Settlement.date,
+            Settlement.type,
+            Settlement.description,
+            Settlement.value,
+        )
+        .select_from(Settlement)
+        .join(Agreement)
+    )
+    if args.get("date_from") is not None:
+        query = query.filter(Settlement.date >= args["date_from"])
+    if args.get("date_to") is not None:
+        query = query.filter(Settlement.date <= args["date_to"])
+    return query
+
+
+def _get_statement_rows(query: BaseQuery) -> Iterator[list]:
+    """
+    Streams statement rows from a server-side cursor with running balance
+    (payments minus charges) counted separately for every agreement
+    """
+    query = query.order_by(Agreement.id, Settlement.date, Settlement.id).yield_per(1000)
+    current_agreement = None
+    balance = 0
+    for identifier, settlement_date, settlement_type, description, value in query:
+        if identifier != current_agreement:
+            current_agreement = identifier
+            balance = 0
+        charge = value if settlement_type == "charge" else None
+        payment = value if settlement_type == "payment" else None
+        balance += (payment or 0) - (charge or 0)
+        yield [
+            identifier,
+            settlement_date.strftime("%d-%m-%Y"),
+            settlement_type,
+            description,
+            charge,
+            payment,
+            round(balance, 2),
+        ]
+
+
+def _get_statement_response(
+    query: BaseQuery, file_format: str, file_name: str
+) -> Response:
+    rows = _get_statement_rows(query)
+    if file_format == "xlsx":
+        content, mimetype = stream_xlsx(STATEMENT_HEADER, rows), XLSX_MIMETYPE
+    else:
+        content, mimetype = stream_csv(STATEMENT_HEADER, rows), CSV_MIMETYPE
+
+    return Response(
+        stream_with_context(content),
+        mimetype=mimetype,
+        headers={
+            "Content-Disposition": get_content_disposition(f"{file_name}.{file_format}")
+        },
+    )
+
 
 @settlements_bp.route("/settlements", methods=["GET"])
 @token_landlord_tenant_required
@@ -62,6 +155,45 @@ def get_agreement_settlements(id_model_tuple: tuple, agreement_id: int):
     )
 
 
+@settlements_bp.route("/settlements/export", methods=["GET"])
+@token_landlord_required
+@use_args(export_schema, location="query", error_status_code=400)
+def export_settlements(landlord_id: int, args: dict):
+    query = (
+        _get_statement_query(args).join(Flat).filter(Flat.landlord_id == landlord_id)
+    )
+
+    return _get_statement_response(query, args["file_format"], "settlements")
+
+
+@settlements_bp.route(
+    "/agreements/<int:agreement_id>/statement.<any(csv, xlsx):file_format>",
+    methods=["GET"],
+)
+@token_landlord_tenant_required
+@use_args(date_range_schema, location="query", error_status_code=400)
+def get_agreement_statement(
+    id_model_tuple: tuple, args: dict, agreement_id: int, file_format: str
+):
+    agreement = Agreement.query.get_or_404(
+        agreement_id, description=f"Agreement {agreement_id} not found"
+    )
+
+    if id_model_tuple[1] == "landlords":
+        if agreement.flat.landlord_id != id_model_tuple[0]:
+            abort(404, description=f"Agreement {agreement_id} not found")
+
+    if id_model_tuple[1] == "tenants":
+        if agreement.tenant_id != id_model_tuple[0]:
+            abort(404, description=f"Agreement {agreement_id} not found")
+
+    query = _get_statement_query(args).filter(Settlement.agreement_id == agreement_id)
+
+    return _get_statement_response(
+        query, file_format, f"statement_{agreement.identifier}"
+    )
+
+
 @settlements_bp.route("/settlements/<int:settlement_id>", methods=["GET"])
 @token_landlord_tenant_required
 def get_settlement(id_model_tuple: tuple, settlement_id: int):
@@ -77,11 +209,14 @@ def get_settlement(id_model_tuple: tuple, settlement_id: int):
         if settlement.agreement.tenant_id != id_model_tuple[0]:
             abort(404, description=f"Settlement {settlement_id} not found")
 
-    return jsonify({"success": True, "data": settlement_schema.dump(settlement)})
+    response = jsonify({"success": True, "data": settlement_schema.dump(settlement)})
+
+    return set_version_etag(response, settlement)
 
 
 @settlements_bp.route("/agreements/<int:agreement_id>/settlements", methods=["POST"])
 @token_landlord_required
+@idempotent
 @validate_json_content_type
 @use_args(SettlementSchema(exclude=["agreement_id"]), error_status_code=400)
 def create_settlement(landlord_id: int, args: dict, agreement_id: int):
@@ -92,12 +227,62 @@ def create_settlement(landlord_id: int, args: dict, agreement_id: int):
     if agreement.flat.landlord_id != landlord_id:
         abort(404, description=f"Agreement {agreement_id} not found")
 
-    settlement = Settlement(agreement_id=agreement_id, **args)
+    settlement = commit_settlement(dict(args, agreement_id=agreement_id))
+
+    return get_write_response(
+        settlement_schema,
+        settlement,
+        "settlements.get_settlement",
+        201,
+        settlement_id=settlement.id,
+    )
+
+
+@settlements_bp.route(
+    "/agreements/<int:agreement_id>/settlements/bulk", methods=["POST"]
+)
+@token_landlord_required
+@validate_json_content_type
+def create_settlements(landlord_id: int, agreement_id: int):
+    agreement = Agreement.query.get_or_404(
+        agreement_id, description=f"Agreement {agreement_id} not found"
+    )
+
+    if agreement.flat.landlord_id != landlord_id:
+        abort(404, description=f"Agreement {agreement_id} not found")
+
+    items, errors = get_bulk_items(
+        SettlementSchema(many=True, exclude=["agreement_id"])
+    )
 
-    db.session.add(settlement)
+    db.session.bulk_insert_mappings(
+        Settlement,
+        [dict(item, agreement_id=agreement_id) for item in items.values()],
+    )
     db.session.commit()
 
-    return jsonify({"success": True, "data": settlement_schema.dump(settlement)}), 201
+    return get_bulk_response(len(items), errors)
+
+
+@settlements_bp.route("/settlements/charges", methods=["POST"])
+@token_landlord_required
+@validate_json_content_type
+@use_args(period_schema, error_status_code=400)
+def create_period_charges(landlord_id: int, args: dict):
+    number_of_charges = generate_charges(args["period"], landlord_id=landlord_id)
+
+    return (
+        jsonify(
+            {
+                "success": True,
+                "data": {
+                    "period": args["period"],
+                    "number_of_charges": number_of_charges,
+                },
+            }
+        ),
+        201,
+    )
 
 
 @settlements_bp.route("/settlements/<int:settlement_id>", methods=["PUT"])
@@ -111,6 +296,7 @@ def update_settlement(landlord_id: int, args: dict, settlement_id: int):
 
     if settlement.agreement.flat.landlord_id != landlord_id:
         abort(404, description=f"Settlement {settlement_id} not found")
+    check_if_match(settlement)
 
     settlement.type = args["type"]
     settlement.value = args["value"]
@@ -120,9 +306,14 @@ def update_settlement(landlord_id: int, args: dict, settlement_id: int):
     if description is not None:
         settlement.description = description
 
-    db.session.commit()
+    commit_without_expire()
 
-    return jsonify({"success": True, "data": settlement_schema.dump(settlement)})
+    return get_write_response(
+        settlement_schema,
+        settlement,
+        "settlements.get_settlement",
+        settlement_id=settlement.id,
+    )
 
 
 @settlements_bp.route("/settlements/<int:settlement_id>", methods=["DELETE"])
@@ -134,6 +325,7 @@ def delete_settlement(landlord_id: int, settlement_id: int):
 
     if settlement.agreement.flat.landlord_id != landlord_id:
         abort(404, description=f"Settlement {settlement_id} not found")
+    check_if_match(settlement)
 
     db.session.delete(settlement)
     db.session.commit()
@@ -156,13 +348,15 @@ def delete_agreement_settlements(landlord_id: int, agreement_id: int):
     if agreement.flat.landlord_id != landlord_id:
         abort(404, description=f"Agreement {agreement_id} not found")
 
-    for settlement in agreement.settlements:
-        db.session.delete(settlement)
+    deleted = Settlement.query.filter(Settlement.agreement_id == agreement_id).delete(
+        synchronize_session=False
+    )
     db.session.commit()
 
     return jsonify(
         {
             "success": True,
             "data": f"Settlements for agreement with id {agreement_id} has been deleted",
+            "deleted": {"settlements": deleted},
         }
     )
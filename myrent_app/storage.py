@@ -0,0 +1,392 @@
+import mimetypes
+import mmap
+import os
+import shutil
+import tempfile
+from abc import ABC, abstractmethod
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from flask import Response, abort, current_app, request, safe_join, send_file
+from werkzeug.wsgi import wrap_file
+
+from myrent_app.utils import (
+    STREAM_CHUNK_SIZE,
+    copy_file_in_s3,
+    delete_all_files_from_s3,
+    delete_file_from_s3,
+    delete_s3_batch,
+    download_data_from_s3,
+    download_files_from_s3,
+    generate_presigned_upload,
+    get_presigned_urls,
+    get_s3_client,
+    get_s3_file_metadata,
+    get_s3_file_url,
+    get_s3_transfer_config,
+    upload_data_to_s3,
+)
+
+
+class Storage(ABC):
+    """
+    Interface of the storage of picture files, implementations are selected
+    with STORAGE_BACKEND
+    """
+
+    name = None
+    direct_upload = False
+    private = False
+
+    @abstractmethod
+    def url(self, file_name: str) -> str:
+        raise NotImplementedError
+
+    def get_urls(self, file_names: Iterable[str]) -> Dict[str, str]:
+        """Returns urls for downloading the files (signed when private)"""
+        return {file_name: self.url(file_name) for file_name in file_names}
+
+    @abstractmethod
+    def save_file(self, path: str, file_name: str, content_type: str) -> str:
+        """Stores the local file under the name, returns its url"""
+        raise NotImplementedError
+
+    @abstractmethod
+    def save_data(self, data: bytes, file_name: str, content_type: str) -> str:
+        raise NotImplementedError
+
+    @abstractmethod
+    def read(self, file_name: str) -> bytes:
+        raise NotImplementedError
+
+    @abstractmethod
+    def read_files(
+        self, file_names: Iterable[str]
+    ) -> Iterator[Tuple[str, Iterator[bytes]]]:
+        """Yields name and content chunks of the files which exist"""
+        raise NotImplementedError
+
+    @abstractmethod
+    def copy(self, source_name: str, file_name: str) -> None:
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_metadata(self, file_name: str) -> Optional[dict]:
+        """Returns size and content type of the file or None"""
+        raise NotImplementedError
+
+    @abstractmethod
+    def delete(self, file_name: str) -> bool:
+        raise NotImplementedError
+
+    @abstractmethod
+    def delete_files(self, file_names: List[str]) -> int:
+        """Deletes the files at once, returns number of deleted files"""
+        raise NotImplementedError
+
+    @abstractmethod
+    def list_files(self) -> Iterator[Tuple[str, float]]:
+        """Yields name and modification time of all files sorted by name"""
+        raise NotImplementedError
+
+    @abstractmethod
+    def delete_all(self) -> str:
+        raise NotImplementedError
+
+    def generate_upload(self, file_name: str, content_type: str) -> dict:
+        """Returns presigned upload, only for storages with direct_upload"""
+        raise NotImplementedError
+
+    @abstractmethod
+    def send(self, file_name: str, mimetype: str = None) -> Response:
+        raise NotImplementedError
+
+
+class S3Storage(Storage):
+    """Files stored in the S3_BUCKET of AWS S3"""
+
+    name = "s3"
+    direct_upload = True
+
+    @property
+    def bucket_name(self) -> str:
+        return current_app.config.get("S3_BUCKET")
+
+    @property
+    def private(self) -> bool:
+        return current_app.config.get("S3_PRIVATE")
+
+    @property
+    def acl(self) -> str:
+        return "private" if self.private else "public-read"
+
+    @property
+    def credentials(self) -> Tuple[str, str]:
+        return (
+            current_app.config.get("AWS_ACCESS_KEY_ID"),
+            current_app.config.get("AWS_SECRET_ACCESS_KEY"),
+        )
+
+    def url(self, file_name: str) -> str:
+        return get_s3_file_url(self.bucket_name, file_name)
+
+    def get_urls(self, file_names: Iterable[str]) -> Dict[str, str]:
+        if not self.private:
+            return super().get_urls(file_names)
+        return get_presigned_urls(self.bucket_name, file_names)
+
+    def save_file(self, path: str, file_name: str, content_type: str) -> str:
+        get_s3_client().upload_file(
+            path,
+            self.bucket_name,
+            file_name,
+            ExtraArgs={"ACL": self.acl, "ContentType": content_type},
+            Config=get_s3_transfer_config(),
+        )
+        return self.url(file_name)
+
+    def save_data(self, data: bytes, file_name: str, content_type: str) -> str:
+        return upload_data_to_s3(
+            data, file_name, content_type, self.bucket_name, acl=self.acl
+        )
+
+    def read(self, file_name: str) -> bytes:
+        return download_data_from_s3(self.bucket_name, file_name)
+
+    def read_files(
+        self, file_names: Iterable[str]
+    ) -> Iterator[Tuple[str, Iterator[bytes]]]:
+        return download_files_from_s3(self.bucket_name, file_names, *self.credentials)
+
+    def copy(self, source_name: str, file_name: str) -> None:
+        copy_file_in_s3(self.bucket_name, source_name, file_name, acl=self.acl)
+
+    def get_metadata(self, file_name: str) -> Optional[dict]:
+        metadata = get_s3_file_metadata(self.bucket_name, file_name)
+        if metadata is None:
+            return None
+        return {
+            "size": metadata["ContentLength"],
+            "content_type": metadata.get("ContentType"),
+        }
+
+    def delete(self, file_name: str) -> bool:
+        return delete_file_from_s3(self.bucket_name, file_name, *self.credentials)
+
+    def delete_files(self, file_names: List[str]) -> int:
+        deleted, _ = delete_s3_batch(get_s3_client(), self.bucket_name, file_names)
+        return deleted
+
+    def list_files(self) -> Iterator[Tuple[str, float]]:
+        pages = (
+            get_s3_client()
+            .get_paginator("list_objects_v2")
+            .paginate(Bucket=self.bucket_name)
+        )
+        for page in pages:
+            for file in page.get("Contents", []):
+                yield file["Key"], file["LastModified"].timestamp()
+
+    def delete_all(self) -> str:
+        return delete_all_files_from_s3(self.bucket_name, *self.credentials)
+
+    def generate_upload(self, file_name: str, content_type: str) -> dict:
+        return generate_presigned_upload(
+            self.bucket_name, file_name, content_type, acl=self.acl
+        )
+
+    def send(self, file_name: str, mimetype: str = None) -> Response:
+        """
+        Files are downloaded from S3 itself (with presigned urls of the
+        pictures when private), so the app does not serve or sign any key
+        """
+        abort(404, description=f"File {file_name} not found")
+
+
+class LocalStorage(Storage):
+    """
+    Files stored in STORAGE_LOCAL_FOLDER and served by the app under
+    STORAGE_LOCAL_URL (or by the web server with X-Sendfile when
+    USE_X_SENDFILE is set or X-Accel-Redirect when STORAGE_LOCAL_ACCEL_REDIRECT
+    is set)
+    """
+
+    name = "local"
+
+    @property
+    def folder(self) -> str:
+        return str(current_app.config.get("STORAGE_LOCAL_FOLDER"))
+
+    def get_path(self, file_name: str) -> str:
+        return safe_join(self.folder, file_name)
+
+    def url(self, file_name: str) -> str:
+        return f"{current_app.config.get('STORAGE_LOCAL_URL').rstrip('/')}/{file_name}"
+
+    def _write(self, file_name: str, write) -> str:
+        """
+        Writes the file to a unique temporary file next to it and renames it,
+        so concurrent writes of the same name never mix and readers see
+        either the old or the new file
+        """
+        path = self.get_path(file_name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        os.close(fd)
+        os.chmod(temp_path, 0o644)
+        try:
+            write(temp_path)
+            os.replace(temp_path, path)
+        finally:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+        return self.url(file_name)
+
+    def save_file(self, path: str, file_name: str, content_type: str) -> str:
+        return self._write(
+            file_name, lambda temp_path: shutil.copyfile(path, temp_path)
+        )
+
+    def save_data(self, data: bytes, file_name: str, content_type: str) -> str:
+        def write(temp_path: str):
+            with open(temp_path, "wb") as file:
+                file.write(data)
+
+        return self._write(file_name, write)
+
+    def read(self, file_name: str) -> bytes:
+        with open(self.get_path(file_name), "rb") as file:
+            return file.read()
+
+    def _map(self, path: str) -> mmap.mmap:
+        """Maps the file to memory, so it is read through the page cache"""
+        with open(path, "rb") as file:
+            return mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def _iter_chunks(self, path: str) -> Iterator[bytes]:
+        if os.path.getsize(path) == 0:
+            return
+        with self._map(path) as mapped:
+            for start in range(0, len(mapped), STREAM_CHUNK_SIZE):
+                yield mapped[start : start + STREAM_CHUNK_SIZE]
+
+    def read_files(
+        self, file_names: Iterable[str]
+    ) -> Iterator[Tuple[str, Iterator[bytes]]]:
+        for file_name in file_names:
+            path = self.get_path(file_name)
+            if not os.path.isfile(path):
+                print(f"Exception read_files: file {file_name} does not exist")
+                continue
+            yield file_name, self._iter_chunks(path)
+
+    def copy(self, source_name: str, file_name: str) -> None:
+        source_path = self.get_path(source_name)
+        self._write(
+            file_name, lambda temp_path: shutil.copyfile(source_path, temp_path)
+        )
+
+    def get_metadata(self, file_name: str) -> Optional[dict]:
+        path = self.get_path(file_name)
+        if not os.path.isfile(path):
+            return None
+        return {
+            "size": os.path.getsize(path),
+            "content_type": mimetypes.guess_type(file_name)[0],
+        }
+
+    def delete(self, file_name: str) -> bool:
+        try:
+            os.remove(self.get_path(file_name))
+        except OSError as e:
+            print("Exception delete: ", e)
+            return False
+        return True
+
+    def delete_files(self, file_names: List[str]) -> int:
+        return sum(self.delete(file_name) for file_name in file_names)
+
+    def list_files(self) -> Iterator[Tuple[str, float]]:
+        if os.path.isdir(self.folder):
+            yield from self._list_folder(self.folder, "")
+
+    def _list_folder(self, folder: str, prefix: str) -> Iterator[Tuple[str, float]]:
+        """
+        Walks the folder in order of the full file names: a subfolder is
+        sorted as its name with "/", so its files are listed between the
+        files of the parent folder like in the listing of S3 bucket
+        """
+        with os.scandir(folder) as entries:
+            entries = sorted(
+                (entry.name + "/" if entry.is_dir() else entry.name, entry)
+                for entry in entries
+            )
+        for name, entry in entries:
+            if entry.is_dir():
+                yield from self._list_folder(entry.path, prefix + name)
+            else:
+                yield prefix + name, entry.stat().st_mtime
+
+    def delete_all(self) -> str:
+        if not os.path.isdir(self.folder) or not os.listdir(self.folder):
+            return f"Folder <{self.folder}> is already empty"
+        count = sum(len(files) for _, _, files in os.walk(self.folder))
+        shutil.rmtree(self.folder)
+        return f"All {count} files has been deleted from folder {self.folder}"
+
+    def send(self, file_name: str, mimetype: str = None) -> Response:
+        """
+        Sends the file with long Cache-Control and support of conditional
+        and byte range requests, delegating the transfer to the web server
+        when X-Accel-Redirect or X-Sendfile is configured
+        """
+        path = self.get_path(file_name)
+        if not os.path.isfile(path):
+            abort(404, description=f"File {file_name} not found")
+        mimetype = (
+            mimetype or mimetypes.guess_type(file_name)[0] or "application/octet-stream"
+        )
+        max_age = current_app.config.get("STORAGE_CACHE_MAX_AGE")
+
+        if current_app.use_x_sendfile:
+            return send_file(
+                path, mimetype=mimetype, conditional=True, cache_timeout=max_age
+            )
+
+        size = os.path.getsize(path)
+        accel_redirect = current_app.config.get("STORAGE_LOCAL_ACCEL_REDIRECT")
+        if accel_redirect:
+            response = current_app.response_class(mimetype=mimetype)
+            response.headers["X-Accel-Redirect"] = (
+                f"{accel_redirect.rstrip('/')}/{file_name}"
+            )
+        elif size == 0:
+            response = current_app.response_class(b"", mimetype=mimetype)
+        else:
+            response = current_app.response_class(
+                wrap_file(request.environ, self._map(path), STREAM_CHUNK_SIZE),
+                mimetype=mimetype,
+                direct_passthrough=True,
+            )
+            response.content_length = size
+
+        mtime = os.path.getmtime(path)
+        response.last_modified = mtime
+        response.set_etag(f"{mtime}-{size}")
+        response.cache_control.public = True
+        response.cache_control.max_age = max_age
+        if accel_redirect:
+            return response.make_conditional(request)
+        response.headers["Accept-Ranges"] = "bytes"
+        return response.make_conditional(
+            request, accept_ranges=True, complete_length=size
+        )
+
+
+STORAGE_BACKENDS = {S3Storage.name: S3Storage, LocalStorage.name: LocalStorage}
+
+
+def get_storage() -> Storage:
+    backend = current_app.config.get("STORAGE_BACKEND")
+    if backend not in STORAGE_BACKENDS:
+        raise RuntimeError(f"Unknown storage backend {backend}")
+    return STORAGE_BACKENDS[backend]()
@@ -3,6 +3,7 @@ from webargs.flaskparser import use_args
 
 from myrent_app import db
 from myrent_app.models import (
+    Agreement,
     Tenant,
     TenantSchema,
     tenant_schema,
@@ -10,7 +11,14 @@ from myrent_app.models import (
 )
 from myrent_app.tenants import tenants_bp
 from myrent_app.utils import (
+    check_if_match,
+    commit_without_expire,
     generate_hashed_password,
+    get_bulk_items,
+    get_bulk_response,
+    get_write_response,
+    reject_existing_values,
+    set_version_etag,
     token_landlord_required,
     token_landlord_tenant_required,
     validate_json_content_type,
@@ -37,7 +45,9 @@ def get_landlord_tenant(landlord_id: int, tenant_id: int):
     if tenant is None:
         abort(404, description=f"Tenant with id {tenant_id} not found")
 
-    return jsonify({"success": True, "data": tenant_schema.dump(tenant)})
+    response = jsonify({"success": True, "data": tenant_schema.dump(tenant)})
+
+    return set_version_etag(response, tenant)
 
 
 @tenants_bp.route("/tenants", methods=["POST"])
@@ -45,22 +55,44 @@ def get_landlord_tenant(landlord_id: int, tenant_id: int):
 @validate_json_content_type
 @use_args(TenantSchema(exclude=["landlord_id"]), error_status_code=400)
 def create_tenant(landlord_id: int, args: dict):
-    if Tenant.query.filter(Tenant.identifier == args["identifier"]).first():
-        abort(
-            409,
-            description=f'Tenant with identifier {args["identifier"]} already exists',
-        )
-
-    if Tenant.query.filter(Tenant.email == args["email"]).first():
-        abort(409, description=f'Tenant with email {args["email"]} already exists')
-
     args["password"] = generate_hashed_password(args["password"])
 
     new_tenant = Tenant(landlord_id=landlord_id, **args)
     db.session.add(new_tenant)
+    commit_without_expire()
+
+    return get_write_response(
+        tenant_schema,
+        new_tenant,
+        "tenants.get_landlord_tenant",
+        201,
+        tenant_id=new_tenant.id,
+    )
+
+
+@tenants_bp.route("/tenants/bulk", methods=["POST"])
+@token_landlord_required
+@validate_json_content_type
+def create_tenants(landlord_id: int):
+    items, errors = get_bulk_items(TenantSchema(many=True, exclude=["landlord_id"]))
+    reject_existing_values(
+        Tenant,
+        "identifier",
+        items,
+        errors,
+        "Tenant with identifier {} already exists",
+    )
+    reject_existing_values(
+        Tenant, "email", items, errors, "Tenant with email {} already exists"
+    )
+
+    for item in items.values():
+        item["password"] = generate_hashed_password(item["password"])
+        item["landlord_id"] = landlord_id
+    db.session.bulk_insert_mappings(Tenant, list(items.values()))
     db.session.commit()
 
-    return jsonify({"success": True, "data": tenant_schema.dump(new_tenant)}), 201
+    return get_bulk_response(len(items), errors)
 
 
 @tenants_bp.route("/tenants/login", methods=["POST"])
@@ -113,6 +145,7 @@ def update_tenant_password(id_model_tuple: tuple, args: dict, tenant_id: int):
         tenant = Tenant.query.get_or_404(
             tenant_id, description=f"Tenant with id {tenant_id} not found"
         )
+    check_if_match(tenant)
 
     if not tenant.is_password_valid(args["current_password"]):
         abort(401, description="Invalid password")
@@ -143,26 +176,7 @@ def update_tenant_data(id_model_tuple: tuple, args: dict, tenant_id: int):
         tenant = Tenant.query.get_or_404(
             tenant_id, description=f"Tenant with id {tenant_id} not found"
         )
-
-    tenant_with_this_identifier = Tenant.query.filter(
-        Tenant.identifier == args["identifier"]
-    ).first()
-    if (
-        tenant_with_this_identifier is not None
-        and tenant_with_this_identifier.identifier != tenant.identifier
-    ):
-        abort(
-            409,
-            description=f'Tenant with identifier {args["identifier"]}'
-            " already exists",
-        )
-
-    tenant_with_this_email = Tenant.query.filter(Tenant.email == args["email"]).first()
-    if (
-        tenant_with_this_email is not None
-        and tenant_with_this_email.email != tenant.email
-    ):
-        abort(409, description=f'Tenant with email {args["email"]}' " already exists")
+    check_if_match(tenant)
 
     tenant.identifier = args["identifier"]
     tenant.email = args["email"]
@@ -173,9 +187,13 @@ def update_tenant_data(id_model_tuple: tuple, args: dict, tenant_id: int):
     description = args.get("description")
     if description is not None:
         tenant.description = description
-    db.session.commit()
+    commit_without_expire()
 
-    return jsonify({"success": True, "data": tenant_schema.dump(tenant)})
+    if id_model_tuple[1] == "tenants":
+        return get_write_response(tenant_schema, tenant, "tenants.get_current_tenant")
+    return get_write_response(
+        tenant_schema, tenant, "tenants.get_landlord_tenant", tenant_id=tenant.id
+    )
 
 
 @tenants_bp.route("/tenants/<int:tenant_id>", methods=["DELETE"])
@@ -187,10 +205,21 @@ def delete_tenant(landlord_id: int, tenant_id: int):
 
     if tenant.landlord_id != landlord_id:
         abort(404, description=f"Tenant with id {tenant_id} not found")
-
-    db.session.delete(tenant)
+    check_if_match(tenant)
+
+    deleted = Agreement.delete_all(Agreement.tenant_id == tenant_id)
+    deleted["tenants"] = Tenant.query.filter(
+        Tenant.id == tenant_id, Tenant.version == tenant.version
+    ).delete(synchronize_session=False)
+    if not deleted["tenants"]:
+        db.session.rollback()
+        abort(412, description="Resource has been modified (ETag does not match)")
     db.session.commit()
 
     return jsonify(
-        {"success": True, "data": f"Tenant with id {tenant_id} has been deleted"}
+        {
+            "success": True,
+            "data": f"Tenant with id {tenant_id} has been deleted",
+            "deleted": deleted,
+        }
     )
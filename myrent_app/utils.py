@@ -1,20 +1,86 @@
+import csv
+import hashlib
+import io
+import json
+import os
 import re
+import threading
+import time
+import zipfile
+from collections import OrderedDict
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 from functools import wraps
-from typing import Tuple
+from itertools import chain
+from typing import Dict, Iterable, Iterator, List, Tuple
+from urllib.parse import quote
+from xml.sax.saxutils import escape
 
 import boto3
 import botocore
 import jwt
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config as BotocoreConfig
 from botocore.errorfactory import ClientError
-from flask import abort, current_app, request, url_for
+from flask import Response, abort, current_app, jsonify, request, url_for
 from flask_sqlalchemy import BaseQuery, DefaultMeta
+from marshmallow import Schema
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm.attributes import InstrumentedAttribute
 from sqlalchemy.sql.expression import BinaryExpression
 from werkzeug.datastructures import FileStorage
 from werkzeug.exceptions import UnsupportedMediaType
 from werkzeug.security import generate_password_hash
+from werkzeug.utils import secure_filename
+
+from myrent_app import db
+from myrent_app.models import IdempotencyKey
 
 COMPARISON_OPERATORS_RE = re.compile(r"(.*)\[(gte|lte|gt|lt)\]")
+IDEMPOTENCY_REPLAYED_HEADERS = [
+    "Content-Type",
+    "Location",
+    "ETag",
+    "Preference-Applied",
+]
+IDEMPOTENCY_POLL_INTERVAL = 0.05
+STREAM_CHUNK_SIZE = 64 * 1024
+CSV_MIMETYPE = "text/csv"
+XLSX_MIMETYPE = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+XLSX_STATIC_FILES = {
+    "[Content_Types].xml": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+        '<Default Extension="rels" '
+        'ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+        '<Default Extension="xml" ContentType="application/xml"/>'
+        '<Override PartName="/xl/workbook.xml" ContentType="application/'
+        'vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+        '<Override PartName="/xl/worksheets/sheet1.xml" ContentType="application/'
+        'vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+        "</Types>"
+    ),
+    "_rels/.rels": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/'
+        'relationships"><Relationship Id="rId1" Type="http://schemas.'
+        'openxmlformats.org/officeDocument/2006/relationships/officeDocument" '
+        'Target="xl/workbook.xml"/></Relationships>'
+    ),
+    "xl/workbook.xml": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+        'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/'
+        'relationships"><sheets><sheet name="Sheet1" sheetId="1" r:id="rId1"/>'
+        "</sheets></workbook>"
+    ),
+    "xl/_rels/workbook.xml.rels": (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/'
+        'relationships"><Relationship Id="rId1" Type="http://schemas.'
+        'openxmlformats.org/officeDocument/2006/relationships/worksheet" '
+        'Target="worksheets/sheet1.xml"/></Relationships>'
+    ),
+}
 
 
 def validate_json_content_type(func):
@@ -82,6 +148,131 @@ def token_landlord_tenant_required(func):
     return wrapper
 
 
+def _get_request_hash() -> str:
+    """
+    Hashes method, path and content of the request, multipart requests by
+    their form fields and names and SHA-256 of their files, because the
+    boundary of the raw body changes with every retry
+    """
+    request_hash = hashlib.sha256(f"{request.method} {request.path}".encode())
+    if request.mimetype != "multipart/form-data":
+        request_hash.update(request.get_data())
+        return request_hash.hexdigest()
+
+    fields = sorted(request.form.items(multi=True))
+    for field, file in request.files.items(multi=True):
+        file_hash = hashlib.sha256()
+        for chunk in iter(lambda: file.stream.read(STREAM_CHUNK_SIZE), b""):
+            file_hash.update(chunk)
+        file.stream.seek(0)
+        fields.append((field, file.filename, file_hash.hexdigest()))
+    request_hash.update(json.dumps(fields).encode())
+    return request_hash.hexdigest()
+
+
+def _reserve_idempotency_key(
+    landlord_id: int, key: str, request_hash: str
+) -> IdempotencyKey:
+    """
+    Returns the stored record of the key or inserts a new one (with empty
+    status_code) which locks the key, concurrent requests with the same key
+    wait until the response is stored
+    """
+    timeout = current_app.config.get("IDEMPOTENCY_LOCK_TIMEOUT")
+    deadline = time.monotonic() + timeout
+    while True:
+        record = (
+            IdempotencyKey.query.populate_existing()
+            .filter(IdempotencyKey.landlord_id == landlord_id)
+            .filter(IdempotencyKey.key == key)
+            .first()
+        )
+
+        if record is None:
+            record = IdempotencyKey(
+                landlord_id=landlord_id, key=key, request_hash=request_hash
+            )
+            db.session.add(record)
+            try:
+                db.session.commit()
+                return record
+            except IntegrityError:
+                db.session.rollback()
+                continue
+
+        if record.is_expired():
+            db.session.delete(record)
+            db.session.commit()
+            continue
+
+        if record.request_hash != request_hash:
+            abort(
+                400,
+                description="Idempotency-Key has been used with a different request",
+            )
+
+        if record.status_code is not None:
+            return record
+
+        if time.monotonic() > deadline:
+            abort(409, description="Request with this Idempotency-Key is in progress")
+        db.session.rollback()
+        time.sleep(IDEMPOTENCY_POLL_INTERVAL)
+
+
+def idempotent(func):
+    """
+    Makes a landlord write request idempotent with header Idempotency-Key:
+    the response is stored and replayed for retries with the same key
+    (used below token_landlord_required)
+    """
+
+    @wraps(func)
+    def wrapper(landlord_id: int, *args, **kwargs):
+        key = request.headers.get("Idempotency-Key")
+        if key is None:
+            return func(landlord_id, *args, **kwargs)
+        if not 0 < len(key) <= 255:
+            abort(400, description="Idempotency-Key must have 1-255 characters")
+
+        record = _reserve_idempotency_key(landlord_id, key, _get_request_hash())
+        if record.status_code is not None:
+            response = Response(
+                record.body,
+                status=record.status_code,
+                headers=json.loads(record.headers),
+            )
+            response.headers["Idempotent-Replayed"] = "true"
+            return response
+
+        try:
+            response = current_app.make_response(func(landlord_id, *args, **kwargs))
+        except Exception:
+            db.session.rollback()
+            db.session.delete(record)
+            db.session.commit()
+            raise
+
+        if response.status_code >= 500:
+            db.session.delete(record)
+            db.session.commit()
+            return response
+
+        headers = {
+            header: response.headers[header]
+            for header in IDEMPOTENCY_REPLAYED_HEADERS
+            if header in response.headers
+        }
+        record.status_code = response.status_code
+        record.headers = json.dumps(headers)
+        record.body = response.get_data(as_text=True)
+        db.session.commit()
+
+        return response
+
+    return wrapper
+
+
 def get_schema_args(model: DefaultMeta) -> dict:
     fields = request.args.get("fields")
     schema_args = {"many": True}
@@ -175,6 +366,132 @@ def get_pagination(query: BaseQuery, func_name: str) -> Tuple[list, dict]:
     return paginate_obj.items, pagination
 
 
+def get_bulk_items(schema: Schema) -> Tuple[Dict[int, dict], Dict[int, dict]]:
+    """
+    Validates JSON list of items with the schema (many=True), returns valid
+    items and validation errors, both keyed by the item index in the list
+    """
+    data = request.get_json()
+    max_items = current_app.config.get("BULK_MAX_ITEMS", 500)
+    if not isinstance(data, list) or not data:
+        abort(400, description="Expected a non-empty list of items")
+    if len(data) > max_items:
+        abort(400, description=f"Too many items (maximum {max_items})")
+
+    errors = schema.validate(data)
+    valid_data = [item for index, item in enumerate(data) if index not in errors]
+    valid_indexes = [index for index in range(len(data)) if index not in errors]
+    items = dict(zip(valid_indexes, schema.load(valid_data)))
+
+    return items, errors
+
+
+def reject_existing_values(
+    model: DefaultMeta,
+    field: str,
+    items: Dict[int, dict],
+    errors: Dict[int, dict],
+    message: str,
+) -> None:
+    """
+    Moves items with the field value already used in the database (checked
+    with one IN query) or repeated in the list from items to errors
+    """
+    column = getattr(model, field)
+    values = [item[field] for item in items.values()]
+    existing_values = {
+        value
+        for (value,) in model.query.with_entities(column).filter(column.in_(values))
+    }
+
+    seen_values = set()
+    for index, item in list(items.items()):
+        value = item[field]
+        if value in existing_values or value in seen_values:
+            errors.setdefault(index, {})[field] = [message.format(value)]
+            del items[index]
+        seen_values.add(value)
+
+
+def get_bulk_response(number_of_records: int, errors: Dict[int, dict]) -> Response:
+    if number_of_records == 0:
+        abort(400, description=errors)
+
+    return (
+        jsonify(
+            {
+                "success": True,
+                "data": {"number_of_records": number_of_records, "errors": errors},
+            }
+        ),
+        201,
+    )
+
+
+def commit_without_expire() -> None:
+    """
+    Commits the session of the request without expiring the loaded objects,
+    so the written resource is dumped from its in-memory state without
+    reloading it, other commits expire the objects as usual
+    """
+    session = db.session()
+    session.expire_on_commit = False
+    try:
+        session.commit()
+    finally:
+        session.expire_on_commit = True
+
+
+def get_write_response(
+    schema: Schema, item: DefaultMeta, endpoint: str, status: int = 200, **values
+) -> Response:
+    """
+    Returns response of a write request: for requests with header
+    Prefer: return=minimal empty 204 response with Location of the resource,
+    otherwise the resource dumped with the schema from its in-memory state
+    (committed with commit_without_expire)
+    """
+    location = url_for(endpoint, **values)
+
+    if "return=minimal" in request.headers.get("Prefer", ""):
+        response = Response(status=204)
+        response.headers["Location"] = location
+        response.headers["Preference-Applied"] = "return=minimal"
+        return set_version_etag(response, item)
+
+    response = jsonify({"success": True, "data": schema.dump(item)})
+    response.status_code = status
+    if status in [201, 202]:
+        response.headers["Location"] = location
+    return set_version_etag(response, item)
+
+
+def set_version_etag(response: Response, item: DefaultMeta) -> Response:
+    """
+    Sets ETag header of the response to the version of the item
+    """
+    version = getattr(item, "version", None)
+    if version is not None:
+        response.set_etag(str(version))
+    return response
+
+
+def check_if_match(item: DefaultMeta) -> None:
+    """
+    Compares header If-Match with the version of the loaded item (412 when
+    it does not match, 428 when it is missing and REQUIRE_IF_MATCH is set).
+    The following UPDATE/DELETE is made only if the row still has this
+    version, so no additional read is needed.
+    """
+    if not request.headers.get("If-Match"):
+        if current_app.config.get("REQUIRE_IF_MATCH", False):
+            abort(428, description="Header If-Match is required")
+        return
+
+    if not request.if_match.contains(str(item.version)):
+        abort(412, description="Resource has been modified (ETag does not match)")
+
+
 def generate_hashed_password(password: str) -> str:
     return generate_password_hash(password)
 
@@ -185,6 +502,66 @@ def allowed_picture(filename: str) -> bool:
     ].lower() in current_app.config.get("ALLOWED_EXTENSIONS")
 
 
+_s3_client_lock = threading.Lock()
+
+
+def _create_s3_client(aws_access_key_id: str, aws_secret_access_key: str):
+    config = current_app.config
+    options = {
+        "max_pool_connections": config.get("S3_MAX_POOL_CONNECTIONS"),
+        "retries": {
+            "mode": config.get("S3_RETRY_MODE"),
+            "max_attempts": config.get("S3_MAX_ATTEMPTS"),
+        },
+    }
+    if "tcp_keepalive" in BotocoreConfig.OPTION_DEFAULTS:
+        options["tcp_keepalive"] = config.get("S3_TCP_KEEPALIVE")
+
+    session = boto3.session.Session(
+        aws_access_key_id=aws_access_key_id,
+        aws_secret_access_key=aws_secret_access_key,
+        region_name=config.get("S3_REGION"),
+    )
+    return session.client(
+        "s3",
+        endpoint_url=config.get("S3_ENDPOINT_URL"),
+        config=BotocoreConfig(**options),
+    )
+
+
+def get_s3_client(aws_access_key_id: str = None, aws_secret_access_key: str = None):
+    """
+    Returns S3 client shared by the app in the current process (created once
+    per worker and again after fork), so its connection pool, credentials
+    and endpoint are reused by all requests and commands
+    """
+    if aws_access_key_id is None:
+        aws_access_key_id = current_app.config.get("AWS_ACCESS_KEY_ID")
+        aws_secret_access_key = current_app.config.get("AWS_SECRET_ACCESS_KEY")
+
+    clients = current_app.extensions.setdefault("s3_clients", {})
+    key = (os.getpid(), aws_access_key_id, aws_secret_access_key)
+    client = clients.get(key)
+    if client is None:
+        with _s3_client_lock:
+            client = clients.get(key)
+            if client is None:
+                for stale_key in [k for k in clients if k[0] != os.getpid()]:
+                    del clients[stale_key]
+                client = _create_s3_client(aws_access_key_id, aws_secret_access_key)
+                clients[key] = client
+    return client
+
+
+def get_s3_transfer_config() -> TransferConfig:
+    config = current_app.config
+    return TransferConfig(
+        multipart_threshold=config.get("S3_MULTIPART_THRESHOLD"),
+        multipart_chunksize=config.get("S3_MULTIPART_CHUNKSIZE"),
+        max_concurrency=config.get("S3_MAX_CONCURRENCY"),
+    )
+
+
 def upload_file_to_s3(
     file: FileStorage,
     file_name: str,
@@ -194,11 +571,7 @@ def upload_file_to_s3(
     acl="public-read",
 ) -> str:
 
-    s3 = boto3.client(
-        "s3",
-        aws_access_key_id=aws_access_key_id,
-        aws_secret_access_key=aws_secret_access_key,
-    )
+    s3 = get_s3_client(aws_access_key_id, aws_secret_access_key)
 
     try:
         s3.upload_fileobj(
@@ -206,13 +579,127 @@ def upload_file_to_s3(
             bucket_name,
             file_name,
             ExtraArgs={"ACL": acl, "ContentType": file.content_type},
+            Config=get_s3_transfer_config(),
         )
     except Exception as e:
         print("Exception upload_file_to_s3: ", e)
         return e
 
-    file_url = f"http://{bucket_name}.s3.amazonaws.com/{file_name}"
-    return file_url
+    return get_s3_file_url(bucket_name, file_name)
+
+
+def upload_data_to_s3(
+    data: bytes,
+    file_name: str,
+    content_type: str,
+    bucket_name: str,
+    acl="public-read",
+) -> str:
+    get_s3_client().put_object(
+        Bucket=bucket_name,
+        Key=file_name,
+        Body=data,
+        ACL=acl,
+        ContentType=content_type,
+    )
+    return get_s3_file_url(bucket_name, file_name)
+
+
+def copy_file_in_s3(
+    bucket_name: str, source_name: str, file_name: str, acl="public-read"
+) -> None:
+    get_s3_client().copy_object(
+        Bucket=bucket_name,
+        Key=file_name,
+        CopySource={"Bucket": bucket_name, "Key": source_name},
+        ACL=acl,
+    )
+
+
+def get_s3_file_url(bucket_name: str, file_name: str) -> str:
+    return f"http://{bucket_name}.s3.amazonaws.com/{file_name}"
+
+
+_presigned_urls_lock = threading.Lock()
+
+
+def get_presigned_urls(bucket_name: str, file_names: Iterable[str]) -> Dict[str, str]:
+    """
+    Returns presigned GET urls of the files valid for S3_PRESIGNED_URL_EXPIRES
+    seconds; urls are cached by the app and reused until less than
+    S3_PRESIGNED_URL_MIN_TTL seconds are left, so only missing ones are signed
+    """
+    config = current_app.config
+    expires = config.get("S3_PRESIGNED_URL_EXPIRES")
+    now = time.time()
+    cache = current_app.extensions.setdefault("presigned_urls", OrderedDict())
+
+    urls = {}
+    with _presigned_urls_lock:
+        for file_name in file_names:
+            cached = cache.get((bucket_name, file_name))
+            if cached is not None and cached[1] - now >= config.get(
+                "S3_PRESIGNED_URL_MIN_TTL"
+            ):
+                urls[file_name] = cached[0]
+            else:
+                urls[file_name] = None
+    missing = [file_name for file_name, url in urls.items() if url is None]
+    if not missing:
+        return urls
+
+    s3 = get_s3_client()
+    for file_name in missing:
+        urls[file_name] = s3.generate_presigned_url(
+            "get_object",
+            Params={"Bucket": bucket_name, "Key": file_name},
+            ExpiresIn=expires,
+        )
+
+    with _presigned_urls_lock:
+        for file_name in missing:
+            cache[(bucket_name, file_name)] = (urls[file_name], now + expires)
+            cache.move_to_end((bucket_name, file_name))
+        while len(cache) > config.get("S3_PRESIGNED_URL_CACHE_SIZE"):
+            cache.popitem(last=False)
+    return urls
+
+
+def generate_presigned_upload(
+    bucket_name: str, file_name: str, content_type: str, acl="public-read"
+) -> dict:
+    """
+    Returns url and form fields of presigned POST, which lets the client
+    upload the file directly to S3 with the given content type and at most
+    PICTURE_UPLOAD_MAX_SIZE bytes
+    """
+    return get_s3_client().generate_presigned_post(
+        bucket_name,
+        file_name,
+        Fields={"acl": acl, "Content-Type": content_type},
+        Conditions=[
+            {"acl": acl},
+            {"Content-Type": content_type},
+            [
+                "content-length-range",
+                1,
+                current_app.config.get("PICTURE_UPLOAD_MAX_SIZE"),
+            ],
+        ],
+        ExpiresIn=current_app.config.get("PICTURE_UPLOAD_URL_EXPIRES"),
+    )
+
+
+def get_s3_file_metadata(bucket_name: str, file_name: str) -> dict:
+    """
+    Returns metadata of the file (HEAD request) or None when it does not exist
+    """
+    try:
+        return get_s3_client().head_object(Bucket=bucket_name, Key=file_name)
+    except ClientError as e:
+        if e.response["Error"]["Code"] in ["404", "NoSuchKey"]:
+            return None
+        raise
 
 
 def delete_file_from_s3(
@@ -220,11 +707,7 @@ def delete_file_from_s3(
 ) -> bool:
     result = False
 
-    s3 = boto3.client(
-        "s3",
-        aws_access_key_id=aws_access_key_id,
-        aws_secret_access_key=aws_secret_access_key,
-    )
+    s3 = get_s3_client(aws_access_key_id, aws_secret_access_key)
 
     try:
         s3.delete_object(Bucket=bucket_name, Key=file_name)
@@ -236,31 +719,199 @@ def delete_file_from_s3(
     return result
 
 
+def delete_s3_batch(s3, bucket_name: str, keys: List[str]) -> Tuple[int, int]:
+    """Deletes up to 1000 files in one request, returns deleted and failed count"""
+    response = s3.delete_objects(
+        Bucket=bucket_name,
+        Delete={"Objects": [{"Key": key} for key in keys], "Quiet": True},
+    )
+    errors = response.get("Errors", [])
+    for error in errors[:5]:
+        print(f"Exception delete_all_files_from_s3: {error['Key']} {error['Message']}")
+    return len(keys) - len(errors), len(errors)
+
+
 def delete_all_files_from_s3(
     bucket_name: str, aws_access_key_id: str, aws_secret_access_key: str
 ) -> str:
+    """
+    Pages through the whole bucket and deletes the listed files in batches
+    of S3_DELETE_BATCH_SIZE (at most 1000) on S3_DELETE_WORKERS threads,
+    printing progress after every batch
+    """
     result = "start function delete_all_files_from_s3"
+    config = current_app.config
+    workers = config.get("S3_DELETE_WORKERS")
+    deleted = failed = 0
 
     try:
-        s3 = boto3.client(
-            "s3",
-            aws_access_key_id=aws_access_key_id,
-            aws_secret_access_key=aws_secret_access_key,
+        s3 = get_s3_client(aws_access_key_id, aws_secret_access_key)
+        pages = s3.get_paginator("list_objects_v2").paginate(
+            Bucket=bucket_name,
+            PaginationConfig={"PageSize": config.get("S3_DELETE_BATCH_SIZE")},
         )
 
-        response = s3.list_objects_v2(Bucket=bucket_name)
-        if "Contents" in response:
-            i = 0
-            for file in response["Contents"]:
-                i += 1
-                # print('Deleting', file['Key'])
-                s3.delete_object(Bucket=bucket_name, Key=file["Key"])
-            result = f"All {i} files has been deleted from s3 bucket {bucket_name}"
-
+        with ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="s3-delete"
+        ) as executor:
+            pending = set()
+
+            def collect(futures):
+                nonlocal deleted, failed
+                for future in futures:
+                    batch_deleted, batch_failed = future.result()
+                    deleted += batch_deleted
+                    failed += batch_failed
+                    print(f"Deleted {deleted} files from s3 bucket {bucket_name}")
+
+            for page in pages:
+                keys = [file["Key"] for file in page.get("Contents", [])]
+                if not keys:
+                    continue
+                if len(pending) >= 2 * workers:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    collect(done)
+                pending.add(executor.submit(delete_s3_batch, s3, bucket_name, keys))
+            collect(wait(pending).done)
+
+        if failed:
+            result = (
+                f"{deleted} files has been deleted from s3 bucket {bucket_name}, "
+                f"{failed} files could not be deleted"
+            )
+        elif deleted:
+            result = (
+                f"All {deleted} files has been deleted from s3 bucket {bucket_name}"
+            )
         else:
             result = f"Bucket <{bucket_name}> is already empty"
 
     except Exception as e:
-        result = f"Exception delete_all_files_from_s3: {e}"
+        result = f"Exception delete_all_files_from_s3 ({deleted} files deleted): {e}"
 
     return result
+
+
+class StreamBuffer:
+    """
+    Class StreamBuffer is a write-only file-like object which keeps written
+    bytes until they are taken by pop() (used to stream files produced
+    by writers like zipfile chunk by chunk)
+    """
+
+    def __init__(self):
+        self._chunks = []
+        self.size = 0
+
+    def write(self, data: bytes) -> int:
+        self._chunks.append(bytes(data))
+        self.size += len(data)
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def pop(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks = []
+        self.size = 0
+        return data
+
+
+def get_content_disposition(file_name: str) -> str:
+    """
+    Returns attachment Content-Disposition with ASCII filename for old clients
+    and UTF-8 filename* (RFC 5987) keeping the original name
+    """
+    ascii_name = secure_filename(file_name) or "download"
+    quoted_name = quote(file_name, safe="")
+    return f"attachment; filename=\"{ascii_name}\"; filename*=UTF-8''{quoted_name}"
+
+
+def stream_csv(header: list, rows: Iterable[list]) -> Iterator[bytes]:
+    """
+    Generates CSV file content in chunks, keeping in memory only one chunk
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for row in chain([header], rows):
+        writer.writerow(row)
+        if buffer.tell() >= STREAM_CHUNK_SIZE:
+            yield buffer.getvalue().encode()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue().encode()
+
+
+def _get_xlsx_row(row: list) -> str:
+    cells = []
+    for value in row:
+        if value is None:
+            cells.append("<c/>")
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            cells.append(f"<c><v>{value}</v></c>")
+        else:
+            cells.append(f'<c t="inlineStr"><is><t>{escape(str(value))}</t></is></c>')
+    return f"<row>{''.join(cells)}</row>"
+
+
+def stream_xlsx(header: list, rows: Iterable[list]) -> Iterator[bytes]:
+    """
+    Generates XLSX file (one sheet, inline strings) in chunks, writing the
+    zip archive directly to the stream, keeping in memory only one chunk
+    """
+    buffer = StreamBuffer()
+    with zipfile.ZipFile(buffer, mode="w", compression=zipfile.ZIP_DEFLATED) as xlsx:
+        for name, content in XLSX_STATIC_FILES.items():
+            xlsx.writestr(name, content)
+        with xlsx.open("xl/worksheets/sheet1.xml", mode="w") as sheet:
+            sheet.write(
+                b'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+                b'<worksheet xmlns="http://schemas.openxmlformats.org/'
+                b'spreadsheetml/2006/main"><sheetData>'
+            )
+            for row in chain([header], rows):
+                sheet.write(_get_xlsx_row(row).encode())
+                if buffer.size >= STREAM_CHUNK_SIZE:
+                    yield buffer.pop()
+            sheet.write(b"</sheetData></worksheet>")
+    yield buffer.pop()
+
+
+def stream_zip(entries: Iterable[Tuple[str, Iterable[bytes]]]) -> Iterator[bytes]:
+    """
+    Generates zip archive from (file name, file content chunks) entries,
+    writing every entry while its content is produced and keeping
+    in memory only one chunk
+    """
+    buffer = StreamBuffer()
+    with zipfile.ZipFile(buffer, mode="w", compression=zipfile.ZIP_DEFLATED) as archive:
+        for name, chunks in entries:
+            with archive.open(name, mode="w", force_zip64=True) as file:
+                for chunk in chunks:
+                    file.write(chunk)
+                    if buffer.size >= STREAM_CHUNK_SIZE:
+                        yield buffer.pop()
+            yield buffer.pop()
+    yield buffer.pop()
+
+
+def download_data_from_s3(bucket_name: str, file_name: str) -> bytes:
+    return get_s3_client().get_object(Bucket=bucket_name, Key=file_name)["Body"].read()
+
+
+def download_files_from_s3(
+    bucket_name: str,
+    file_names: Iterable[str],
+    aws_access_key_id: str,
+    aws_secret_access_key: str,
+) -> Iterator[Tuple[str, Iterator[bytes]]]:
+    s3 = get_s3_client(aws_access_key_id, aws_secret_access_key)
+
+    for file_name in file_names:
+        try:
+            body = s3.get_object(Bucket=bucket_name, Key=file_name)["Body"]
+        except Exception as e:
+            print("Exception download_files_from_s3: ", e)
+            continue
+        yield file_name, body.iter_chunks(STREAM_CHUNK_SIZE)
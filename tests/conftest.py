@@ -3,11 +3,14 @@ import os
 from myrent_app import create_app, db
 from config import base_dir
 from myrent_app.commands.db_manage_commnands import add_data
+from moto import mock_s3
+from myrent_app.utils import get_s3_client
 
 
 @pytest.fixture
-def app():
+def app(tmp_path):
     app = create_app("testing")
+    app.config["STORAGE_LOCAL_FOLDER"] = str(tmp_path / "uploads")
 
     with app.app_context():
         db.create_all()
@@ -190,3 +193,17 @@ def file_example():
         "description": "picture description",
     }
     return file_example
+
+
+@pytest.fixture
+def s3_bucket(app):
+    app.config["STORAGE_BACKEND"] = "s3"
+    app.config["S3_BUCKET"] = "myrent-test"
+    app.config["S3_REGION"] = "us-east-1"
+    app.config["AWS_ACCESS_KEY_ID"] = "testing"
+    app.config["AWS_SECRET_ACCESS_KEY"] = "testing"
+
+    with mock_s3():
+        with app.app_context():
+            get_s3_client().create_bucket(Bucket=app.config["S3_BUCKET"])
+        yield app.config["S3_BUCKET"]
@@ -1,7 +1,91 @@
+import os
+
+import pytest
 from flask import Flask
+from sqlalchemy import inspect
+
+from myrent_app import db
+from myrent_app.errors.errors import _get_unique_column
+from myrent_app.models import Landlord
+from myrent_app.utils import (
+    commit_without_expire,
+    delete_all_files_from_s3,
+    get_s3_client,
+)
 
 
 def test_app(app):
     assert isinstance(app, Flask)
     assert app.config["TESTING"] is True
     assert app.config["DEBUG"] is True
+
+
+@pytest.mark.parametrize(
+    "constraint_name,column_name",
+    [
+        ("ix_landlords_identifier", "identifier"),
+        ("landlords_email_key", "email"),
+        ("email", "email"),
+        ("landlords_pkey", None),
+    ],
+)
+def test_get_unique_column(constraint_name, column_name):
+    assert _get_unique_column("landlords", constraint_name) == column_name
+
+
+def test_get_s3_client(app, monkeypatch):
+    with app.app_context():
+        s3 = get_s3_client("key-id", "secret")
+
+        assert get_s3_client("key-id", "secret") is s3
+        assert get_s3_client("other-key-id", "secret") is not s3
+        assert (
+            s3.meta.config.max_pool_connections == app.config["S3_MAX_POOL_CONNECTIONS"]
+        )
+
+        monkeypatch.setattr(os, "getpid", lambda: -1)
+
+        assert get_s3_client("key-id", "secret") is not s3
+        assert len(app.extensions["s3_clients"]) == 1
+
+
+def test_delete_all_files_from_s3(app, s3_bucket):
+    app.config["S3_DELETE_BATCH_SIZE"] = 10
+    app.config["S3_DELETE_WORKERS"] = 2
+
+    with app.app_context():
+        s3 = get_s3_client()
+        for i in range(45):
+            s3.put_object(Bucket=s3_bucket, Key=f"file{i}.jpg", Body=b"data")
+
+        result = delete_all_files_from_s3(s3_bucket, "testing", "testing")
+
+        assert result == f"All 45 files has been deleted from s3 bucket {s3_bucket}"
+        assert s3.list_objects_v2(Bucket=s3_bucket)["KeyCount"] == 0
+        assert (
+            delete_all_files_from_s3(s3_bucket, "testing", "testing")
+            == f"Bucket <{s3_bucket}> is already empty"
+        )
+
+
+def test_commit_without_expire(app):
+    with app.app_context():
+        landlord = Landlord(
+            identifier="landlord",
+            email="landlord@example.com",
+            first_name="Jan",
+            last_name="Kowalski",
+            phone="500-500-500",
+            address="Mostnika 5",
+            password="password",
+        )
+        db.session.add(landlord)
+        commit_without_expire()
+
+        assert inspect(landlord).expired_attributes == set()
+        assert db.session().expire_on_commit is True
+
+        landlord.first_name = "Adam"
+        db.session.commit()
+
+        assert "first_name" in inspect(landlord).expired_attributes
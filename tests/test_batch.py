@@ -0,0 +1,123 @@
+import pytest
+from flask import g
+
+from myrent_app import db
+from myrent_app.batch.batch import _deferred_commit
+
+
+def test_batch_requests(client, landlord_token, tenant, agreement):
+    response = client.post(
+        "/api/v1/batch",
+        json={
+            "requests": [
+                {"method": "GET", "path": "/api/v1/landlords/me"},
+                {"method": "GET", "path": "/api/v1/agreements"},
+                {
+                    "method": "POST",
+                    "path": "/api/v1/agreements/1/settlements",
+                    "body": {"type": "charge", "value": 3000, "date": "03-02-2020"},
+                },
+                {"method": "GET", "path": "/api/v1/agreements/1/settlements"},
+                {"method": "GET", "path": "/api/v1/flats/5"},
+            ]
+        },
+        headers={"Authorization": f"Bearer {landlord_token}"},
+    )
+    response_data = response.get_json()
+
+    assert response.status_code == 200
+    assert response_data["success"] is False
+    assert response_data["number_of_records"] == 5
+    assert [item["status"] for item in response_data["data"]] == [
+        200,
+        200,
+        201,
+        200,
+        404,
+    ]
+    assert response_data["data"][0]["body"]["data"]["identifier"] == "testidentifier"
+    assert response_data["data"][1]["body"]["number_of_records"] == 1
+    assert response_data["data"][3]["body"]["number_of_records"] == 1
+    assert response_data["data"][4]["body"]["message"] == "Flat with id 5 not found"
+
+
+def test_batch_requests_atomic(client, landlord_token, agreement):
+    response = client.post(
+        "/api/v1/batch",
+        json={
+            "atomic": True,
+            "requests": [
+                {
+                    "method": "POST",
+                    "path": "/api/v1/agreements/1/settlements",
+                    "body": {"type": "charge", "value": 3000, "date": "03-02-2020"},
+                },
+                {
+                    "method": "POST",
+                    "path": "/api/v1/agreements/1/settlements",
+                    "body": {"type": "refund", "value": 100, "date": "04-02-2020"},
+                },
+                {"method": "GET", "path": "/api/v1/agreements/1/settlements"},
+            ],
+        },
+        headers={"Authorization": f"Bearer {landlord_token}"},
+    )
+    response_data = response.get_json()
+
+    assert response.status_code == 200
+    assert response_data["success"] is False
+    assert [item["status"] for item in response_data["data"]] == [201, 400]
+
+    response = client.get(
+        "/api/v1/agreements/1/settlements",
+        headers={"Authorization": f"Bearer {landlord_token}"},
+    )
+
+    assert response.get_json()["number_of_records"] == 0
+
+
+def test_batch_requests_nested(client, landlord_token):
+    response = client.post(
+        "/api/v1/batch",
+        json={"requests": [{"method": "POST", "path": "/api/v1/batch"}]},
+        headers={"Authorization": f"Bearer {landlord_token}"},
+    )
+    response_data = response.get_json()
+
+    assert response.status_code == 400
+    assert response_data["success"] is False
+    assert response_data["message"] == "Batch requests can not be nested"
+
+
+@pytest.mark.parametrize("path", ["/api/v1/%62atch", "//api/v1/batch"])
+def test_batch_requests_nested_path(client, landlord_token, path):
+    response = client.post(
+        "/api/v1/batch",
+        json={
+            "requests": [
+                {"method": "POST", "path": "/api/v1/flats", "body": {}},
+                {"method": "POST", "path": path},
+            ],
+            "atomic": True,
+        },
+        headers={"Authorization": f"Bearer {landlord_token}"},
+    )
+    response_data = response.get_json()
+
+    assert response.status_code == 400
+    assert response_data["success"] is False
+    assert response_data["message"] == "Batch requests can not be nested"
+
+
+def test_deferred_commit_nested(app):
+    with app.test_request_context():
+        session = db.session()
+        with _deferred_commit():
+            with _deferred_commit():
+                pass
+
+            assert session.commit == session.flush
+            assert g.deferred_commit is True
+
+        assert "commit" not in vars(session)
+        assert "deferred_commit" not in g
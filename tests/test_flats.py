@@ -307,3 +307,143 @@ def test_delete_flat_missing_token(client, landlord_token, flat_data):
     assert response_data["success"] is False
     alert = "Missing landlord token. Please login or register as landlord."
     assert alert in response_data["message"]
+
+
+def test_create_flats_bulk(client, landlord_token, flat):
+    flats = [
+        {"identifier": "bulkflat1", "address": "bulkaddress1"},
+        {"identifier": flat["identifier"], "address": "bulkaddress2"},
+        {"identifier": "bulkflat1", "address": "bulkaddress3"},
+        {"identifier": "bulkflat4"},
+        {"identifier": "bulkflat5", "address": "bulkaddress5"},
+    ]
+    response = client.post(
+        "/api/v1/flats/bulk",
+        json=flats,
+        headers={"Authorization": f"Bearer {landlord_token}"},
+    )
+    response_data = response.get_json()
+
+    assert response.status_code == 201
+    assert response_data["success"] is True
+    assert response_data["data"]["number_of_records"] == 2
+    assert response_data["data"]["errors"] == {
+        "1": {
+            "identifier": [f"Flat with identifier {flat['identifier']} already exists"]
+        },
+        "2": {"identifier": ["Flat with identifier bulkflat1 already exists"]},
+        "3": {"address": ["Missing data for required field."]},
+    }
+
+    response = client.get("/api/v1/flats?identifier=bulkflat5")
+    response_data = response.get_json()
+
+    assert response_data["number_of_records"] == 1
+    assert response_data["data"][0]["status"] == "active"
+    assert response_data["data"][0]["landlord"]["identifier"] == "testidentifier"
+
+
+def test_create_flats_bulk_no_valid_items(client, landlord_token):
+    response = client.post(
+        "/api/v1/flats/bulk",
+        json=[{"identifier": "bulkflat1"}],
+        headers={"Authorization": f"Bearer {landlord_token}"},
+    )
+    response_data = response.get_json()
+
+    assert response.status_code == 400
+    assert response_data["success"] is False
+    assert response_data["message"] == {
+        "0": {"address": ["Missing data for required field."]}
+    }
+
+
+def test_delete_flat_with_agreement(client, landlord_token, agreement):
+    client.post(
+        "/api/v1/agreements/1/settlements/bulk",
+        json=[
+            {"type": "charge", "value": 3000, "date": "03-02-2020"},
+            {"type": "payment", "value": 3000, "date": "05-02-2020"},
+        ],
+        headers={"Authorization": f"Bearer {landlord_token}"},
+    )
+
+    response = client.delete(
+        "/api/v1/flats/1", headers={"Authorization": f"Bearer {landlord_token}"}
+    )
+    response_data = response.get_json()
+
+    assert response.status_code == 200
+    assert response_data["success"] is True
+    assert response_data["deleted"] == {
+        "flats": 1,
+        "pictures": 0,
+        "agreements": 1,
+        "settlements": 2,
+        "overdues": 0,
+    }
+
+    response = client.get(
+        "/api/v1/agreements", headers={"Authorization": f"Bearer {landlord_token}"}
+    )
+
+    assert response.get_json()["number_of_records"] == 0
+
+
+def test_create_flat_return_minimal(client, landlord_token, flat_data):
+    response = client.post(
+        "/api/v1/flats",
+        json=flat_data,
+        headers={
+            "Authorization": f"Bearer {landlord_token}",
+            "Prefer": "return=minimal",
+        },
+    )
+
+    assert response.status_code == 204
+    assert response.get_data() == b""
+    assert response.headers["Location"].endswith("/api/v1/flats/1")
+    assert response.headers["Preference-Applied"] == "return=minimal"
+
+    response = client.get(response.headers["Location"])
+
+    assert response.status_code == 200
+    assert response.get_json()["data"]["identifier"] == flat_data["identifier"]
+
+
+def test_update_flat_if_match(client, landlord_token, flat, flat_data):
+    response = client.get("/api/v1/flats/1")
+    etag = response.headers["ETag"]
+
+    assert etag == '"1"'
+
+    headers = {"Authorization": f"Bearer {landlord_token}", "If-Match": etag}
+    flat_data["address"] = "ul. Nowa 1, 00-001 Warszawa"
+    response = client.put("/api/v1/flats/1", json=flat_data, headers=headers)
+
+    assert response.status_code == 200
+    assert response.headers["ETag"] == '"2"'
+    assert response.get_json()["data"]["address"] == flat_data["address"]
+
+    response = client.put("/api/v1/flats/1", json=flat_data, headers=headers)
+    response_data = response.get_json()
+
+    assert response.status_code == 412
+    assert response_data["success"] is False
+    assert "ETag does not match" in response_data["message"]
+
+    response = client.delete("/api/v1/flats/1", headers=headers)
+
+    assert response.status_code == 412
+
+
+def test_update_flat_if_match_required(app, client, landlord_token, flat, flat_data):
+    app.config["REQUIRE_IF_MATCH"] = True
+    response = client.put(
+        "/api/v1/flats/1",
+        json=flat_data,
+        headers={"Authorization": f"Bearer {landlord_token}"},
+    )
+
+    assert response.status_code == 428
+    assert response.get_json()["success"] is False
@@ -1,5 +1,14 @@
+import io
+import json
+import os
+import zipfile
+
 import pytest
 
+from config import base_dir
+from myrent_app.commands.db_manage_commnands import detect_overdue
+from myrent_app.pictures.uploads import drain_picture_uploads
+
 
 def test_get_landlords_no_records(client):
     response = client.get("/api/v1/landlords")
@@ -356,3 +365,201 @@ def test_update_landlord_data(client, landlord_token):
     assert response_data["data"]["last_name"] == updated_landlord["last_name"]
     assert response_data["data"]["phone"] == updated_landlord["phone"]
     assert response_data["data"]["description"] == updated_landlord["description"]
+
+
+def test_update_landlord_data_existing_email(client, landlord, landlord_token):
+    client.post(
+        "/api/v1/landlords/register",
+        json=dict(landlord, identifier="otheridentifier", email="other@wp.pl"),
+    )
+    updated_landlord = {
+        key: value for key, value in landlord.items() if key != "password"
+    }
+    updated_landlord["email"] = "other@wp.pl"
+    response = client.put(
+        "/api/v1/landlords/data",
+        json=updated_landlord,
+        headers={"Authorization": f"Bearer {landlord_token}"},
+    )
+    response_data = response.get_json()
+
+    assert response.status_code == 409
+    assert response_data["success"] is False
+    assert response_data["message"] == "Landlord with email other@wp.pl already exists"
+
+    response = client.get(
+        "/api/v1/landlords/me", headers={"Authorization": f"Bearer {landlord_token}"}
+    )
+
+    assert response.get_json()["data"]["email"] == landlord["email"]
+
+
+def test_get_landlord_dashboard_no_token(client):
+    response = client.get("/api/v1/landlords/me/dashboard")
+    response_data = response.get_json()
+
+    assert response.status_code == 401
+    assert response_data["success"] is False
+    assert "data" not in response_data
+
+
+def test_get_landlord_dashboard(client, landlord_token, agreement):
+    settlements = [
+        {"type": "charge", "value": 3000, "date": "03-01-2020"},
+        {"type": "payment", "value": 1000, "date": "05-01-2020"},
+        {"type": "payment", "value": 2000, "date": "10-01-2020"},
+        {"type": "charge", "value": 3000, "date": "03-02-2020"},
+    ]
+    for settlement in settlements:
+        client.post(
+            "/api/v1/agreements/1/settlements",
+            json=settlement,
+            headers={"Authorization": f"Bearer {landlord_token}"},
+        )
+
+    response = client.get(
+        "/api/v1/landlords/me/dashboard",
+        headers={"Authorization": f"Bearer {landlord_token}"},
+    )
+    response_data = response.get_json()
+
+    assert response.status_code == 200
+    assert response_data["success"] is True
+    assert response_data["data"]["columns"] == [
+        "month",
+        "flat_id",
+        "charges",
+        "charges_count",
+        "payments",
+        "payments_count",
+    ]
+    assert response_data["data"]["rows"] == [
+        ["2020-01", 1, 3000.0, 1, 3000.0, 2],
+        ["2020-02", 1, 3000.0, 1, 0.0, 0],
+    ]
+    assert response_data["data"]["flats"] == [[1, "testidentifier"]]
+
+    response = client.get(
+        "/api/v1/landlords/me/dashboard?from=01-02-2020&to=29-02-2020",
+        headers={"Authorization": f"Bearer {landlord_token}"},
+    )
+    response_data = response.get_json()
+
+    assert response.status_code == 200
+    assert response_data["data"]["rows"] == [["2020-02", 1, 3000.0, 1, 0.0, 0]]
+
+
+def test_get_landlord_dashboard_invalid_date(client, landlord_token):
+    response = client.get(
+        "/api/v1/landlords/me/dashboard?from=2020-01-01",
+        headers={"Authorization": f"Bearer {landlord_token}"},
+    )
+    response_data = response.get_json()
+
+    assert response.status_code == 400
+    assert response_data["success"] is False
+    assert "from" in response_data["message"]
+
+
+def test_get_landlord_overdues(app, client, landlord_token, agreement):
+    settlements = [
+        {"type": "charge", "value": 3000, "date": "01-02-2020"},
+        {"type": "payment", "value": 1000, "date": "05-02-2020"},
+        {"type": "payment", "value": 2000, "date": "20-02-2020"},
+        {"type": "charge", "value": 3000, "date": "01-03-2020"},
+        {"type": "payment", "value": 3000, "date": "10-03-2020"},
+    ]
+    for settlement in settlements:
+        client.post(
+            "/api/v1/agreements/1/settlements",
+            json=settlement,
+            headers={"Authorization": f"Bearer {landlord_token}"},
+        )
+    runner = app.test_cli_runner()
+    runner.invoke(detect_overdue, ["--period", "2020-02"])
+    runner.invoke(detect_overdue, ["--period", "2020-03"])
+
+    response = client.get(
+        "/api/v1/landlords/me/overdue",
+        headers={"Authorization": f"Bearer {landlord_token}"},
+    )
+    response_data = response.get_json()
+
+    assert response.status_code == 200
+    assert response_data["success"] is True
+    assert response_data["number_of_records"] == 1
+    assert response_data["data"][0]["period"] == "2020-02"
+    assert response_data["data"][0]["amount"] == 2000
+    assert response_data["data"][0]["agreement"]["identifier"] == "testagreement"
+
+    response = client.get(
+        "/api/v1/landlords/me/overdue?period=2020-03",
+        headers={"Authorization": f"Bearer {landlord_token}"},
+    )
+    response_data = response.get_json()
+
+    assert response.status_code == 200
+    assert response_data["data"] == []
+
+
+def test_export_landlord_data(client, landlord_token, agreement):
+    response = client.get(
+        "/api/v1/landlords/me/export",
+        headers={"Authorization": f"Bearer {landlord_token}"},
+    )
+
+    assert response.status_code == 200
+    assert response.headers["Content-Type"] == "application/zip"
+    with zipfile.ZipFile(io.BytesIO(response.get_data())) as archive:
+        assert archive.namelist() == [
+            "landlord.ndjson",
+            "flats.ndjson",
+            "tenants.ndjson",
+            "agreements.ndjson",
+            "settlements.ndjson",
+            "pictures.ndjson",
+        ]
+        landlords = archive.read("landlord.ndjson").decode().splitlines()
+        agreements = archive.read("agreements.ndjson").decode().splitlines()
+        settlements = archive.read("settlements.ndjson").decode()
+
+    assert json.loads(landlords[0])["identifier"] == "testidentifier"
+    assert len(agreements) == 1
+    assert json.loads(agreements[0])["identifier"] == agreement["identifier"]
+    assert json.loads(agreements[0])["flat"]["identifier"] == "testidentifier"
+    assert settlements == ""
+
+
+def test_export_landlord_data_pictures(
+    app, client, landlord_token, flat, s3_bucket, tmp_path
+):
+    app.config["PICTURE_SPOOL_FOLDER"] = str(tmp_path)
+    with open(os.path.join(base_dir, "samples", "example.JPG"), "rb") as img:
+        data = img.read()
+    for file_name in ["example.jpg", "copy.jpg"]:
+        client.post(
+            "/api/v1/flats/1/pictures",
+            data={"picture": (io.BytesIO(data), file_name)},
+            headers={"Authorization": f"Bearer {landlord_token}"},
+        )
+    with app.app_context():
+        drain_picture_uploads(timeout=30)
+
+    response = client.get(
+        "/api/v1/landlords/me/export",
+        headers={"Authorization": f"Bearer {landlord_token}"},
+    )
+
+    with zipfile.ZipFile(io.BytesIO(response.get_data())) as archive:
+        assert archive.read("pictures/flat1_example.jpg") == data
+        assert archive.read("pictures/flat1_copy.jpg") == data
+
+
+def test_login_sample_landlord(client, sample_data):
+    response = client.post(
+        "/api/v1/landlords/login",
+        json={"identifier": "landlord1", "password": "haslo1"},
+    )
+
+    assert response.status_code == 200
+    assert "token" in response.get_json()
@@ -1,7 +1,20 @@
+import hashlib
 import os
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
 from io import BytesIO
 import pytest
-from config import base_dir
+import requests
+from PIL import Image
+from sqlalchemy import event
+from myrent_app import db
+from myrent_app.commands.db_manage_commnands import reconcile_storage
+from myrent_app.models import Blob, Picture
+from myrent_app.pictures import uploads
+from myrent_app.pictures.uploads import drain_picture_uploads
+from myrent_app.pictures.variants import resize_picture
+from myrent_app.storage import LocalStorage, Storage, get_storage
+from myrent_app.utils import get_s3_client
 
 
 def test_add_picture_no_token(client, flat):
@@ -55,11 +68,12 @@ def test_add_picture_ok(client, flat, landlord_token, file_example):
 
     response_data = response.get_json()
 
-    assert response.status_code == 201
+    assert response.status_code == 202
     assert response_data["success"] is True
     assert response_data["data"]["name"] == f'flat1_{file_example["name"]}'
     assert response_data["data"]["path"] == file_example["path"]
     assert response_data["data"]["description"] == file_example["description"]
+    assert response_data["data"]["status"] == "pending"
 
 
 def test_get_all_pictures_no_records(client):
@@ -101,13 +115,13 @@ def test_get_one_picture(client, sample_data):
     assert response.status_code == 200
     assert response.headers["Content-Type"] == "application/json"
     assert response_data["success"] is True
-    assert len(response_data["data"]) == 7
+    assert len(response_data["data"]) == 9
     assert response_data["data"]["id"] == 1
+    assert response_data["data"]["variants"] == {}
+    assert response_data["data"]["status"] == "ready"
     assert response_data["data"]["name"] == "flat1_example.JPG"
     assert response_data["data"]["description"] == "Description for flat1_example.JPG"
-    assert response_data["data"]["path"] == os.path.join(
-        base_dir, "uploads", "example.JPG"
-    )
+    assert response_data["data"]["path"] == "/api/v1/storage/flat1_example.JPG"
 
 
 def test_delete_picture_no_token(client, sample_data):
@@ -177,3 +191,655 @@ def test_delete_picture_other_landlord(client, sample_data):
     assert response_data["success"] is False
     assert "data" not in response_data
     assert response_data["message"] == "Picture with id 1 not found"
+
+
+def upload_picture(client, landlord_token, content=b"picture", name="example.jpg"):
+    response = client.post(
+        "api/v1/flats/1/pictures/upload-url",
+        json={"file_name": name, "content_type": "image/jpeg"},
+        headers={"Authorization": f"Bearer {landlord_token}"},
+    )
+    upload = response.get_json()["data"]
+    requests.post(
+        upload["url"], data=upload["fields"], files={"file": (name, content)}
+    ).raise_for_status()
+    return upload
+
+
+def test_get_picture_upload_url(client, flat, landlord_token, s3_bucket):
+    response = client.post(
+        "api/v1/flats/1/pictures/upload-url",
+        json={"file_name": "example.jpg", "content_type": "image/jpeg"},
+        headers={"Authorization": f"Bearer {landlord_token}"},
+    )
+    response_data = response.get_json()
+
+    assert response.status_code == 200
+    assert response_data["data"]["name"] == "flat1_example.jpg"
+    assert response_data["data"]["fields"]["key"] == "flat1_example.jpg"
+    assert response_data["data"]["fields"]["Content-Type"] == "image/jpeg"
+    assert s3_bucket in response_data["data"]["url"]
+
+
+def test_get_picture_upload_url_content_type(client, flat, landlord_token, s3_bucket):
+    response = client.post(
+        "api/v1/flats/1/pictures/upload-url",
+        json={"file_name": "example.jpg", "content_type": "text/html"},
+        headers={"Authorization": f"Bearer {landlord_token}"},
+    )
+
+    assert response.status_code == 415
+    assert "Not allowed content type" in response.get_json()["message"]
+
+
+def test_confirm_picture_upload(app, client, flat, landlord_token, s3_bucket):
+    upload = upload_picture(client, landlord_token)
+
+    response = client.post(
+        "api/v1/flats/1/pictures/confirm",
+        json={"name": upload["name"], "description": "kitchen"},
+        headers={"Authorization": f"Bearer {landlord_token}"},
+    )
+    response_data = response.get_json()
+
+    assert response.status_code == 202
+    assert response_data["data"]["name"] == "flat1_example.jpg"
+    assert response_data["data"]["description"] == "kitchen"
+    assert response_data["data"]["status"] == "pending"
+    assert response_data["data"]["path"].endswith(
+        f"{s3_bucket}.s3.amazonaws.com/flat1_example.jpg"
+    )
+
+    with app.app_context():
+        assert drain_picture_uploads(timeout=30) is True
+        s3 = get_s3_client()
+    response_data = client.get("api/v1/pictures/1").get_json()
+    sha256 = hashlib.sha256(b"picture").hexdigest()
+
+    assert response_data["data"]["status"] == "ready"
+    assert response_data["data"]["path"].endswith(
+        f"{s3_bucket}.s3.amazonaws.com/blobs/{sha256}"
+    )
+    assert [
+        file["Key"] for file in s3.list_objects_v2(Bucket=s3_bucket)["Contents"]
+    ] == [f"blobs/{sha256}"]
+
+
+def test_confirm_picture_upload_failed(
+    app, client, flat, landlord_token, s3_bucket, monkeypatch
+):
+    def hash_file(storage, file_name):
+        raise FileNotFoundError(f"Picture {file_name} has not been uploaded")
+
+    monkeypatch.setattr(
+        uploads.PictureUploadQueue, "_hash_file", staticmethod(hash_file)
+    )
+    upload = upload_picture(client, landlord_token)
+    client.post(
+        "api/v1/flats/1/pictures/confirm",
+        json={"name": upload["name"]},
+        headers={"Authorization": f"Bearer {landlord_token}"},
+    )
+    with app.app_context():
+        assert drain_picture_uploads(timeout=30) is True
+
+    response_data = client.get("api/v1/pictures/1").get_json()
+
+    assert response_data["data"]["status"] == "failed"
+    assert response_data["data"]["path"].endswith("/flat1_example.jpg")
+
+
+def test_confirm_picture_upload_not_uploaded(client, flat, landlord_token, s3_bucket):
+    response = client.post(
+        "api/v1/flats/1/pictures/confirm",
+        json={"name": "flat1_example.jpg"},
+        headers={"Authorization": f"Bearer {landlord_token}"},
+    )
+
+    assert response.status_code == 404
+    assert response.get_json()["message"] == (
+        "Picture flat1_example.jpg has not been uploaded"
+    )
+
+
+def test_resize_picture(file_example):
+    with open(file_example["source"], "rb") as img:
+        variants = resize_picture(img.read(), {"thumbnail": 160}, 85)
+
+    assert set(variants) == {("thumbnail", "jpeg"), ("thumbnail", "webp")}
+    for (_, file_format), data in variants.items():
+        with Image.open(BytesIO(data)) as image:
+            assert image.format == file_format.upper()
+            assert max(image.size) <= 160
+            assert "exif" not in image.info
+
+
+def test_confirm_picture_upload_variants(
+    app, client, flat, landlord_token, s3_bucket, file_example
+):
+    with open(file_example["source"], "rb") as img:
+        content = img.read()
+    upload = upload_picture(client, landlord_token, content=content)
+    sha256 = hashlib.sha256(content).hexdigest()
+
+    response = client.post(
+        "api/v1/flats/1/pictures/confirm",
+        json={"name": upload["name"]},
+        headers={"Authorization": f"Bearer {landlord_token}"},
+    )
+
+    assert response.status_code == 202
+    assert response.get_json()["data"]["variants"] == {}
+
+    with app.app_context():
+        assert drain_picture_uploads(timeout=30) is True
+    response_data = client.get("api/v1/pictures/1").get_json()
+    variants = response_data["data"]["variants"]
+
+    assert response_data["data"]["status"] == "ready"
+    assert set(variants) == set(app.config["PICTURE_VARIANTS"])
+    assert variants["thumbnail"]["webp"].endswith(f"/blobs/{sha256}_thumbnail.webp")
+
+    with app.app_context():
+        s3 = get_s3_client()
+    thumbnail = s3.head_object(Bucket=s3_bucket, Key=f"blobs/{sha256}_thumbnail.jpg")
+
+    assert thumbnail["ContentType"] == "image/jpeg"
+
+    client.delete(
+        "api/v1/pictures/1", headers={"Authorization": f"Bearer {landlord_token}"}
+    )
+
+    assert "Contents" not in s3.list_objects_v2(Bucket=s3_bucket)
+
+
+def test_add_picture_background_upload(
+    app, client, flat, landlord_token, s3_bucket, file_example, tmp_path
+):
+    app.config["PICTURE_SPOOL_FOLDER"] = str(tmp_path)
+    with open(file_example["source"], "rb") as img:
+        response = client.post(
+            "api/v1/flats/1/pictures",
+            data={"picture": img},
+            headers={"Authorization": f"Bearer {landlord_token}"},
+        )
+
+    assert response.status_code == 202
+    assert response.get_json()["data"]["status"] == "pending"
+    assert response.headers["Location"].endswith("/api/v1/pictures/1")
+
+    with app.app_context():
+        assert drain_picture_uploads(timeout=30) is True
+
+    response_data = client.get("api/v1/pictures/1").get_json()
+
+    assert response_data["data"]["status"] == "ready"
+    assert "thumbnail" in response_data["data"]["variants"]
+    assert os.listdir(tmp_path) == []
+
+
+def test_add_picture_background_upload_failed(
+    app, client, flat, landlord_token, s3_bucket, file_example
+):
+    app.config["S3_BUCKET"] = "myrent-missing"
+    app.config["PICTURE_UPLOAD_RETRIES"] = 2
+    app.config["PICTURE_UPLOAD_RETRY_DELAY"] = 0
+    with open(file_example["source"], "rb") as img:
+        client.post(
+            "api/v1/flats/1/pictures",
+            data={"picture": img},
+            headers={"Authorization": f"Bearer {landlord_token}"},
+        )
+
+    with app.app_context():
+        drain_picture_uploads(timeout=30)
+
+    response_data = client.get("api/v1/pictures/1").get_json()
+
+    assert response_data["data"]["status"] == "failed"
+
+
+def test_add_picture_background_upload_error(
+    app, client, flat, landlord_token, s3_bucket, monkeypatch
+):
+    def store_picture_variants(stored_file, data=None):
+        raise RuntimeError("database is down")
+
+    monkeypatch.setattr(uploads, "store_picture_variants", store_picture_variants)
+    headers = {"Authorization": f"Bearer {landlord_token}"}
+    for file_name in ["example.jpg", "copy.jpg"]:
+        client.post(
+            "api/v1/flats/1/pictures",
+            data={"picture": (BytesIO(b"picture"), file_name)},
+            headers=headers,
+        )
+        with app.app_context():
+            drain_picture_uploads(timeout=30)
+
+    response_data = client.get("api/v1/flats/1/pictures").get_json()
+
+    assert [picture["status"] for picture in response_data["data"]] == [
+        "failed",
+        "failed",
+    ]
+    with app.app_context():
+        assert Blob.query.one().status == "failed"
+
+
+def test_get_pictures_query_count(app, client, flat):
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    def add_pictures(numbers):
+        with app.app_context():
+            for number in numbers:
+                blob = Blob(sha256=f"{number:064}", size=1, status="ready")
+                db.session.add(
+                    Picture(name=f"flat1_{number}.jpg", path="", flat_id=1, blob=blob)
+                )
+            db.session.commit()
+
+    def count_queries():
+        counts = []
+        for url in ["api/v1/pictures", "api/v1/flats/1/pictures"]:
+            statements.clear()
+            response = client.get(url)
+            assert response.status_code == 200
+            counts.append(len(statements))
+        return counts
+
+    with app.app_context():
+        engine = db.engine
+    event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    add_pictures(range(1))
+    queries = count_queries()
+    add_pictures(range(1, 5))
+
+    assert count_queries() == queries
+    event.remove(engine, "before_cursor_execute", before_cursor_execute)
+
+
+def test_add_picture_deduplication(
+    app, client, flat, flat_2_data, landlord_token, s3_bucket, file_example
+):
+    headers = {"Authorization": f"Bearer {landlord_token}"}
+    client.post("api/v1/flats", json=flat_2_data, headers=headers)
+    paths = []
+    for flat_id in [1, 2]:
+        with open(file_example["source"], "rb") as img:
+            response = client.post(
+                f"api/v1/flats/{flat_id}/pictures",
+                data={"picture": img},
+                headers=headers,
+            )
+        with app.app_context():
+            drain_picture_uploads(timeout=30)
+        paths.append(response.get_json()["data"]["path"])
+
+    assert response.status_code == 201
+    assert response.get_json()["data"]["status"] == "ready"
+    assert paths[0] == paths[1]
+    assert "/blobs/" in paths[0]
+
+    with app.app_context():
+        s3 = get_s3_client()
+        blob = Blob.query.one()
+
+        assert blob.refcount == 2
+
+    def count_objects():
+        return s3.list_objects_v2(Bucket=s3_bucket).get("KeyCount", 0)
+
+    number_of_objects = 1 + 2 * len(app.config["PICTURE_VARIANTS"])
+
+    assert count_objects() == number_of_objects
+
+    client.delete("api/v1/pictures/1", headers=headers)
+
+    assert count_objects() == number_of_objects
+
+    client.delete("api/v1/flats/2", headers=headers)
+
+    assert count_objects() == 0
+    with app.app_context():
+        assert Blob.query.count() == 0
+
+
+def test_get_storage_file(client, sample_data, file_example):
+    path = client.get("api/v1/pictures/1").get_json()["data"]["path"]
+    with open(file_example["source"], "rb") as img:
+        data = img.read()
+
+    response = client.get(path)
+
+    assert path == "/api/v1/storage/flat1_example.JPG"
+    assert response.status_code == 200
+    assert response.headers["Content-Type"] == "image/jpeg"
+    assert response.headers["Accept-Ranges"] == "bytes"
+    assert response.cache_control.public is True
+    assert response.cache_control.max_age == 365 * 24 * 60 * 60
+    assert response.data == data
+
+    response = client.get(path, headers={"Range": "bytes=0-99"})
+
+    assert response.status_code == 206
+    assert response.headers["Content-Range"] == f"bytes 0-99/{len(data)}"
+    assert response.data == data[:100]
+
+    response = client.get(path, headers={"If-None-Match": response.headers["ETag"]})
+
+    assert response.status_code == 304
+
+
+def test_get_storage_file_accel_redirect(app, client, sample_data):
+    app.config["STORAGE_LOCAL_ACCEL_REDIRECT"] = "/internal-uploads/"
+
+    response = client.get("api/v1/storage/flat1_example.JPG")
+
+    assert response.status_code == 200
+    assert response.headers["X-Accel-Redirect"] == "/internal-uploads/flat1_example.JPG"
+    assert response.data == b""
+
+
+def test_get_storage_file_not_found(client):
+    response = client.get("api/v1/storage/missing.JPG")
+    response_data = response.get_json()
+
+    assert response.status_code == 404
+    assert response_data["success"] is False
+    assert response_data["message"] == "File missing.JPG not found"
+
+
+def test_get_storage_file_outside_folder(client, sample_data):
+    response = client.get("api/v1/storage/../tests/test.db")
+
+    assert response.status_code == 404
+
+
+def test_get_picture_upload_url_local_storage(client, flat, landlord_token):
+    response = client.post(
+        "api/v1/flats/1/pictures/upload-url",
+        json={"file_name": "example.JPG", "content_type": "image/jpeg"},
+        headers={"Authorization": f"Bearer {landlord_token}"},
+    )
+    response_data = response.get_json()
+
+    assert response.status_code == 501
+    assert response_data["success"] is False
+    assert (
+        response_data["message"] == "Direct uploads are not supported by local storage"
+    )
+
+
+def test_add_pictures_bulk(app, client, flat, landlord_token, file_example, tmp_path):
+    app.config["PICTURE_SPOOL_FOLDER"] = str(tmp_path / "spool")
+    with open(file_example["source"], "rb") as img:
+        data = img.read()
+
+    response = client.post(
+        "api/v1/flats/1/pictures/bulk",
+        data={
+            "picture": [
+                (BytesIO(data), "first.jpg"),
+                (BytesIO(data), "second.jpg"),
+                (BytesIO(b"text"), "notes.txt"),
+                (BytesIO(data), "first.jpg"),
+            ],
+            "description": ["first picture", "", "notes"],
+        },
+        headers={"Authorization": f"Bearer {landlord_token}"},
+    )
+    response_data = response.get_json()
+
+    assert response.status_code == 202
+    assert response_data["success"] is True
+    assert response_data["data"]["number_of_records"] == 2
+    pictures = response_data["data"]["pictures"]
+    assert pictures["0"]["name"] == "flat1_first.jpg"
+    assert pictures["0"]["description"] == "first picture"
+    assert pictures["1"]["name"] == "flat1_second.jpg"
+    assert pictures["1"]["path"] == pictures["0"]["path"]
+    assert set(response_data["data"]["errors"]) == {"2", "3"}
+    assert response_data["data"]["errors"]["3"] == {
+        "picture": ["Picture with name first.jpg already exists"]
+    }
+
+    with app.app_context():
+        assert drain_picture_uploads(timeout=30) is True
+        assert Blob.query.one().refcount == 2
+
+    response_data = client.get("api/v1/flats/1/pictures").get_json()
+
+    assert [picture["status"] for picture in response_data["data"]] == [
+        "ready",
+        "ready",
+    ]
+    assert os.listdir(tmp_path / "spool") == []
+
+
+def test_add_pictures_bulk_all_invalid(client, flat, landlord_token):
+    response = client.post(
+        "api/v1/flats/1/pictures/bulk",
+        data={"picture": [(BytesIO(b"text"), "notes.txt")]},
+        headers={"Authorization": f"Bearer {landlord_token}"},
+    )
+    response_data = response.get_json()
+
+    assert response.status_code == 400
+    assert response_data["success"] is False
+    assert list(response_data["message"]) == ["0"]
+
+
+def test_add_pictures_bulk_too_many(app, client, flat, landlord_token):
+    app.config["PICTURE_BULK_MAX_FILES"] = 1
+
+    response = client.post(
+        "api/v1/flats/1/pictures/bulk",
+        data={
+            "picture": [(BytesIO(b"data"), "first.jpg"), (BytesIO(b"data"), "b.jpg")]
+        },
+        headers={"Authorization": f"Bearer {landlord_token}"},
+    )
+
+    assert response.status_code == 400
+    assert response.get_json()["message"] == "Too many pictures (maximum 1)"
+
+
+def test_get_pictures_private_bucket(
+    app, client, flat, landlord_token, s3_bucket, file_example, monkeypatch
+):
+    app.config["S3_PRIVATE"] = True
+    with open(file_example["source"], "rb") as img:
+        client.post(
+            "api/v1/flats/1/pictures",
+            data={"picture": img},
+            headers={"Authorization": f"Bearer {landlord_token}"},
+        )
+    with app.app_context():
+        drain_picture_uploads(timeout=30)
+        s3 = get_s3_client()
+        sha256 = Blob.query.one().sha256
+    grants = s3.get_object_acl(Bucket=s3_bucket, Key=f"blobs/{sha256}")["Grants"]
+
+    signed = []
+    generate_presigned_url = s3.generate_presigned_url
+
+    def generate_presigned_url_spy(*args, **kwargs):
+        signed.append(kwargs["Params"]["Key"])
+        return generate_presigned_url(*args, **kwargs)
+
+    monkeypatch.setattr(s3, "generate_presigned_url", generate_presigned_url_spy)
+    response_data = client.get("api/v1/flats/1/pictures").get_json()
+    picture = response_data["data"][0]
+
+    assert all("AllUsers" not in str(grant["Grantee"]) for grant in grants)
+    assert picture["path"].startswith(
+        f"https://{s3_bucket}.s3.amazonaws.com/blobs/{sha256}?"
+    )
+    assert "Signature" in picture["path"]
+    assert f"blobs/{sha256}_thumbnail.webp?" in picture["variants"]["thumbnail"]["webp"]
+    # the original was signed and cached for the response of the upload
+    assert len(signed) == 2 * len(app.config["PICTURE_VARIANTS"])
+
+    assert client.get("api/v1/pictures/1").get_json()["data"] == picture
+    assert len(signed) == 2 * len(app.config["PICTURE_VARIANTS"])
+
+    app.config["S3_PRESIGNED_URL_MIN_TTL"] = app.config["S3_PRESIGNED_URL_EXPIRES"] + 1
+    client.get("api/v1/pictures/1")
+    assert len(signed) == 1 + 4 * len(app.config["PICTURE_VARIANTS"])
+
+
+def test_get_storage_file_private_bucket(app, client, s3_bucket):
+    app.config["S3_PRIVATE"] = True
+    with app.app_context():
+        get_storage().save_data(b"picture", "flat1_example.jpg", "image/jpeg")
+
+    response = client.get("api/v1/storage/flat1_example.jpg")
+
+    assert response.status_code == 404
+    assert "Location" not in response.headers
+
+
+def test_reconcile_storage(
+    app, client, sample_data, landlord_token, flat_data, file_example
+):
+    headers = {"Authorization": f"Bearer {landlord_token}"}
+    response = client.post("api/v1/flats", json=flat_data, headers=headers)
+    flat_id = response.get_json()["data"]["id"]
+    with open(file_example["source"], "rb") as img:
+        picture_id = client.post(
+            f"api/v1/flats/{flat_id}/pictures",
+            data={"picture": (img, "other.jpg")},
+            headers=headers,
+        ).get_json()["data"]["id"]
+    folder = app.config["STORAGE_LOCAL_FOLDER"]
+    with app.app_context():
+        drain_picture_uploads(timeout=30)
+        storage = get_storage()
+        storage.save_data(b"data", "orphaned.jpg", "image/jpeg")
+        storage.save_data(b"data", "blobs/orphaned_thumbnail.jpg", "image/jpeg")
+        storage.save_data(b"data", "flat1_uploading.jpg", "image/jpeg")
+        storage.delete("flat2_example3.JPG")
+        storage.delete("flat1_example.JPG")
+        changed = datetime.utcnow() - timedelta(days=1)
+        Blob.query.update({Blob.created: changed, Blob.updated: changed})
+        Picture.query.filter(Picture.id != 1).update(
+            {Picture.created: changed, Picture.updated: changed}
+        )
+        db.session.commit()
+    for file_name in ["orphaned.jpg", "blobs/orphaned_thumbnail.jpg"]:
+        os.utime(os.path.join(folder, file_name), (0, 0))
+    runner = app.test_cli_runner()
+
+    result = runner.invoke(reconcile_storage, ["--dry-run", "--min-age", "60"])
+
+    assert "Missing file: flat2_example3.JPG" in result.output
+    assert (
+        "2 orphaned files (0 deleted, 1 recent skipped), "
+        "1 missing files (0 pictures marked as failed)"
+    ) in result.output
+    assert os.path.exists(os.path.join(folder, "orphaned.jpg"))
+
+    result = runner.invoke(
+        reconcile_storage, ["--min-age", "60", "--batch-size", "1", "--pause", "0"]
+    )
+
+    assert (
+        "2 orphaned files (2 deleted, 1 recent skipped), "
+        "1 missing files (1 pictures marked as failed)"
+    ) in result.output
+    assert not os.path.exists(os.path.join(folder, "orphaned.jpg"))
+    assert not os.path.exists(os.path.join(folder, "blobs/orphaned_thumbnail.jpg"))
+    assert os.path.exists(os.path.join(folder, "flat1_uploading.jpg"))
+    assert client.get("api/v1/pictures/1").get_json()["data"]["status"] == "ready"
+    assert client.get("api/v1/pictures/2").get_json()["data"]["status"] == "failed"
+    response_data = client.get(f"api/v1/pictures/{picture_id}").get_json()
+    assert response_data["data"]["status"] == "ready"
+    assert "thumbnail" in response_data["data"]["variants"]
+
+
+def test_local_storage_list_files(app):
+    with app.app_context():
+        storage = LocalStorage()
+        for file_name in [
+            "b.jpg",
+            "a/c.jpg",
+            "a.jpg",
+            "a/b/d.jpg",
+            "a0.jpg",
+            "a-b.jpg",
+        ]:
+            storage.save_data(b"data", file_name, "image/jpeg")
+
+        file_names = [file_name for file_name, _ in storage.list_files()]
+
+    assert file_names == sorted(file_names)
+    assert file_names == [
+        "a-b.jpg",
+        "a.jpg",
+        "a/b/d.jpg",
+        "a/c.jpg",
+        "a0.jpg",
+        "b.jpg",
+    ]
+
+
+def test_add_picture_idempotency_key(app, client, flat, landlord_token, file_example):
+    headers = {
+        "Authorization": f"Bearer {landlord_token}",
+        "Idempotency-Key": "c1b2a3d4-picture",
+    }
+    with open(file_example["source"], "rb") as img:
+        data = img.read()
+
+    responses = [
+        client.post(
+            "api/v1/flats/1/pictures",
+            data={"picture": (BytesIO(data), "example.jpg"), "description": "x"},
+            headers=headers,
+        )
+        for _ in range(2)
+    ]
+
+    assert responses[0].status_code in [201, 202]
+    assert responses[1].status_code == responses[0].status_code
+    assert responses[1].headers["Idempotent-Replayed"] == "true"
+
+    response = client.post(
+        "api/v1/flats/1/pictures",
+        data={"picture": (BytesIO(data[:-1]), "example.jpg"), "description": "x"},
+        headers=headers,
+    )
+
+    assert response.status_code == 400
+
+    with app.app_context():
+        drain_picture_uploads(timeout=30)
+
+
+def test_storage_incomplete_backend():
+    class IncompleteStorage(Storage):
+        def url(self, file_name):
+            return file_name
+
+    with pytest.raises(TypeError):
+        IncompleteStorage()
+
+    assert isinstance(LocalStorage(), Storage)
+
+
+def test_local_storage_concurrent_writes(app):
+    payloads = [bytes([index]) * 256 * 1024 for index in range(8)]
+
+    def save(data):
+        with app.app_context():
+            get_storage().save_data(data, "flat1_example.jpg", "image/jpeg")
+
+    with ThreadPoolExecutor(max_workers=len(payloads)) as executor:
+        list(executor.map(save, payloads))
+
+    with app.app_context():
+        assert get_storage().read("flat1_example.jpg") in payloads
+        assert os.listdir(app.config["STORAGE_LOCAL_FOLDER"]) == ["flat1_example.jpg"]
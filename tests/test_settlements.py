@@ -0,0 +1,486 @@
+import csv
+import io
+import zipfile
+from datetime import date
+
+import pytest
+from sqlalchemy import event
+
+from myrent_app import db
+from myrent_app.commands import db_manage_commnands
+from myrent_app.commands.db_manage_commnands import (
+    benchmark_settlements,
+    clean_idempotency_keys,
+    generate,
+    generate_charges,
+)
+from myrent_app.commands.generator import generate_data
+from myrent_app.models import Agreement, IdempotencyKey, Settlement
+from myrent_app.settlements import charges, group_commit
+from myrent_app.settlements.charges import calculate_charge
+from myrent_app.settlements.group_commit import (
+    PendingSettlement,
+    SettlementGroupCommitter,
+)
+
+
+@pytest.mark.parametrize(
+    "price_period,date_from,date_to,expected",
+    [
+        ("month", date(2020, 1, 1), date(2020, 12, 31), (date(2020, 2, 1), 2900)),
+        ("month", date(2020, 2, 16), date(2020, 12, 31), (date(2020, 2, 16), 1400)),
+        ("month", date(2019, 1, 1), date(2020, 2, 14), (date(2020, 2, 1), 1400)),
+        ("day", date(2020, 2, 5), date(2020, 2, 10), (date(2020, 2, 5), 17400)),
+    ],
+)
+def test_calculate_charge(price_period, date_from, date_to, expected):
+    result = calculate_charge(
+        2900, price_period, date_from, date_to, date(2020, 2, 1), date(2020, 2, 29)
+    )
+
+    assert result == expected
+
+
+def test_create_period_charges_no_token(client):
+    response = client.post("/api/v1/settlements/charges", json={"period": "2020-01"})
+    response_data = response.get_json()
+
+    assert response.status_code == 401
+    assert response_data["success"] is False
+    assert "data" not in response_data
+
+
+def test_create_period_charges_invalid_period(client, landlord_token):
+    response = client.post(
+        "/api/v1/settlements/charges",
+        json={"period": "01-2020"},
+        headers={"Authorization": f"Bearer {landlord_token}"},
+    )
+    response_data = response.get_json()
+
+    assert response.status_code == 400
+    assert response_data["success"] is False
+    assert "period" in response_data["message"]
+
+
+def test_create_period_charges(client, landlord_token, agreement):
+    for _ in range(2):
+        response = client.post(
+            "/api/v1/settlements/charges",
+            json={"period": "2020-02"},
+            headers={"Authorization": f"Bearer {landlord_token}"},
+        )
+    response_data = response.get_json()
+
+    assert response.status_code == 201
+    assert response_data["success"] is True
+    assert response_data["data"] == {"period": "2020-02", "number_of_charges": 0}
+
+    response = client.get(
+        "/api/v1/agreements/1/settlements",
+        headers={"Authorization": f"Bearer {landlord_token}"},
+    )
+    response_data = response.get_json()
+
+    assert response_data["number_of_records"] == 1
+    assert response_data["data"][0]["type"] == "charge"
+    assert response_data["data"][0]["value"] == agreement["price_value"]
+    assert response_data["data"][0]["date"] == "01-02-2020"
+    assert response_data["data"][0]["period"] == "2020-02"
+
+
+def test_generate_charges_command(app, client, landlord_token, agreement):
+    runner = app.test_cli_runner()
+    result = runner.invoke(generate_charges, ["--period", "2022-06"])
+
+    assert "1 charges for period 2022-06 have been generated" in result.output
+
+    result = runner.invoke(generate_charges, ["--period", "2022-07"])
+
+    assert "0 charges for period 2022-07 have been generated" in result.output
+
+
+def test_generate_charges_concurrent_runs(app, agreement, monkeypatch):
+    with app.app_context():
+        due_charges = charges.get_due_charges("2022-06")
+        monkeypatch.setattr(charges, "get_due_charges", lambda *args: due_charges)
+
+        assert charges.generate_charges("2022-06", batch_size=1) == 1
+        assert charges.generate_charges("2022-06", batch_size=1) == 0
+        assert Settlement.query.filter(Settlement.period == "2022-06").count() == 1
+
+
+def test_get_agreement_statement_csv(client, landlord_token, agreement):
+    settlements = [
+        {"type": "charge", "value": 3000, "date": "03-02-2020"},
+        {"type": "payment", "value": 1000, "date": "05-01-2020"},
+        {"type": "payment", "value": 2500, "date": "10-02-2020"},
+    ]
+    for settlement in settlements:
+        client.post(
+            "/api/v1/agreements/1/settlements",
+            json=settlement,
+            headers={"Authorization": f"Bearer {landlord_token}"},
+        )
+
+    response = client.get(
+        "/api/v1/agreements/1/statement.csv",
+        headers={"Authorization": f"Bearer {landlord_token}"},
+    )
+    rows = list(csv.reader(io.StringIO(response.get_data(as_text=True))))
+
+    assert response.status_code == 200
+    assert response.headers["Content-Type"].startswith("text/csv")
+    assert rows == [
+        ["agreement", "date", "type", "description", "charge", "payment", "balance"],
+        ["testagreement", "05-01-2020", "payment", "", "", "1000.0", "1000.0"],
+        ["testagreement", "03-02-2020", "charge", "", "3000.0", "", "-2000.0"],
+        ["testagreement", "10-02-2020", "payment", "", "", "2500.0", "500.0"],
+    ]
+
+
+def test_get_agreement_statement_file_name(
+    client, landlord_token, flat, tenant, agreement_data
+):
+    agreement_data["identifier"] = 'Umowa "Łódź" 1/2020'
+    client.post(
+        "/api/v1/flats/1/tenants/1/agreements",
+        json=agreement_data,
+        headers={"Authorization": f"Bearer {landlord_token}"},
+    )
+
+    response = client.get(
+        "/api/v1/agreements/1/statement.csv",
+        headers={"Authorization": f"Bearer {landlord_token}"},
+    )
+
+    assert response.status_code == 200
+    assert response.headers["Content-Disposition"] == (
+        'attachment; filename="statement_Umowa_odz_1_2020.csv"; '
+        "filename*=UTF-8''statement_Umowa%20%22%C5%81%C3%B3d%C5%BA%22%201%2F2020.csv"
+    )
+
+
+def test_get_agreement_statement_other_tenant(client, agreement, tenant2_token):
+    response = client.get(
+        "/api/v1/agreements/1/statement.csv",
+        headers={"Authorization": f"Bearer {tenant2_token}"},
+    )
+    response_data = response.get_json()
+
+    assert response.status_code == 404
+    assert response_data["success"] is False
+    assert response_data["message"] == "Agreement 1 not found"
+
+
+def test_export_settlements_xlsx(client, landlord_token, agreement):
+    client.post(
+        "/api/v1/agreements/1/settlements",
+        json={"type": "charge", "value": 3000, "date": "03-02-2020"},
+        headers={"Authorization": f"Bearer {landlord_token}"},
+    )
+
+    response = client.get(
+        "/api/v1/settlements/export?format=xlsx&from=01-01-2020",
+        headers={"Authorization": f"Bearer {landlord_token}"},
+    )
+
+    assert response.status_code == 200
+    with zipfile.ZipFile(io.BytesIO(response.get_data())) as xlsx:
+        assert xlsx.testzip() is None
+        sheet = xlsx.read("xl/worksheets/sheet1.xml").decode()
+    assert sheet.count("<row>") == 2
+    assert "<t>testagreement</t>" in sheet
+    assert "<c><v>-3000.0</v></c>" in sheet
+
+
+def test_create_settlements_bulk(client, landlord_token, agreement):
+    settlements = [
+        {"type": "charge", "value": 3000, "date": "03-02-2020"},
+        {"type": "refund", "value": 100, "date": "04-02-2020"},
+        {"type": "payment", "value": 3000, "date": "05-02-2020"},
+    ]
+    response = client.post(
+        "/api/v1/agreements/1/settlements/bulk",
+        json=settlements,
+        headers={"Authorization": f"Bearer {landlord_token}"},
+    )
+    response_data = response.get_json()
+
+    assert response.status_code == 201
+    assert response_data["data"]["number_of_records"] == 2
+    assert list(response_data["data"]["errors"]) == ["1"]
+
+    response = client.get(
+        "/api/v1/agreements/1/settlements",
+        headers={"Authorization": f"Bearer {landlord_token}"},
+    )
+
+    assert response.get_json()["number_of_records"] == 2
+
+
+def test_delete_agreement_settlements(client, landlord_token, agreement):
+    client.post(
+        "/api/v1/agreements/1/settlements/bulk",
+        json=[
+            {"type": "charge", "value": 3000, "date": "03-02-2020"},
+            {"type": "payment", "value": 3000, "date": "05-02-2020"},
+        ],
+        headers={"Authorization": f"Bearer {landlord_token}"},
+    )
+
+    response = client.delete(
+        "/api/v1/agreements/1/settlements",
+        headers={"Authorization": f"Bearer {landlord_token}"},
+    )
+    response_data = response.get_json()
+
+    assert response.status_code == 200
+    assert response_data["success"] is True
+    assert response_data["deleted"] == {"settlements": 2}
+
+    response = client.get(
+        "/api/v1/agreements/1/settlements",
+        headers={"Authorization": f"Bearer {landlord_token}"},
+    )
+
+    assert response.get_json()["number_of_records"] == 0
+
+
+def test_update_settlement_no_reload_after_commit(
+    app, client, landlord_token, agreement
+):
+    client.post(
+        "/api/v1/agreements/1/settlements",
+        json={"type": "charge", "value": 3000, "date": "03-02-2020"},
+        headers={"Authorization": f"Bearer {landlord_token}"},
+    )
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    with app.app_context():
+        engine = db.engine
+    event.listen(engine, "before_cursor_execute", before_cursor_execute)
+    response = client.put(
+        "/api/v1/settlements/1",
+        json={"type": "charge", "value": 3100, "date": "03-02-2020"},
+        headers={"Authorization": f"Bearer {landlord_token}"},
+    )
+    event.remove(engine, "before_cursor_execute", before_cursor_execute)
+    response_data = response.get_json()
+
+    assert response.status_code == 200
+    assert response_data["data"]["value"] == 3100
+    assert response_data["data"]["agreement"]["identifier"] == agreement["identifier"]
+    assert statements[-1].startswith("UPDATE settlements")
+
+
+def test_create_settlement_idempotency_key(client, landlord_token, agreement):
+    headers = {
+        "Authorization": f"Bearer {landlord_token}",
+        "Idempotency-Key": "c1b2a3d4-settlement",
+    }
+    data = {"type": "payment", "value": 3000, "date": "05-02-2020"}
+    response = client.post(
+        "/api/v1/agreements/1/settlements", json=data, headers=headers
+    )
+
+    assert response.status_code == 201
+    assert "Idempotent-Replayed" not in response.headers
+
+    replayed = client.post(
+        "/api/v1/agreements/1/settlements", json=data, headers=headers
+    )
+
+    assert replayed.status_code == 201
+    assert replayed.headers["Idempotent-Replayed"] == "true"
+    assert replayed.headers["Location"] == response.headers["Location"]
+    assert replayed.get_json() == response.get_json()
+    assert Settlement.query.count() == 1
+
+    data["value"] = 2000
+    response = client.post(
+        "/api/v1/agreements/1/settlements", json=data, headers=headers
+    )
+
+    assert response.status_code == 400
+    assert Settlement.query.count() == 1
+
+
+def test_create_settlement_idempotency_key_failed_request(
+    client, landlord_token, agreement
+):
+    headers = {
+        "Authorization": f"Bearer {landlord_token}",
+        "Idempotency-Key": "c1b2a3d4-failed",
+    }
+    data = {"type": "payment", "value": 3000, "date": "05-02-2020"}
+    response = client.post(
+        "/api/v1/agreements/2/settlements", json=data, headers=headers
+    )
+
+    assert response.status_code == 404
+    assert IdempotencyKey.query.count() == 0
+
+
+def test_clean_idempotency_keys_command(app, client, landlord_token, agreement):
+    client.post(
+        "/api/v1/agreements/1/settlements",
+        json={"type": "payment", "value": 3000, "date": "05-02-2020"},
+        headers={
+            "Authorization": f"Bearer {landlord_token}",
+            "Idempotency-Key": "c1b2a3d4-expired",
+        },
+    )
+    app.config["IDEMPOTENCY_KEY_TTL"] = -1
+
+    result = app.test_cli_runner().invoke(clean_idempotency_keys)
+
+    assert "1 expired idempotency keys have been removed" in result.output
+    assert IdempotencyKey.query.count() == 0
+
+
+def test_create_settlement_group_commit(app, client, landlord_token, agreement):
+    app.config["SETTLEMENT_GROUP_COMMIT"] = True
+    response = client.post(
+        "/api/v1/agreements/1/settlements",
+        json={"type": "payment", "value": 3000, "date": "05-02-2020"},
+        headers={"Authorization": f"Bearer {landlord_token}"},
+    )
+    response_data = response.get_json()
+
+    assert response.status_code == 201
+    assert response.headers["Location"].endswith("/api/v1/settlements/1")
+    assert response_data["data"]["value"] == 3000
+    assert response_data["data"]["agreement"]["id"] == 1
+    assert Settlement.query.count() == 1
+
+
+def test_group_commit_flush_invalid_settlement(app, agreement):
+    batch = [
+        PendingSettlement({"agreement_id": 1, "type": "payment", "value": 1}),
+        PendingSettlement({"agreement_id": 1, "type": "payment", "value": None}),
+    ]
+    with app.app_context():
+        SettlementGroupCommitter.flush(batch)
+
+        assert batch[0].settlement.id == 1
+        assert batch[1].settlement is None
+        assert batch[1].error is not None
+        assert all(pending.done.is_set() for pending in batch)
+        assert Settlement.query.count() == 1
+
+
+def test_benchmark_settlements_command(app, client, landlord_token, agreement):
+    result = app.test_cli_runner().invoke(
+        benchmark_settlements, ["--agreement-id", "1", "--count", "20"]
+    )
+
+    assert "commit per request: 20 settlements" in result.output
+    assert "group-commit: 20 settlements" in result.output
+    assert Settlement.query.count() == 0
+
+
+def test_benchmark_settlements_command_error(app, monkeypatch):
+    def post_settlements(agreement_id, count, threads):
+        raise RuntimeError("database is down")
+
+    monkeypatch.setattr(db_manage_commnands, "_post_settlements", post_settlements)
+    result = app.test_cli_runner().invoke(
+        benchmark_settlements, ["--agreement-id", "1", "--count", "20"]
+    )
+
+    assert "Unexpected error: database is down" in result.output
+    assert app.config["SETTLEMENT_GROUP_COMMIT"] is False
+
+
+def test_generate(app, client):
+    runner = app.test_cli_runner()
+    result = runner.invoke(
+        generate,
+        ["--landlords", "3", "--flats-per-landlord", "4", "--months", "30"],
+    )
+
+    assert "3 rows have been added to landlords" in result.output
+    assert "12 rows have been added to flats" in result.output
+
+    with app.app_context():
+        agreements = Agreement.query.order_by(Agreement.flat_id, Agreement.date_from)
+        previous = None
+        for agreement in agreements:
+            if previous is not None and previous.flat_id == agreement.flat_id:
+                assert previous.date_to < agreement.date_from
+            previous = agreement
+        number_of_charges = Settlement.query.filter(Settlement.type == "charge").count()
+        months = sum(
+            (a.date_to.year - a.date_from.year) * 12
+            + a.date_to.month
+            - a.date_from.month
+            + 1
+            for a in agreements
+        )
+
+    assert number_of_charges == months
+    response = client.post(
+        "/api/v1/landlords/login",
+        json={"identifier": "landlord1", "password": "password"},
+    )
+    assert response.status_code == 200
+    response = client.get("/api/v1/flats?page=2")
+    assert response.get_json()["pagination"]["total_pages"] == 3
+
+
+def test_generate_data_deterministic(app):
+    def generated_settlements():
+        return [
+            (s.type, s.value, s.date, s.period)
+            for s in Settlement.query.order_by(Settlement.id)
+        ]
+
+    with app.app_context():
+        generate_data(2, 2, 12, seed=7)
+        first = generated_settlements()
+        Settlement.query.delete()
+        Agreement.query.delete()
+        db.session.commit()
+        generate_data(2, 2, 12, seed=7)
+        second = generated_settlements()
+
+    assert first
+    assert second == first
+
+
+def test_create_settlement_group_commit_flush_error(
+    app, client, landlord_token, agreement, monkeypatch
+):
+    def flush(batch):
+        raise RuntimeError("rollback failed")
+
+    monkeypatch.setattr(SettlementGroupCommitter, "flush", staticmethod(flush))
+    app.config["SETTLEMENT_GROUP_COMMIT"] = True
+    with pytest.raises(RuntimeError, match="rollback failed"):
+        client.post(
+            "/api/v1/agreements/1/settlements",
+            json={"type": "payment", "value": 3000, "date": "05-02-2020"},
+            headers={"Authorization": f"Bearer {landlord_token}"},
+        )
+
+    assert app.extensions["settlement_group_commit"].thread.is_alive()
+
+
+def test_create_settlement_group_commit_stopped_thread(
+    app, client, landlord_token, agreement, monkeypatch
+):
+    monkeypatch.setattr(SettlementGroupCommitter, "_run", lambda self: None)
+    monkeypatch.setattr(group_commit, "GROUP_COMMIT_POLL_INTERVAL", 0.01)
+    app.config["SETTLEMENT_GROUP_COMMIT"] = True
+    response = client.post(
+        "/api/v1/agreements/1/settlements",
+        json={"type": "payment", "value": 3000, "date": "05-02-2020"},
+        headers={"Authorization": f"Bearer {landlord_token}"},
+    )
+
+    assert response.status_code == 201
+    assert Settlement.query.count() == 1
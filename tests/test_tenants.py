@@ -430,6 +430,25 @@ def test_update_tenant_data_by_tenant(client, tenant, tenant_token):
     assert response_data["data"]["landlord"]
 
 
+def test_update_tenant_data_by_tenant_return_minimal(client, tenant, tenant_token):
+    updated_tenant = {**tenant, "phone": "updatedtestphone"}
+    del updated_tenant["password"]
+    headers = {"Authorization": f"Bearer {tenant_token}"}
+    response = client.put(
+        f"/api/v1/tenants/1/data",
+        json=updated_tenant,
+        headers={**headers, "Prefer": "return=minimal"},
+    )
+
+    assert response.status_code == 204
+    assert response.headers["Location"].endswith("/api/v1/tenants/me")
+
+    response = client.get(response.headers["Location"], headers=headers)
+
+    assert response.status_code == 200
+    assert response.get_json()["data"]["phone"] == updated_tenant["phone"]
+
+
 def test_update_tenant_data_by_other_tenant(client, tenant, tenant2_token):
     updated_tenant = {
         "address": "updatedtestaddress",
@@ -559,3 +578,32 @@ def test_delete_tenant_by_tenant(client, tenant, tenant_token):
     assert response.headers["Content-Type"] == "application/json"
     assert response_data["success"] is False
     assert response_data["message"] == "Only landlord functionality"
+
+
+def test_create_tenants_bulk(client, landlord_token, tenant):
+    tenants = [
+        dict(tenant, identifier="bulktenant1", email="bulktenant1@wp.pl"),
+        dict(tenant, identifier="bulktenant2"),
+        dict(tenant, identifier="bulktenant3", email="bulktenant3@wp.pl"),
+    ]
+    response = client.post(
+        "/api/v1/tenants/bulk",
+        json=tenants,
+        headers={"Authorization": f"Bearer {landlord_token}"},
+    )
+    response_data = response.get_json()
+
+    assert response.status_code == 201
+    assert response_data["success"] is True
+    assert response_data["data"]["number_of_records"] == 2
+    assert response_data["data"]["errors"] == {
+        "1": {"email": [f"Tenant with email {tenant['email']} already exists"]}
+    }
+
+    response = client.post(
+        "/api/v1/tenants/login",
+        json={"identifier": "bulktenant3", "password": tenant["password"]},
+    )
+
+    assert response.status_code == 200
+    assert response.get_json()["token"]